@@ -7,7 +7,7 @@ class AirtableService:
     def __init__(self):
         self.api_key = Config.AIRTABLE_API_KEY
         self.base_id = Config.AIRTABLE_BASE_ID
-        self.base_url = f"https://api.airtable.com/v0/{self.base_id}"
+        self.base_url = f"{Config.AIRTABLE_API_URL}/{self.base_id}"
         self.headers = {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
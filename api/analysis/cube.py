@@ -0,0 +1,107 @@
+from flask import Blueprint, request, jsonify, session
+from services.analysis_cache import analysis_cache
+from services.analysis_manifest import get_session_uploads
+from services.time_index import parse_date_param
+from api.middleware import license_required
+
+analysis_bp = Blueprint('analysis', __name__)
+
+def _sorted_items(nodes, name_key, extra=None):
+    """Converte un livello del cubo in una lista ordinata per numero di lead"""
+    items = []
+    for name, node in nodes.items():
+        item = {name_key: name, 'numero_lead': node['numero_lead']}
+        if extra:
+            item.update(extra(node))
+        items.append(item)
+    items.sort(key=lambda x: x['numero_lead'], reverse=True)
+    return items
+
+@analysis_bp.route('/cube', methods=['GET'])
+@license_required()
+def drill_down():
+    """Endpoint di drill-down campagna -> contenuto -> termine sull'ultima analisi.
+
+    Parametri opzionali: campaign, content e start, end (YYYY-MM-DD) come in /results,
+    per avere gli stessi totali della pagina filtrata.
+    """
+    try:
+        upload_ids = get_session_uploads(session.get('user_id'), session.get('analysis_id'))
+        
+        if not upload_ids:
+            return jsonify({
+                'success': False,
+                'message': 'Nessuna analisi disponibile. Carica prima un file.'
+            }), 404
+        
+        try:
+            start_ts = parse_date_param(request.args.get('start', ''))
+            end_ts = parse_date_param(request.args.get('end', ''), end_of_day=True)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Parametri non validi'
+            }), 400
+        
+        results = analysis_cache.filter(upload_ids, start_ts, end_ts)
+        
+        if 'error' in results:
+            return jsonify({
+                'success': False,
+                'message': results['error']
+            }), 500
+        
+        cube = results['cube']
+        campaign = request.args.get('campaign')
+        content = request.args.get('content')
+        
+        # Livello 1: totali per campagna
+        if campaign is None:
+            return jsonify({
+                'success': True,
+                'level': 'campaign',
+                'items': _sorted_items(cube, 'utm_campaign',
+                                       lambda node: {'numero_contenuti': len(node['contents'])})
+            }), 200
+        
+        if campaign not in cube:
+            return jsonify({
+                'success': False,
+                'message': 'Campagna non trovata'
+            }), 404
+        
+        contents = cube[campaign]['contents']
+        
+        # Livello 2: totali per contenuto all'interno della campagna
+        if content is None:
+            return jsonify({
+                'success': True,
+                'level': 'content',
+                'utm_campaign': campaign,
+                'numero_lead': cube[campaign]['numero_lead'],
+                'items': _sorted_items(contents, 'utm_content',
+                                       lambda node: {'numero_termini': len(node['terms'])})
+            }), 200
+        
+        if content not in contents:
+            return jsonify({
+                'success': False,
+                'message': 'Contenuto non trovato per questa campagna'
+            }), 404
+        
+        # Livello 3: termini all'interno del contenuto
+        terms = contents[content]['terms']
+        return jsonify({
+            'success': True,
+            'level': 'term',
+            'utm_campaign': campaign,
+            'utm_content': content,
+            'numero_lead': contents[content]['numero_lead'],
+            'items': [{'utm_term': term, 'numero_lead': count} for term, count in terms.most_common()]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Errore interno del server: {str(e)}'
+        }), 500
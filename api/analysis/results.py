@@ -0,0 +1,163 @@
+from collections import Counter
+from flask import request, jsonify, session, Response
+from services.analysis_cache import analysis_cache, analysis_etag
+from services.analysis_manifest import load_manifest
+from services.ad_spend import add_cost_columns, load_spend
+from services.time_index import parse_date_param, format_timestamp
+from api.analysis.cube import analysis_bp
+from api.middleware import license_required
+
+SORT_FIELDS = ('numero_lead', 'utm_term', 'nome_inserzione', 'utm_campaign', 'posizione', 'spesa', 'cpl', 'ctr')
+# Campi numerici (con l'export della spesa: vuoti per le inserzioni senza spesa)
+NUMERIC_FIELDS = ('numero_lead', 'posizione', 'spesa', 'cpl', 'ctr')
+# Parametro della query -> campo filtrato per sottostringa
+FILTERS = {'term': 'utm_term', 'content': 'nome_inserzione', 'campaign': 'utm_campaign'}
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+# Da incrementare quando cambia il formato della risposta, per invalidare gli ETag già emessi
+RESPONSE_VERSION = 3
+
+def _term_campaigns(entry):
+    """Campagna con più lead per ogni utm_term, calcolata una volta dal cubo dell'analisi"""
+    mapping = entry.get('term_campaigns')
+    if mapping is None:
+        totals = Counter()
+        for campaign, campaign_node in entry['cube'].items():
+            for content_node in campaign_node['contents'].values():
+                for term, count in content_node['terms'].items():
+                    totals[(term, campaign)] += count
+        mapping = {}
+        for (term, campaign), _ in totals.most_common():
+            mapping.setdefault(term, campaign)
+        entry['term_campaigns'] = mapping
+    return mapping
+
+def _build_rows(entry, results):
+    """Righe per inserzione con posizione (per numero di lead), campagna e percentuale sul totale"""
+    campaigns = _term_campaigns(entry)
+    total = results['rows_with_utm_term']
+    ordered = sorted(results['results_df'], key=lambda x: (-x['numero_lead'], x['utm_term']))
+    return [{
+        'posizione': position,
+        'utm_term': item['utm_term'],
+        'nome_inserzione': item['nome_inserzione'],
+        'utm_campaign': campaigns.get(item['utm_term'], ''),
+        'numero_lead': item['numero_lead'],
+        'percentuale': round(item['numero_lead'] / total * 100, 2) if total else 0
+    } for position, item in enumerate(ordered, start=1)]
+
+def _sort_key(field):
+    if field in NUMERIC_FIELDS:
+        return lambda row: row[field] or 0
+    return lambda row: (row[field] or '').lower()
+
+@analysis_bp.route('/results', methods=['GET'])
+@license_required()
+def analysis_results():
+    """Risultati di un'analisi in JSON: statistiche e inserzioni paginate, ordinabili e filtrabili.
+
+    Parametri: analysis (default: analisi della sessione), start/end (AAAA-MM-GG), page, per_page,
+    sort, order (asc/desc), term, content, campaign (filtri per sottostringa).
+    Se con l'analisi è stato caricato l'export della spesa, le righe hanno anche spesa, impression,
+    clic, cpl e ctr.
+    """
+    try:
+        manifest = load_manifest(session.get('user_id'), request.args.get('analysis') or session.get('analysis_id'))
+        upload_ids = [item['upload_id'] for item in manifest['files']] if manifest else []
+        spend = manifest.get('spend') if manifest else None
+
+        if not upload_ids:
+            return jsonify({
+                'success': False,
+                'message': 'Nessuna analisi disponibile. Carica prima un file.'
+            }), 404
+
+        start = request.args.get('start', '')
+        end = request.args.get('end', '')
+        sort = request.args.get('sort', 'numero_lead')
+        order = request.args.get('order', 'desc' if sort == 'numero_lead' else 'asc')
+        try:
+            page = max(1, int(request.args.get('page', 1)))
+            per_page = min(MAX_PER_PAGE, max(1, int(request.args.get('per_page', DEFAULT_PER_PAGE))))
+            start_ts = parse_date_param(start)
+            end_ts = parse_date_param(end, end_of_day=True)
+            if sort not in SORT_FIELDS or order not in ('asc', 'desc'):
+                raise ValueError(sort)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Parametri non validi'
+            }), 400
+        filters = {field: request.args.get(param, '').strip().lower() for param, field in FILTERS.items()}
+
+        # L'analisi non cambia per gli stessi file: l'ETag si calcola senza elaborare la risposta
+        etag = analysis_etag(upload_ids, RESPONSE_VERSION, start, end, sort, order, page, per_page,
+                             *filters.values(), spend['upload_id'] if spend else '')
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        entry = analysis_cache.get(upload_ids)
+
+        if 'error' in entry:
+            return jsonify({
+                'success': False,
+                'message': entry['error']
+            }), 500
+
+        results = entry if start_ts is None and end_ts is None else entry['time_index'].filter(start_ts, end_ts)
+        rows = _build_rows(entry, results)
+        if spend:
+            joined = load_spend(spend['upload_id'], upload_ids, (item['utm_term'] for item in results['results_df']),
+                                start_ts, end_ts)
+            if 'error' in joined:
+                return jsonify({
+                    'success': False,
+                    'message': joined['error']
+                }), 500
+            rows = add_cost_columns(rows, joined)
+        for field, value in filters.items():
+            if value:
+                rows = [row for row in rows if value in (row[field] or '').lower()]
+        rows.sort(key=_sort_key(sort), reverse=order == 'desc')
+        if sort in ('spesa', 'cpl', 'ctr'):
+            # Inserzioni senza spesa in fondo, in entrambi gli ordini
+            rows.sort(key=lambda row: row[sort] is None)
+
+        first_ts, last_ts = entry['time_index'].bounds()
+        total_items = len(rows)
+        offset = (page - 1) * per_page
+        response = jsonify({
+            'success': True,
+            'stats': {
+                'total_leads': results['total_rows'],
+                'leads_with_utm': results['rows_with_utm_term'],
+                'unique_insertions': results['unique_ads']
+            },
+            'date_range': {
+                'start': start,
+                'end': end,
+                'min': format_timestamp(first_ts),
+                'max': format_timestamp(last_ts)
+            },
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total_items': total_items,
+                'total_pages': (total_items + per_page - 1) // per_page
+            },
+            'sort': sort,
+            'order': order,
+            'items': rows[offset:offset + per_page]
+        })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Errore nel recupero dei risultati: {str(e)}'
+        }), 500
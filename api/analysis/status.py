@@ -0,0 +1,26 @@
+from flask import request, jsonify, session
+from services.analysis_manifest import is_pending, load_manifest
+from api.analysis.cube import analysis_bp
+from api.middleware import login_required
+
+@analysis_bp.route('/status', methods=['GET'])
+@login_required
+def analysis_status():
+    """Stato di un'analisi progressiva: pending (in corso), ready o error.
+
+    Interrogato dalla pagina di anteprima; richiede solo il login perché viene chiamato
+    ogni pochi secondi e non restituisce dati dell'analisi.
+    """
+    manifest = load_manifest(session.get('user_id'), request.args.get('analysis') or session.get('analysis_id'))
+    
+    if manifest is None:
+        return jsonify({
+            'success': False,
+            'message': 'Analisi non trovata'
+        }), 404
+    
+    if manifest.get('error'):
+        return jsonify({'success': True, 'status': 'error', 'message': manifest['error']})
+    # Un'analisi interrotta (es. riavvio del worker) viene completata aprendo i risultati
+    status = 'pending' if is_pending(manifest) else 'ready'
+    return jsonify({'success': True, 'status': status})
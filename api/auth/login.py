@@ -39,7 +39,8 @@ def login():
             }), 401
         
         # L'utente è autenticato correttamente
-        # Crea la sessione
+        # Crea la sessione (svuotata prima: con le sessioni sul server riceve un nuovo id)
+        session.clear()
         session['user_id'] = user_data['user_id']
         session['username'] = username
         session['user_role'] = 'user'
@@ -0,0 +1 @@
+# Ingest API Package
@@ -0,0 +1,79 @@
+import json
+from itertools import islice
+from flask import Blueprint, request, jsonify
+from services.lead_ingest import authenticate, get_lead_store, normalize_lead
+from services.metrics import registry, stage
+
+ingest_bp = Blueprint('ingest', __name__)
+
+# Lead scritti per transazione durante la lettura di un batch NDJSON
+BATCH_SIZE = 500
+# Errori riportati al massimo nella risposta
+MAX_REPORTED_ERRORS = 100
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+def _ndjson_leads(stream, errors):
+    """Lead normalizzati di un corpo NDJSON letto riga per riga; le righe non valide finiscono in errors"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield normalize_lead(json.loads(line))
+        except ValueError as e:
+            errors.append({'line': line_number, 'message': str(e)})
+
+@ingest_bp.route('/leads', methods=['POST'])
+def ingest_leads():
+    """Riceve lead dal CRM: un oggetto JSON o un batch NDJSON (un lead per riga).
+
+    Autenticazione con "Authorization: Bearer <token>" (INGEST_TOKENS); ogni lead richiede
+    SORGENTE e può avere Email, Data/Ora o timestamp ISO 8601 e un id per ignorare i reinvii.
+    """
+    user_id = authenticate(request.headers.get('Authorization'))
+    if user_id is None:
+        return jsonify({
+            'success': False,
+            'message': 'Token di ingestione non valido'
+        }), 401
+    
+    try:
+        store = get_lead_store()
+        errors = []
+        accepted = duplicates = 0
+        with stage('ingest'):
+            if request.mimetype in NDJSON_MIMETYPES:
+                leads = _ndjson_leads(request.stream, errors)
+                while True:
+                    batch = list(islice(leads, BATCH_SIZE))
+                    if not batch:
+                        break
+                    inserted, skipped = store.append(user_id, batch)
+                    accepted += inserted
+                    duplicates += skipped
+            else:
+                try:
+                    lead = normalize_lead(request.get_json(force=True, silent=False))
+                except Exception as e:
+                    errors.append({'line': 1, 'message': str(e) if isinstance(e, ValueError) else 'JSON non valido'})
+                else:
+                    accepted, duplicates = store.append(user_id, [lead])
+        
+        registry.inc('ingest_leads_total', accepted, result='accepted')
+        registry.inc('ingest_leads_total', duplicates, result='duplicate')
+        registry.inc('ingest_leads_total', len(errors), result='rejected')
+        
+        status = 400 if errors and not accepted and not duplicates else 200
+        return jsonify({
+            'success': status == 200,
+            'accepted': accepted,
+            'duplicates': duplicates,
+            'rejected': len(errors),
+            'errors': errors[:MAX_REPORTED_ERRORS]
+        }), status
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Errore durante la ricezione dei lead: {str(e)}'
+        }), 500
@@ -65,7 +65,7 @@ def list_user_licenses():
         # Ottieni tutte le licenze dell'utente
         try:
             import requests
-            url = f"https://api.airtable.com/v0/{Config.AIRTABLE_BASE_ID}/Licenze"
+            url = f"{Config.AIRTABLE_API_URL}/{Config.AIRTABLE_BASE_ID}/Licenze"
             headers = {
                 'Authorization': f'Bearer {Config.AIRTABLE_API_KEY}',
                 'Content-Type': 'application/json'
@@ -1,6 +1,7 @@
 from functools import wraps
 from flask import session, request, jsonify, redirect, url_for
 from services.airtable_service import AirtableService
+from services.metrics import stage
 from config import Config
 
 def login_required(f):
@@ -38,10 +39,11 @@ def license_required(app_name=None):
             airtable_service = AirtableService()
             app_to_check = app_name or Config.APP_NAME
             
-            license_result = airtable_service.verify_license(
-                session['user_id'], 
-                app_to_check
-            )
+            with stage('license'):
+                license_result = airtable_service.verify_license(
+                    session['user_id'], 
+                    app_to_check
+                )
             
             if not license_result['success']:
                 if request.is_json:
@@ -80,8 +82,11 @@ def check_session_timeout():
                 session.clear()
                 return False
         
-        # Aggiorna l'ultimo accesso
-        session['last_activity'] = datetime.now().isoformat()
+        # Aggiorna l'ultimo accesso solo ogni SESSION_ACTIVITY_INTERVAL secondi: la sessione
+        # (cookie o record sul server) non viene riscritta a ogni richiesta
+        now = datetime.now()
+        if not last_activity or now - last_activity >= timedelta(seconds=Config.SESSION_ACTIVITY_INTERVAL):
+            session['last_activity'] = now.isoformat()
         return True
     
     return False
@@ -16,8 +16,12 @@ def get_profile():
         # Inizializza il servizio Airtable
         airtable_service = AirtableService()
         
-        # Ottieni il profilo utente
-        profile_data = airtable_service.get_user_profile(user_id)
+        # Profilo e preferenze sono indipendenti: si leggono in parallelo
+        results = airtable_service.fetch_many({
+            'profile': lambda: airtable_service.get_user_profile(user_id),
+            'preferences': lambda: airtable_service.get_user_preferences(user_id)
+        })
+        profile_data = results['profile']
         
         if not profile_data:
             return jsonify({
@@ -25,8 +29,7 @@ def get_profile():
                 'message': 'Profilo utente non trovato'
             }), 404
         
-        # Ottieni le preferenze utente
-        preferences = airtable_service.get_user_preferences(user_id) or {}
+        preferences = results['preferences'] or {}
         
         # Logging rimosso
         
@@ -83,7 +86,7 @@ def update_profile():
             import requests
             from config import Config
             
-            url = f"https://api.airtable.com/v0/{Config.AIRTABLE_BASE_ID}/Utenti/{user_id}"
+            url = f"{Config.AIRTABLE_API_URL}/{Config.AIRTABLE_BASE_ID}/Utenti/{user_id}"
             headers = {
                 'Authorization': f'Bearer {Config.AIRTABLE_API_KEY}',
                 'Content-Type': 'application/json'
@@ -200,9 +203,9 @@ def update_preferences():
         # Converti i dati nel formato atteso dal servizio
         preferences_data = {}
         if 'theme' in data:
-            preferences_data['theme'] = data['theme']
+            preferences_data['tema_interfaccia'] = data['theme']
         if 'json_prefs' in data:
-            preferences_data['json_prefs'] = data['json_prefs']
+            preferences_data['json_pref'] = data['json_prefs']
         
         success = airtable_service.update_user_preferences(user_id, preferences_data)
         
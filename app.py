@@ -1,259 +1,191 @@
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, jsonify, session
-import csv
+from flask import Flask, render_template, request, send_file, flash, redirect, url_for, jsonify, session, g, Response, abort
 import os
-from urllib.parse import urlparse, parse_qs
-from collections import Counter
+import time
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from datetime import datetime
-import json
-from dotenv import load_dotenv
 
-# Carica le variabili d'ambiente (solo se il file .env esiste)
-try:
-    load_dotenv()
-except Exception:
-    # Su Vercel le variabili d'ambiente sono già disponibili
-    pass
-
-# Importa configurazione e servizi
+# Importa configurazione e servizi (config carica anche il file .env, se presente).
+# I moduli pesanti (requests, analisi CSV, pool di processi) sono importati al primo utilizzo.
 from config import Config
-from services.airtable_service import AirtableService
+from services.analysis_cache import analysis_cache, analysis_etag, get_upload_folder
+from services.analysis_manifest import (complete_manifest, create_manifest, is_pending, list_manifests,
+                                       load_manifest, retention)
+from services.storage import get_storage, save_upload
+from services.analysis_summary import compare_summaries
+from services.exports import EXPORT_VERSION, EXPORTS, export_cache
+from services.ad_spend import add_cost_columns, load_spend, spend_summary
+from services.lead_ingest import get_lead_store
+from services.assets import AssetManifest, DIST_FOLDER, ENCODINGS, IMMUTABLE_MAX_AGE, guess_mimetype, negotiate_encoding
+from services.time_index import parse_date_param, format_timestamp
+from services import metrics, progressive
+from services.profiler import SamplingProfiler
+from services.session_store import create_session_interface
 from api.middleware import login_required, license_required, check_session_timeout
 
 # Importa le API routes
 from api.auth.login import auth_bp
 from api.licenses.verify import licenses_bp
 from api.users.profile import users_bp
+from api.analysis.cube import analysis_bp
+from api.ingest.leads import ingest_bp
+import api.analysis.results  # registra /api/analysis/results su analysis_bp
+import api.analysis.status  # registra /api/analysis/status su analysis_bp
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Sessioni sul server (SESSION_BACKEND=memory/sqlite): il cookie contiene solo l'id della sessione
+session_interface = create_session_interface(Config.SESSION_BACKEND, Config.SESSION_TIMEOUT,
+                                             Config.SESSION_SQLITE_PATH, Config.SESSION_MAX_ENTRIES)
+if session_interface is not None:
+    app.session_interface = session_interface
+
 # Registra i blueprint delle API
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(licenses_bp, url_prefix='/api/licenses')
 app.register_blueprint(users_bp, url_prefix='/api/users')
+app.register_blueprint(analysis_bp, url_prefix='/api/analysis')
+app.register_blueprint(ingest_bp, url_prefix='/api/ingest')
 
-# Crea la cartella uploads se non esiste (solo in ambiente locale)
-try:
-    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-        os.makedirs(app.config['UPLOAD_FOLDER'])
-except (OSError, PermissionError):
-    # Su Vercel usa /tmp per i file temporanei
-    app.config['UPLOAD_FOLDER'] = '/tmp'
+# Percorso assoluto: send_file risolve i percorsi relativi rispetto alla cartella dell'app, non alla cwd.
+# La cartella viene creata al primo utilizzo (get_upload_folder), non all'avvio
+app.config['UPLOAD_FOLDER'] = os.path.abspath(app.config['UPLOAD_FOLDER'])
 
-def extract_utm_term_from_url(url):
-    """Estrae il valore utm_term da un URL"""
-    if pd.isna(url) or not isinstance(url, str):
-        return None
-    
+def get_date_range():
+    """Legge l'intervallo di date (start/end in formato YYYY-MM-DD) dalla query string"""
+    start = request.args.get('start', '')
+    end = request.args.get('end', '')
     try:
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        utm_term = query_params.get('utm_term', [None])[0]
-        return utm_term
-    except:
-        return None
+        return start, end, parse_date_param(start), parse_date_param(end, end_of_day=True)
+    except ValueError:
+        flash('Intervallo di date non valido, usa il formato AAAA-MM-GG')
+        return '', '', None, None
 
-def extract_campaign_name_from_url(url):
-    """Estrae il nome della campagna dall'URL"""
-    if pd.isna(url) or not isinstance(url, str):
-        return None
-    
-    try:
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        utm_campaign = query_params.get('utm_campaign', [None])[0]
-        return utm_campaign
-    except:
+def join_spend(manifest, results, start_ts=None, end_ts=None):
+    """Spesa per inserzione dall'export caricato con l'analisi (None se non c'è)"""
+    spend = manifest.get('spend')
+    if not spend:
         return None
+    upload_ids = [item['upload_id'] for item in manifest['files']]
+    return load_spend(spend['upload_id'], upload_ids, (item['utm_term'] for item in results['results_df']),
+                      start_ts, end_ts)
 
-def extract_content_name_from_url(url):
-    """Estrae il contenuto dell'inserzione dall'URL"""
-    if pd.isna(url) or not isinstance(url, str):
-        return None
+def render_results(results, start='', end='', live=False, joined=None):
+    """Renderizza la pagina dei risultati per un'analisi (eventualmente filtrata per date).
+
+    Con live=True i risultati sono quelli dei lead ricevuti dal webhook (senza export né tabella paginata).
+    joined è l'eventuale join con l'export della spesa, per le colonne di spesa, CPL e CTR.
+    """
+    top_insertions_list = sorted(results['results_df'], key=lambda x: x['numero_lead'], reverse=True)
+    spend = None
+    if joined is not None and 'error' in joined:
+        spend = {'error': joined['error']}
+    elif joined is not None:
+        top_insertions_list = add_cost_columns(top_insertions_list, joined)
+        spend = spend_summary(top_insertions_list, joined)
+    first_ts, last_ts = results['bounds'] if live else results['time_index'].bounds()
     
-    try:
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        utm_content = query_params.get('utm_content', [None])[0]
-        return utm_content
-    except:
-        return None
+    session_data = {
+        'top_insertions': top_insertions_list,
+        'stats': {
+            'total_leads': results['total_rows'],
+            'leads_with_utm': results['rows_with_utm_term'],
+            'unique_insertions': results['unique_ads']
+        },
+        'chart_data': {
+            'labels': [ins['nome_inserzione'] for ins in top_insertions_list[:10]],
+            'data': [ins['numero_lead'] for ins in top_insertions_list[:10]]
+        },
+        'date_range': {
+            'start': start,
+            'end': end,
+            'min': format_timestamp(first_ts),
+            'max': format_timestamp(last_ts)
+        },
+        'timestamp': datetime.now().strftime('%d/%m/%Y alle %H:%M'),
+        'live': live,
+        'spend': spend,
+        'results_url': url_for('live_page' if live else 'results_page')
+    }
+    
+    with metrics.stage('render'):
+        return render_template('results.html', **session_data)
 
-def process_csv_file(file_path):
-    """Processa il file CSV e restituisce i risultati"""
-    try:
-        # Leggi il file CSV
-        rows = []
-        with open(file_path, 'r', encoding='utf-8-sig', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                rows.append(row)
-        
-        # Filtra solo le righe che hanno una SORGENTE (URL) con utm_term
-        rows_with_url = []
-        for row in rows:
-            sorgente = row.get('SORGENTE', '')
-            if sorgente and 'utm_term' in sorgente:
-                rows_with_url.append(row)
-        
-        # Estrai i parametri UTM
-        rows_with_utm_term = []
-        for row in rows_with_url:
-            utm_term = extract_utm_term_from_url(row.get('SORGENTE', ''))
-            utm_campaign = extract_campaign_name_from_url(row.get('SORGENTE', ''))
-            utm_content = extract_content_name_from_url(row.get('SORGENTE', ''))
-            
-            if utm_term:
-                row['utm_term_extracted'] = utm_term
-                row['utm_campaign_extracted'] = utm_campaign
-                row['utm_content_extracted'] = utm_content
-                rows_with_utm_term.append(row)
-        
-        # Analizza i valori utm_term più frequenti
-        utm_term_counts = Counter([row['utm_term_extracted'] for row in rows_with_utm_term])
-        
-        # Crea un mapping utm_term -> nome inserzione basato su utm_content
-        utm_term_to_content = {}
-        
-        for utm_term in utm_term_counts.keys():
-            if utm_term:
-                content_list = [row['utm_content_extracted'] for row in rows_with_utm_term 
-                               if row['utm_term_extracted'] == utm_term and row.get('utm_content_extracted')]
-                if content_list:
-                    content_counts = Counter(content_list)
-                    most_common_content = content_counts.most_common(1)[0][0]
-                    utm_term_to_content[utm_term] = most_common_content
-        
-        # Prepara i risultati
-        results = []
-        for utm_term, content in utm_term_to_content.items():
-            count = utm_term_counts[utm_term]
-            results.append({
-                'utm_term': utm_term,
-                'nome_inserzione': content,
-                'numero_lead': count
-            })
-        
-        # Ordina per numero di lead
-        results.sort(key=lambda x: x['numero_lead'], reverse=True)
-        
-        # Prepara i dati dettagliati
-        detailed_results = []
-        for row in rows_with_utm_term:
-            detailed_results.append({
-                'Data': row.get('Data', ''),
-                'Ora': row.get('Ora', ''),
-                'Email': row.get('Email', ''),
-                'UTM_Term': row.get('utm_term_extracted', ''),
-                'Campagna': row.get('utm_campaign_extracted', ''),
-                'Nome_Inserzione': row.get('utm_content_extracted', '')
-            })
-        
-        return {
-            'success': True,
-            'total_rows': len(rows),
-            'rows_with_utm_term': len(rows_with_utm_term),
-            'unique_ads': len(results),
-            'results_df': results,
-            'detailed_df': detailed_results,
-            'top_utm_terms': utm_term_counts.most_common(10)
-        }
-        
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
+def render_preview(manifest):
+    """Renderizza l'anteprima stimata di un'analisi progressiva ancora in corso"""
+    with metrics.stage('render'):
+        return render_template('preview.html', manifest=manifest, preview=manifest['preview'])
 
-def process_csv(file_path):
-    """Processa il file CSV e restituisce i risultati dell'analisi"""
-    try:
-        # Leggi il CSV
-        rows = []
-        with open(file_path, 'r', encoding='utf-8-sig', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            fieldnames = reader.fieldnames
-            for row in reader:
-                rows.append(row)
-        
-        # Verifica che esista la colonna SORGENTE
-        if 'SORGENTE' not in fieldnames:
-            return {'error': 'Il file deve contenere una colonna "SORGENTE"'}
-        
-        # Estrai utm_term, utm_campaign e utm_content dagli URL
-        utm_data = []
-        for row in rows:
-            url = str(row.get('SORGENTE', ''))
-            if 'utm_term=' in url:
-                try:
-                    parsed_url = urlparse(url)
-                    query_params = parse_qs(parsed_url.query)
-                    
-                    utm_term = query_params.get('utm_term', [''])[0]
-                    utm_campaign = query_params.get('utm_campaign', [''])[0]
-                    utm_content = query_params.get('utm_content', [''])[0]
-                    
-                    if utm_term:
-                        utm_data.append({
-                            'utm_term': utm_term,
-                            'utm_campaign': utm_campaign,
-                            'utm_content': utm_content,
-                            'data': row.get('Data', ''),
-                            'ora': row.get('Ora', ''),
-                            'email': row.get('Email', '')
-                        })
-                except Exception as e:
-                    continue
-        
-        if not utm_data:
-            return {'error': 'Nessun URL con utm_term trovato nel file'}
-        
-        # Conta le occorrenze di ogni utm_term
-        utm_term_counts = Counter([item['utm_term'] for item in utm_data])
-        
-        # Mappa utm_term a nome inserzione usando utm_content
-        utm_mapping = {}
-        for utm_term in utm_term_counts.keys():
-            # Trova il utm_content più frequente per questo utm_term
-            content_for_term = [item['utm_content'] for item in utm_data if item['utm_term'] == utm_term and item['utm_content']]
-            if content_for_term:
-                content_counts = Counter(content_for_term)
-                most_common_content = content_counts.most_common(1)[0][0]
-                nome_inserzione = most_common_content if most_common_content else utm_term
-            else:
-                nome_inserzione = utm_term
-            utm_mapping[utm_term] = nome_inserzione
-        
-        # Crea i risultati
-        results_data = []
-        for utm_term, count in utm_term_counts.items():
-            results_data.append({
-                'utm_term': utm_term,
-                'nome_inserzione': utm_mapping[utm_term],
-                'numero_lead': count
-            })
-        
-        # Aggiungi nome inserzione ai dati dettagliati
-        for item in utm_data:
-            item['nome_inserzione'] = utm_mapping[item['utm_term']]
-        
-        return {
-            'results_df': results_data,
-            'detailed_df': utm_data,
-            'total_rows': len(rows),
-            'rows_with_utm_term': len(utm_data),
-            'unique_ads': len(utm_term_counts)
-        }
-        
-    except Exception as e:
-        return {'error': f'Errore nel processare il file: {str(e)}'}
+profiler = SamplingProfiler(
+    app.config['PROFILE_DIR'],
+    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+    slow_threshold=app.config['PROFILE_SLOW_THRESHOLD'],
+    interval=app.config['PROFILE_INTERVAL_MS'] / 1000,
+    max_files=app.config['PROFILE_MAX_FILES'],
+    max_bytes=app.config['PROFILE_MAX_BYTES']
+)
+
+# Asset statici con fingerprint generati da build_assets.py (static/dist/manifest.json)
+assets = AssetManifest(app.static_folder)
+
+@app.template_global()
+def asset_url(name):
+    """URL di un asset di static/: versione con fingerprint se generata, altrimenti originale o CDN"""
+    location = assets.resolve(name)
+    return location['url'] or url_for('static', filename=location['filename'])
+
+@app.route('/static/dist/<path:filename>')
+def static_dist(filename):
+    """Asset con fingerprint: cache immutabile e versioni precompresse (.br/.gz) se accettate"""
+    path = safe_join(os.path.join(app.static_folder, DIST_FOLDER), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    encoding = negotiate_encoding(path, request.accept_encodings)
+    response = send_file(path + dict(ENCODINGS)[encoding] if encoding else path,
+                         mimetype=guess_mimetype(filename),
+                         max_age=IMMUTABLE_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Misura dei tempi per fase (header Server-Timing e istogrammi di /metrics)
+@app.before_request
+def start_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+    profiler.start_request(path=request.path, method=request.method,
+                           content_length=request.content_length or 0)
+
+@app.teardown_request
+def finish_profiling(exc):
+    if exc is not None:
+        profiler.annotate(error=str(exc))
+    profiler.finish_request()
+
+@app.after_request
+def add_server_timing(response):
+    started = g.pop('request_started', None)
+    timings = metrics.finish_request()
+    if started is not None:
+        total = time.perf_counter() - started
+        metrics.registry.observe('http_request_duration_seconds', total,
+                                 endpoint=request.endpoint or 'none', method=request.method,
+                                 status=response.status_code)
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings, total)
+    profiler.annotate(status=response.status_code, timings=timings)
+    return response
 
 # Middleware per controllare la sessione su ogni richiesta
 @app.before_request
 def before_request():
     # Escludi le route che non richiedono autenticazione
-    excluded_routes = ['/login', '/license-error', '/api/auth/login', '/api/auth/check-session', '/static']
+    # /api/ingest è chiamato dal CRM e si autentica con un token
+    excluded_routes = ['/login', '/license-error', '/api/auth/login', '/api/auth/check-session', '/static', '/metrics',
+                       '/api/ingest']
     
     if request.endpoint and any(request.path.startswith(route) for route in excluded_routes):
         return
@@ -306,127 +238,224 @@ def too_large(e):
     flash(f'File troppo grande! La dimensione massima consentita è {max_size_text}.', 'error')
     return redirect(url_for('index'))
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Metriche in formato testo Prometheus (protette da METRICS_TOKEN se impostato)"""
+    token = app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Non autorizzato\n', status=401, mimetype='text/plain')
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/upload', methods=['POST'])
 @license_required()
 def upload_file():
-    if 'file' not in request.files:
-        flash('Nessun file selezionato')
-        return redirect(request.url)
-    
-    file = request.files['file']
-    if file.filename == '':
+    with metrics.stage('receive'):
+        files = [f for f in request.files.getlist('file') if f.filename]
+        # Export facoltativo della spesa da Gestione Inserzioni, per CPL e CTR
+        spend_file = request.files.get('spend')
+        if spend_file is not None and not spend_file.filename:
+            spend_file = None
+    if not files:
         flash('Nessun file selezionato')
         return redirect(request.url)
     
-    # Controllo aggiuntivo della dimensione del file
-    if hasattr(file, 'content_length') and file.content_length > app.config['MAX_CONTENT_LENGTH']:
+    # Controllo aggiuntivo della dimensione dei file
+    if sum(f.content_length or 0 for f in files + ([spend_file] if spend_file else [])) > app.config['MAX_CONTENT_LENGTH']:
         railway_env = os.environ.get('RAILWAY_ENVIRONMENT_NAME') is not None
         max_size_text = '50MB' if railway_env else '4MB'
         flash(f'Il file è troppo grande. La dimensione massima consentita è {max_size_text}.')
         return redirect(request.url)
     
-    if file and file.filename.lower().endswith('.csv'):
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{filename}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
+    if all(f.filename.lower().endswith('.csv') for f in files + ([spend_file] if spend_file else [])):
+        # I file sono salvati nello storage indirizzati per contenuto (sha256): un file già
+        # caricato, anche da un'altra istanza, non viene salvato né analizzato di nuovo
+        upload_folder = get_upload_folder(app.config)
+        uploads = []
+        for file in files:
+            with metrics.stage('save'):
+                upload_id, size = save_upload(get_storage(), file.stream, upload_folder)
+            uploads.append((upload_id, secure_filename(file.filename), size))
+        upload_ids = [upload_id for upload_id, _, _ in uploads]
+        names = [name for _, name, _ in uploads]
+        total_size = sum(size for _, _, size in uploads)
+        spend = None
+        if spend_file is not None:
+            with metrics.stage('save'):
+                spend_id, spend_size = save_upload(get_storage(), spend_file.stream, upload_folder)
+            spend = (spend_id, secure_filename(spend_file.filename), spend_size)
+        
+        # File grandi non ancora analizzati: anteprima stimata da un campione subito,
+        # analisi completa in background (la pagina si aggiorna quando è pronta)
+        if progressive.is_enabled(total_size) and analysis_cache.cached(upload_ids) is None:
+            preview = progressive.build_preview(upload_ids)
+            if preview is not None:
+                manifest = create_manifest(session['user_id'], uploads, None, preview, spend)
+                session['analysis_id'] = manifest['id']
+                progressive.start_full_analysis(session['user_id'], manifest['id'], upload_ids, names)
+                profiler.annotate(file_size=total_size, files=len(uploads), rows=preview['total_rows'])
+                return render_preview(manifest)
         
-        # Processa il file
-        results = process_csv(file_path)
+        # Processa i file in parallelo (il risultato unito resta in cache per filtri e download)
+        results = analysis_cache.get(upload_ids, names)
+        
+        profiler.annotate(file_size=total_size, files=len(uploads), rows=results.get('total_rows'))
         
         if 'error' not in results:
-            # Logging rimosso
-            
-            # Prepara i dati per il template
-            top_insertions_list = results['results_df']
-            
-            session_data = {
-                'top_insertions': top_insertions_list,
-                'stats': {
-                    'total_leads': results['total_rows'],
-                    'leads_with_utm': results['rows_with_utm_term'],
-                    'unique_insertions': results['unique_ads']
-                },
-                'chart_data': {
-                    'labels': json.dumps([ins['nome_inserzione'] for ins in top_insertions_list[:10]]),
-                    'data': json.dumps([ins['numero_lead'] for ins in top_insertions_list[:10]])
-                },
-                'timestamp': datetime.now().strftime('%d/%m/%Y alle %H:%M')
-            }
+            # L'id dell'analisi in sessione permette a risultati e download di ritrovarla direttamente
+            manifest = create_manifest(session['user_id'], uploads, results, spend=spend)
+            session['analysis_id'] = manifest['id']
+            retention.maybe_run()
             
-            return render_template('results.html', **session_data)
+            return render_results(results, joined=join_spend(manifest, results))
         else:
             flash(f'Errore nel processare il file: {results["error"]}')
             return redirect(url_for('index'))
     else:
-        flash('Per favore carica un file CSV valido')
+        flash('Per favore carica solo file CSV validi')
+        return redirect(url_for('index'))
+
+@app.route('/results')
+@license_required()
+def results_page():
+    """Risultati dell'ultima analisi, filtrabili per intervallo di date"""
+    manifest = load_manifest(session.get('user_id'), session.get('analysis_id'))
+    
+    if manifest is None:
+        flash('Nessun file CSV trovato. Carica prima un file.')
+        return redirect(url_for('index'))
+    
+    # Analisi progressiva ancora in corso: si mostra l'anteprima
+    if is_pending(manifest):
+        return render_preview(manifest)
+    if manifest.get('error'):
+        flash(f'Errore nel processare il file: {manifest["error"]}')
+        return redirect(url_for('index'))
+    
+    upload_ids = [item['upload_id'] for item in manifest['files']]
+    start, end, start_ts, end_ts = get_date_range()
+    results = analysis_cache.filter(upload_ids, start_ts, end_ts)
+    
+    if 'error' in results:
+        flash(f'Errore nel processare il file: {results["error"]}')
+        return redirect(url_for('index'))
+    
+    if manifest.get('pending'):
+        # Analisi in background interrotta: completata ora, nella richiesta
+        complete_manifest(session['user_id'], manifest['id'], analysis_cache.get(upload_ids))
+    
+    return render_results(results, start, end, joined=join_spend(manifest, results, start_ts, end_ts))
+
+@app.route('/live')
+@license_required()
+def live_page():
+    """Risultati dei lead ricevuti dal CRM tramite /api/ingest/leads, sempre aggiornati"""
+    start, end, start_ts, end_ts = get_date_range()
+    results = get_lead_store().results(session['user_id'], start_ts, end_ts)
+    
+    if 'error' in results:
+        flash('Nessun lead ricevuto dal CRM. Configura il webhook di ingestione per vederli qui.')
+        return redirect(url_for('index'))
+    
+    return render_results(results, start, end, live=True)
+
+@app.route('/compare')
+@license_required()
+def compare_page():
+    """Confronto tra due analisi dell'utente basato sui riassunti salvati"""
+    available = list_manifests(session['user_id'])
+    
+    if len(available) < 2:
+        flash('Servono almeno due file analizzati per un confronto.')
+        return redirect(url_for('index'))
+    
+    # Di default confronta l'ultima analisi con la precedente
+    current = load_manifest(session['user_id'], request.args.get('current') or available[0]['id'])
+    base = load_manifest(session['user_id'], request.args.get('base') or available[1]['id'])
+    
+    if base is None or current is None:
+        flash('Analisi da confrontare non trovata')
         return redirect(url_for('index'))
+    
+    # Analisi in corso o non riuscite non hanno un riassunto da confrontare
+    if base.get('summary') is None or current.get('summary') is None:
+        flash('Analisi da confrontare non ancora completata o non riuscita')
+        return redirect(url_for('index'))
+    
+    comparison = compare_summaries(base['summary'], current['summary'])
+    
+    return render_template('compare.html',
+                           available=available,
+                           base=base,
+                           current=current,
+                           comparison=comparison)
 
 @app.route('/download/<file_type>')
 @license_required()
 def download_file(file_type):
     try:
-        # Trova il file CSV più recente nella cartella uploads
-        upload_folder = app.config['UPLOAD_FOLDER']
-        csv_files = [f for f in os.listdir(upload_folder) if f.endswith('.csv')]
-        
-        if not csv_files:
-            flash('Nessun file CSV trovato. Carica prima un file.')
+        if file_type not in EXPORTS:
+            flash('Tipo di file non riconosciuto')
             return redirect(url_for('index'))
         
-        # Prendi il file più recente
-        latest_file = max(csv_files, key=lambda x: os.path.getctime(os.path.join(upload_folder, x)))
-        file_path = os.path.join(upload_folder, latest_file)
-        
-        # Processa il file per generare i risultati
-        results = process_csv(file_path)
+        # Analisi della sessione, ritrovata tramite il suo id
+        manifest = load_manifest(session.get('user_id'), session.get('analysis_id'))
         
-        if 'error' in results:
-            flash(f'Errore nel processare il file: {results["error"]}')
+        if not manifest:
+            flash('Nessun file CSV trovato. Carica prima un file.')
             return redirect(url_for('index'))
+        upload_ids = [item['upload_id'] for item in manifest['files']]
+        # Con l'export della spesa il CSV per inserzione ha anche spesa, CPL e CTR
+        spend = manifest.get('spend') if EXPORTS[file_type] == 'results_df' else None
         
-        # Genera il file richiesto
-        if file_type == 'utm_term_inserzioni.csv':
-            # File riepilogo inserzioni
-            data = results['results_df']
-            
-            # Crea un file temporaneo
-            temp_file = os.path.join(upload_folder, 'temp_utm_term_inserzioni.csv')
-            with open(temp_file, 'w', newline='', encoding='utf-8-sig') as csvfile:
-                if data:
-                    fieldnames = data[0].keys()
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(data)
-            
-            return send_file(temp_file, 
-                           as_attachment=True, 
-                           download_name='utm_term_inserzioni.csv',
-                           mimetype='text/csv')
+        # gzip se il client lo accetta: l'ETag (forte) distingue le due rappresentazioni
+        start, end, start_ts, end_ts = get_date_range()
+        gzipped = request.accept_encodings['gzip'] > 0
+        export_id = analysis_etag(upload_ids, EXPORT_VERSION, file_type, start, end,
+                                  *([spend['upload_id']] if spend else []))
+        etag = f'{export_id}-gzip' if gzipped else export_id
         
-        elif file_type == 'lead_dettagliati_con_inserzioni.csv':
-            # File dettagliato con tutti i lead
-            data = results['detailed_df']
-            
-            # Crea un file temporaneo
-            temp_file = os.path.join(upload_folder, 'temp_lead_dettagliati.csv')
-            with open(temp_file, 'w', newline='', encoding='utf-8-sig') as csvfile:
-                if data:
-                    fieldnames = data[0].keys()
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(data)
+        # Stesso export già scaricato: nessun bisogno di rileggere l'analisi
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            export_folder = os.path.join(get_upload_folder(app.config), 'exports')
+            path = export_cache.lookup(export_folder, export_id, gzipped)
+            if path is None:
+                # Usa l'analisi in cache, ristretta all'eventuale intervallo di date
+                results = analysis_cache.filter(upload_ids, start_ts, end_ts)
+                
+                if 'error' in results:
+                    flash(f'Errore nel processare il file: {results["error"]}')
+                    return redirect(url_for('index'))
+                
+                rows = results[EXPORTS[file_type]]
+                if spend:
+                    joined = join_spend(manifest, results, start_ts, end_ts)
+                    if 'error' in joined:
+                        flash(joined['error'])
+                        return redirect(url_for('index'))
+                    rows = add_cost_columns(rows, joined)
+                
+                path = export_cache.store(export_folder, export_id, rows, gzipped)
             
-            return send_file(temp_file, 
-                           as_attachment=True, 
-                           download_name='lead_dettagliati_con_inserzioni.csv',
-                           mimetype='text/csv')
+            # send_file gestisce If-None-Match, If-Range e Range (ripresa dei download interrotti)
+            response = send_file(path,
+                                 as_attachment=True,
+                                 download_name=file_type,
+                                 mimetype='text/csv',
+                                 etag=etag)
+            if gzipped:
+                response.headers['Content-Encoding'] = 'gzip'
         
-        else:
-            flash('Tipo di file non riconosciuto')
-            return redirect(url_for('index'))
+        response.set_etag(etag)
+        response.accept_ranges = 'bytes'
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
             
+    except HTTPException:
+        # Es. 416 per un Range non soddisfacibile
+        raise
     except Exception as e:
         flash(f'Errore durante il download: {str(e)}')
         return redirect(url_for('index'))
@@ -434,5 +463,7 @@ def download_file(file_type):
 # For Vercel deployment - app is exported via index.py
 if __name__ == '__main__':
     # Railway fornisce la porta tramite la variabile d'ambiente PORT
+    # Solo per sviluppo locale: in produzione si usa gunicorn (vedi gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5000))
-    app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
+    debug = os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true')
+    app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
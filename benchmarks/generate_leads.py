@@ -0,0 +1,122 @@
+"""Generatore riproducibile di export CSV di lead realistici per i benchmark.
+
+Uso:
+    python -m benchmarks.generate_leads leads_100k.csv --rows 100k --seed 42
+"""
+import argparse
+import csv
+import random
+import sys
+from datetime import date, timedelta
+from itertools import accumulate
+from urllib.parse import urlencode
+
+NOMI = ['Marco', 'Giulia', 'Luca', 'Francesca', 'Alessandro', 'Chiara', 'Andrea', 'Sara',
+        'Matteo', 'Elena', 'Giuseppe', 'Valentina', 'Stefano', 'Martina', 'Roberto', 'Federica']
+COGNOMI = ['Rossi', 'Russo', 'Ferrari', 'Esposito', 'Bianchi', 'Romano', 'Colombo', 'Ricci',
+           'Marino', 'Greco', 'Bruno', 'Gallo', 'Conti', 'De Luca', 'Costa', 'Giordano']
+CITTA = [('Roma', 'RM'), ('Milano', 'MI'), ('Napoli', 'NA'), ('Torino', 'TO'), ('Palermo', 'PA'),
+         ('Bologna', 'BO'), ('Firenze', 'FI'), ('Bari', 'BA'), ('Venezia', 'VE'), ('Verona', 'VR')]
+DOMINI = ['gmail.com', 'libero.it', 'hotmail.it', 'outlook.com', 'yahoo.it', 'alice.it']
+REGIONI = ['Italia', 'Lazio', 'Lombardia e Piemonte', 'Veneto', 'Campania', 'Roma']
+FORMATI = ['Video // 4:5', 'Video // 9:16', 'Carosello', 'Immagine // 1:1', 'post id // 4:5 // Video']
+TEMI = ['Testimonianza Alessandro', 'Crisi 2008-2009', 'Notti insonni', 'Consulenza gratuita',
+        'Caso studio', 'Webinar', 'Guida PDF']
+FONTI_ORGANICHE = ['', 'https://www.esempio.it/', 'https://www.esempio.it/contatti',
+                   'https://www.google.com/', 'https://www.esempio.it/?utm_source=newsletter']
+
+FIELDNAMES = ['Nome', 'Cognome', 'Email', 'Telefono', 'Città', 'Provincia',
+              'Data', 'Ora', 'SORGENTE', 'Stato', 'Note']
+
+SUFFIXES = {'k': 1000, 'm': 1000 * 1000}
+
+
+def parse_rows(value):
+    """Converte '10k', '1m' o '250000' nel numero di righe"""
+    value = str(value).strip().lower()
+    if value and value[-1] in SUFFIXES:
+        return int(float(value[:-1]) * SUFFIXES[value[-1]])
+    return int(value)
+
+
+def build_ads(rng, n_ads):
+    """Crea n_ads inserzioni (ID Meta, campagna, contenuto)"""
+    ads = []
+    for i in range(n_ads):
+        ad_id = str(120200000000000000 + rng.randrange(10 ** 13))
+        campagna = f"[SS] Funnel // {rng.choice(['TOFU', 'RE-ENG', 'MOFU'])} // Contatti // " \
+                   f"{rng.choice(['ABO', 'CBO'])} // {rng.choice(REGIONI)}"
+        contenuto = f"{rng.choice(FORMATI)} // {rng.choice(TEMI)}"
+        # Alcune inserzioni hanno una seconda variante di utm_content
+        variante = f"{contenuto} - Copia" if rng.random() < 0.2 else None
+        ads.append((ad_id, campagna, contenuto, variante))
+    return ads
+
+
+def generate(out, rows, seed=42, n_ads=300, zipf_s=1.1, organic=0.25, days=90, start=date(2024, 11, 1)):
+    """Scrive su out un export CSV di `rows` lead con distribuzione Zipf degli utm_term"""
+    rng = random.Random(seed)
+    ads = build_ads(rng, n_ads)
+    cum_weights = list(accumulate(1 / (k ** zipf_s) for k in range(1, n_ads + 1)))
+    dates = [(start + timedelta(days=d)).strftime('%d/%m/%Y') for d in range(days)]
+
+    writer = csv.writer(out)
+    writer.writerow(FIELDNAMES)
+    for i in range(rows):
+        nome = rng.choice(NOMI)
+        cognome = rng.choice(COGNOMI)
+        citta, provincia = rng.choice(CITTA)
+
+        if rng.random() < organic:
+            sorgente = rng.choice(FONTI_ORGANICHE)
+        else:
+            ad_id, campagna, contenuto, variante = rng.choices(ads, cum_weights=cum_weights)[0]
+            if variante and rng.random() < 0.3:
+                contenuto = variante
+            sorgente = 'https://www.esempio.it/landing?' + urlencode({
+                'utm_source': 'facebook',
+                'utm_medium': 'paid',
+                'utm_campaign': campagna,
+                'utm_content': contenuto,
+                'utm_term': ad_id,
+                'fbclid': f"IwAR{rng.getrandbits(64):x}"
+            })
+
+        writer.writerow([
+            nome,
+            cognome,
+            f"{nome.lower()}.{cognome.lower().replace(' ', '')}{i}@{rng.choice(DOMINI)}",
+            f"+39 3{rng.randrange(10 ** 8, 10 ** 9)}",
+            citta,
+            provincia,
+            rng.choice(dates),
+            f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+            sorgente,
+            rng.choice(['Nuovo', 'Contattato', 'Qualificato', 'Perso']),
+            ''
+        ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Genera un export CSV di lead sintetico e riproducibile.')
+    parser.add_argument('output', help="file CSV da creare ('-' per stdout)")
+    parser.add_argument('--rows', default='10k', help='numero di righe, es. 10k, 1m (default: 10k)')
+    parser.add_argument('--seed', type=int, default=42, help='seme del generatore (default: 42)')
+    parser.add_argument('--ads', type=int, default=300, help='numero di inserzioni distinte (default: 300)')
+    parser.add_argument('--zipf', type=float, default=1.1, help='esponente della distribuzione Zipf (default: 1.1)')
+    parser.add_argument('--organic', type=float, default=0.25,
+                        help='frazione di righe senza utm_term (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    kwargs = dict(rows=parse_rows(args.rows), seed=args.seed, n_ads=args.ads,
+                  zipf_s=args.zipf, organic=args.organic)
+    if args.output == '-':
+        sys.stdout.reconfigure(newline='')
+        generate(sys.stdout, **kwargs)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8-sig') as f:
+            generate(f, **kwargs)
+
+
+if __name__ == '__main__':
+    main()
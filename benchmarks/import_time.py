@@ -0,0 +1,129 @@
+"""Costo di avvio a freddo dell'app (import di app.py), misurato con python -X importtime.
+
+Ogni misura gira in un interprete nuovo; per ogni modulo si tiene la mediana
+delle esecuzioni. Oltre al confronto con una baseline, verifica che i moduli
+pesanti caricati solo al primo utilizzo non tornino a essere importati all'avvio.
+
+Uso:
+    python -m benchmarks.import_time --save benchmarks/import_baseline.json
+    python -m benchmarks.import_time --compare benchmarks/import_baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduli che non devono essere importati all'avvio: li carica la prima richiesta che li usa
+LAZY_MODULES = ('requests', 'services.csv_analysis', 'concurrent.futures.process')
+
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def parse_importtime(output):
+    """Tempi (in µs) per modulo dall'output di -X importtime: {modulo: (self, cumulativo)}"""
+    modules = {}
+    for line in output.splitlines():
+        match = _LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def measure_once(module):
+    """Importa il modulo in un interprete nuovo e restituisce i tempi per modulo"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    )
+    return parse_importtime(completed.stderr)
+
+
+def measure(module, repeat):
+    """Mediana dei tempi per modulo su più esecuzioni"""
+    runs = [measure_once(module) for _ in range(repeat)]
+    names = set().union(*runs)
+    return {
+        name: {
+            'self_ms': median(run[name][0] for run in runs if name in run) / 1000,
+            'cumulative_ms': median(run[name][1] for run in runs if name in run) / 1000,
+        }
+        for name in names
+    }
+
+
+def by_package(modules):
+    """Tempo proprio sommato per pacchetto di primo livello"""
+    totals = defaultdict(float)
+    for name, timing in modules.items():
+        totals[name.split('.')[0]] += timing['self_ms']
+    return dict(totals)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Misura il costo di import dell'app all'avvio a freddo.")
+    parser.add_argument('--module', default='app', help="modulo da importare (default: app)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='esecuzioni, si tiene la mediana (default: 5)')
+    parser.add_argument('--top', type=int, default=15, help='righe da mostrare per tabella (default: 15)')
+    parser.add_argument('--save', help='salva i risultati come baseline JSON')
+    parser.add_argument('--compare', help='baseline JSON con cui confrontare il tempo totale')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='aumento massimo del tempo totale tollerato (default: 0.25)')
+    args = parser.parse_args(argv)
+
+    modules = measure(args.module, args.repeat)
+    if args.module not in modules:
+        print(f"{args.module} non compare nell'output di -X importtime", file=sys.stderr)
+        return 1
+    total_ms = modules[args.module]['cumulative_ms']
+    packages = by_package(modules)
+
+    print(f"import {args.module}: {total_ms:.1f} ms (mediana di {args.repeat}), {len(modules)} moduli")
+    print(f"\n{'pacchetto':<40} {'ms':>8}")
+    for name, ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{name:<40} {ms:>8.1f}")
+    print(f"\n{'modulo':<40} {'proprio':>8} {'cumul.':>8}")
+    ordered = sorted(modules.items(), key=lambda item: item[1]['cumulative_ms'], reverse=True)
+    for name, timing in ordered[:args.top]:
+        print(f"{name:<40} {timing['self_ms']:>8.1f} {timing['cumulative_ms']:>8.1f}")
+
+    failures = []
+    eager = [name for name in LAZY_MODULES if name in modules]
+    if args.module == 'app' and eager:
+        failures.append(f"moduli importati all'avvio invece che al primo utilizzo: {', '.join(eager)}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        change = total_ms / baseline['total_ms'] - 1
+        print(f"\nrispetto alla baseline: {change * 100:+.1f}% ({baseline['total_ms']:.1f} ms)")
+        if change > args.threshold:
+            failures.append(f"import {args.module} {change * 100:+.1f}% (soglia +{args.threshold * 100:.0f}%)")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'module': args.module,
+                'total_ms': total_ms,
+                'packages': packages,
+            }, f, indent=2)
+        print(f"Baseline salvata in {args.save}")
+
+    for failure in failures:
+        print(f"REGRESSIONE {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""Benchmark di throughput e memoria dei percorsi di analisi CSV.
+
+Ogni misura gira in un processo separato, così il picco di RSS non è
+influenzato dalle misure precedenti.
+
+Uso:
+    python -m benchmarks.run_benchmarks --rows 10k,100k --save benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --rows 10k,100k --compare benchmarks/baseline.json --threshold 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.generate_leads import generate, parse_rows
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, 'benchmarks', '.data')
+
+
+def _run_process_csv(path):
+    from services.csv_analysis import process_csv
+    results = process_csv(path)
+    if 'error' in results:
+        raise RuntimeError(results['error'])
+
+
+def _run_process_csv_file(path):
+    from services.csv_analysis import process_csv_file
+    results = process_csv_file(path)
+    if not results.get('success'):
+        raise RuntimeError(results['error'])
+
+
+def _run_extract_main(path):
+    import extract_utm_term
+    with tempfile.TemporaryDirectory() as output_dir:
+        if extract_utm_term.main([path, '-q', '-o', output_dir, '-r', 'entrambi']) != 0:
+            raise RuntimeError('extract_utm_term.main è terminato con errore')
+
+
+TARGETS = {
+    'process_csv': _run_process_csv,
+    'process_csv_file': _run_process_csv_file,
+    'extract_utm_term.main': _run_extract_main,
+}
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(target, path, rows):
+    """Esegue una misura nel processo corrente (throughput, picco RSS, picco tracemalloc)"""
+    run = TARGETS[target]
+
+    started = time.perf_counter()
+    run(path)
+    elapsed = time.perf_counter() - started
+    peak_rss = _peak_rss_bytes()
+
+    # tracemalloc rallenta l'esecuzione: si misura in un secondo passaggio
+    tracemalloc.start()
+    run(path)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds': elapsed,
+        'rows_per_s': rows / elapsed if elapsed > 0 else 0,
+        'mb_per_s': os.path.getsize(path) / 1024 / 1024 / elapsed if elapsed > 0 else 0,
+        'peak_rss_mb': peak_rss / 1024 / 1024,
+        'tracemalloc_peak_mb': traced_peak / 1024 / 1024,
+    }
+
+
+def measure_in_subprocess(target, path, rows):
+    """Lancia la misura in un interprete nuovo e ne legge il risultato JSON"""
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.run_benchmarks', '--worker', target, path, str(rows)],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def dataset(rows, seed):
+    """Percorso del CSV sintetico per questa dimensione, generato solo se manca"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f'leads_{rows}_{seed}.csv')
+    if not os.path.exists(path):
+        print(f"Generazione di {path}...", file=sys.stderr)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', newline='', encoding='utf-8-sig') as f:
+            generate(f, rows=rows, seed=seed)
+        os.replace(tmp_path, path)
+    return path
+
+
+def compare(results, baseline, threshold):
+    """Elenca le misure il cui throughput è sceso oltre la soglia rispetto alla baseline"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if not previous:
+            continue
+        change = current['rows_per_s'] / previous['rows_per_s'] - 1
+        current['change'] = change
+        if change < -threshold:
+            regressions.append((key, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark dei percorsi di analisi CSV.')
+    parser.add_argument('--rows', default='10k,100k',
+                        help='dimensioni dei dataset separate da virgola (default: 10k,100k)')
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help=f"percorsi da misurare (default: {','.join(TARGETS)})")
+    parser.add_argument('--seed', type=int, default=42, help='seme del generatore (default: 42)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='ripetizioni per misura, si tiene la migliore (default: 3)')
+    parser.add_argument('--save', help='salva i risultati come baseline JSON')
+    parser.add_argument('--compare', help='baseline JSON con cui confrontare il throughput')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='calo massimo di righe/s tollerato rispetto alla baseline (default: 0.10)')
+    parser.add_argument('--worker', nargs=3, metavar=('TARGET', 'PATH', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        target, path, rows = args.worker
+        print(json.dumps(measure(target, path, int(rows))))
+        return 0
+
+    targets = [t.strip() for t in args.targets.split(',') if t.strip()]
+    unknown = [t for t in targets if t not in TARGETS]
+    if unknown:
+        parser.error(f"percorsi sconosciuti: {', '.join(unknown)}")
+
+    results = {}
+    for size in args.rows.split(','):
+        rows = parse_rows(size)
+        path = dataset(rows, args.seed)
+        for target in targets:
+            runs = [measure_in_subprocess(target, path, rows) for _ in range(args.repeat)]
+            best = max(runs, key=lambda r: r['rows_per_s'])
+            best['peak_rss_mb'] = min(r['peak_rss_mb'] for r in runs)
+            results[f'{target}@{rows}'] = best
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    print(f"{'misura':<34} {'righe/s':>12} {'MB/s':>8} {'RSS MB':>8} {'heap MB':>8} {'delta':>8}")
+    for key, r in results.items():
+        change = f"{r['change'] * 100:+.1f}%" if 'change' in r else ''
+        print(f"{key:<34} {r['rows_per_s']:>12,.0f} {r['mb_per_s']:>8.1f} "
+              f"{r['peak_rss_mb']:>8.1f} {r['tracemalloc_peak_mb']:>8.1f} {change:>8}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'seed': args.seed,
+                'results': results
+            }, f, indent=2)
+        print(f"Baseline salvata in {args.save}")
+
+    if regressions:
+        for key, change in regressions:
+            print(f"REGRESSIONE {key}: throughput {change * 100:+.1f}% (soglia -{args.threshold * 100:.0f}%)",
+                  file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Genera gli asset statici con fingerprint in static/dist/.
+
+Ogni file di static/ (escluso dist/) viene copiato in static/dist/ con l'hash del
+contenuto nel nome, insieme alle versioni precompresse .gz e .br (quest'ultima
+solo se è installato il pacchetto opzionale `brotli`). I riferimenti url() nei CSS
+vengono riscritti verso i nomi con hash. La corrispondenza tra nomi originali e
+nomi con hash va in static/dist/manifest.json, letto dall'app (asset_url).
+
+Con --fetch scarica prima in static/vendor/ le librerie front-end (VENDOR_ASSETS
+in services/assets.py) con i font e le immagini a cui fanno riferimento i CSS.
+
+Uso:
+    python build_assets.py --fetch
+    python build_assets.py
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sys
+import urllib.request
+from urllib.parse import urljoin
+
+from services.assets import DIST_FOLDER, MANIFEST_NAME, VENDOR_ASSETS
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC = os.path.join(ROOT, 'static')
+
+# Tipi che vale la pena precomprimere (woff2, png, jpg sono già compressi)
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map', '.ttf', '.eot', '.txt')
+
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def _relative_path(ref):
+    """Percorso di un riferimento url() relativo, senza query e frammento (None se assoluto o inline)"""
+    if ref.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+        return None
+    return re.split(r'[?#]', ref, 1)[0]
+
+
+def _css_references(css):
+    """Riferimenti relativi url() di un CSS"""
+    paths = (_relative_path(match.group(2).strip()) for match in _CSS_URL.finditer(css))
+    return [path for path in paths if path]
+
+
+def _download(url, name):
+    target = os.path.join(STATIC, *name.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = response.read()
+    with open(target, 'wb') as f:
+        f.write(data)
+    print(f"{name:<60} {len(data):>10,} B  <- {url}")
+    return data
+
+
+def fetch():
+    """Scarica le librerie front-end (e i file a cui rimandano i loro CSS) in static/vendor/"""
+    for name, url in VENDOR_ASSETS.items():
+        data = _download(url, name)
+        if name.endswith('.css'):
+            for ref in sorted(set(_css_references(data.decode('utf-8')))):
+                ref_name = posixpath.normpath(posixpath.join(posixpath.dirname(name), ref))
+                _download(urljoin(url, ref), ref_name)
+
+
+def _fingerprint(name, data):
+    """vendor/x/app.min.css -> vendor/x/app.min.<hash>.css"""
+    stem, ext = posixpath.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _rewrite_css(name, css, manifest):
+    """Sostituisce nei url() relativi i nomi originali con quelli con hash"""
+    def replace(match):
+        quote, ref = match.group(1), match.group(2).strip()
+        path = _relative_path(ref)
+        target = manifest.get(posixpath.normpath(posixpath.join(posixpath.dirname(name), path))) if path else None
+        if target is None:
+            return match.group(0)
+        hashed = posixpath.join(posixpath.dirname(path), posixpath.basename(target))
+        return f'url({quote}{hashed}{ref[len(path):]}{quote})'
+    return _CSS_URL.sub(replace, css)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _compressed_variants(data):
+    """(suffisso, contenuto) delle versioni precompresse, solo se più piccole dell'originale"""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, payload) for suffix, payload in variants if len(payload) < len(data)]
+
+
+def build():
+    """Genera static/dist/ e il manifest; restituisce {nome originale: nome con hash}"""
+    dist = os.path.join(STATIC, DIST_FOLDER)
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(STATIC):
+        if os.path.abspath(dirpath) == STATIC:
+            dirnames[:] = [d for d in dirnames if d != DIST_FOLDER]
+        for filename in filenames:
+            if not filename.startswith('.'):
+                sources.append(os.path.relpath(os.path.join(dirpath, filename), STATIC).replace(os.sep, '/'))
+
+    # I CSS per ultimi: devono conoscere i nomi con hash dei file a cui rimandano
+    manifest = {}
+    written = {MANIFEST_NAME}
+    for name in sorted(sources, key=lambda n: (n.endswith('.css'), n)):
+        with open(os.path.join(STATIC, *name.split('/')), 'rb') as f:
+            data = f.read()
+        if name.endswith('.css'):
+            data = _rewrite_css(name, data.decode('utf-8'), manifest).encode('utf-8')
+        hashed = _fingerprint(name, data)
+        manifest[name] = hashed
+        target = os.path.join(dist, *hashed.split('/'))
+        if not os.path.exists(target):
+            _write(target, data)
+        written.add(hashed)
+        sizes = [f'{len(data):>10,} B']
+        if name.endswith(COMPRESSIBLE):
+            for suffix, payload in _compressed_variants(data):
+                _write(target + suffix, payload)
+                written.add(hashed + suffix)
+                sizes.append(f'{suffix[1:]} {len(payload):>9,} B')
+        print(f"{hashed:<60} {'  '.join(sizes)}")
+
+    # Elimina le versioni precedenti degli asset
+    for dirpath, _, filenames in os.walk(dist, topdown=False):
+        for filename in filenames:
+            relative = os.path.relpath(os.path.join(dirpath, filename), dist).replace(os.sep, '/')
+            if relative not in written:
+                os.remove(os.path.join(dirpath, filename))
+        if dirpath != dist and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    _write(os.path.join(dist, MANIFEST_NAME),
+           (json.dumps(manifest, indent=2, sort_keys=True, ensure_ascii=False) + '\n').encode('utf-8'))
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Genera gli asset statici con fingerprint e precompressi.')
+    parser.add_argument('--fetch', action='store_true',
+                        help='scarica prima le librerie front-end in static/vendor/')
+    args = parser.parse_args(argv)
+
+    if args.fetch:
+        try:
+            fetch()
+        except OSError as e:
+            print(f"Download delle librerie non riuscito: {e}", file=sys.stderr)
+            return 1
+    manifest = build()
+    print(f"\n{len(manifest)} asset in static/{DIST_FOLDER}/")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,14 @@
 import os
-from dotenv import load_dotenv
 
-# Carica le variabili d'ambiente dal file .env (solo se esiste)
-try:
-    load_dotenv()
-except Exception:
-    # Su Vercel le variabili d'ambiente sono già disponibili
-    pass
+# Carica le variabili d'ambiente dal file .env (solo se esiste: su Vercel le variabili
+# sono già disponibili e python-dotenv non viene nemmeno importato)
+if any(os.path.exists(os.path.join(folder, '.env'))
+       for folder in (os.getcwd(), os.path.dirname(os.path.abspath(__file__)))):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except Exception:
+        pass
 
 class Config:
     # Configurazione Flask
@@ -15,6 +17,28 @@ class Config:
     # Configurazione Airtable
     AIRTABLE_API_KEY = os.environ.get('AIRTABLE_API_KEY') or 'patD0oILpVSAgGlXH.340137025a6213e618f73e85886219cadc77c33e93168022f89fad7224d25bd8'
     AIRTABLE_BASE_ID = os.environ.get('AIRTABLE_BASE_ID') or 'app7QNXXGNwobUi0N'
+    # URL delle API, sovrascrivibile per puntare a un server locale (es. loadtest/airtable_stub.py)
+    AIRTABLE_API_URL = os.environ.get('AIRTABLE_API_URL') or 'https://api.airtable.com/v0'
+    # Timeout di ogni chiamata e scadenza comune delle chiamate in parallelo (secondi)
+    AIRTABLE_TIMEOUT = float(os.environ.get('AIRTABLE_TIMEOUT') or 10)
+    # Thread condivisi per le chiamate Airtable in parallelo
+    AIRTABLE_MAX_CONCURRENCY = int(os.environ.get('AIRTABLE_MAX_CONCURRENCY') or 8)
+    # Rate limit delle chiamate (richieste/s e picco), tentativi dopo una risposta 429
+    AIRTABLE_RATE_LIMIT = float(os.environ.get('AIRTABLE_RATE_LIMIT') or 3)
+    AIRTABLE_RATE_BURST = float(os.environ.get('AIRTABLE_RATE_BURST') or 2)
+    AIRTABLE_MAX_RETRIES = int(os.environ.get('AIRTABLE_MAX_RETRIES') or 3)
+    # Durata in cache di profili e preferenze utente (secondi, 0 = nessuna cache)
+    AIRTABLE_CACHE_TTL = float(os.environ.get('AIRTABLE_CACHE_TTL') or 300)
+    # Limiter in memoria condivisa tra i processi (impostato da gunicorn.conf.py)
+    AIRTABLE_SHARED_RATE_LIMIT = os.environ.get('AIRTABLE_SHARED_RATE_LIMIT', '').lower() in ('1', 'true')
+    # Versioni della cache condivise tra i processi: una modifica fatta da un worker invalida
+    # le copie negli altri (di default insieme al limiter condiviso, cioè con gunicorn)
+    AIRTABLE_SHARED_CACHE = (os.environ.get('AIRTABLE_SHARED_CACHE')
+                             or os.environ.get('AIRTABLE_SHARED_RATE_LIMIT', '')).lower() in ('1', 'true')
+    # Salvataggio delle preferenze in background, a gruppi, al massimo ogni N secondi
+    # (0 = scrittura immediata; su Vercel l'istanza può essere sospesa prima della scrittura)
+    PREFERENCES_FLUSH_INTERVAL = float(os.environ.get('PREFERENCES_FLUSH_INTERVAL')
+                                       or (0 if os.environ.get('VERCEL') else 2))
     
     # Configurazione applicazione
     APP_NAME = os.environ.get('APP_NAME') or 'Estrattore UTM Term'
@@ -22,9 +46,74 @@ class Config:
     
     # Configurazione sessioni
     SESSION_TIMEOUT = 3600  # 1 ora in secondi
+    # Ogni quanti secondi si aggiorna l'ultimo accesso (scadenza della sessione) invece che a ogni richiesta
+    SESSION_ACTIVITY_INTERVAL = int(os.environ.get('SESSION_ACTIVITY_INTERVAL') or 60)
+    # Dove si salvano le sessioni: 'cookie' (default, nel cookie firmato), 'memory' (in memoria del processo,
+    # solo con un processo) o 'sqlite' (file SESSION_SQLITE_PATH, condiviso dai worker della stessa macchina)
+    SESSION_BACKEND = (os.environ.get('SESSION_BACKEND') or 'cookie').lower()
+    SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH') or os.path.join('storage', 'sessions.sqlite3')
+    SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES') or 10000)
     
     # Configurazione upload
     UPLOAD_FOLDER = 'uploads'
     # Rileva se siamo su Railway o Vercel
     RAILWAY_ENVIRONMENT = os.environ.get('RAILWAY_ENVIRONMENT_NAME') is not None
-    MAX_CONTENT_LENGTH = 50 * 1024 * 1024 if RAILWAY_ENVIRONMENT else 4 * 1024 * 1024  # 50MB su Railway, 4MB su Vercel
\ No newline at end of file
+    MAX_CONTENT_LENGTH = 50 * 1024 * 1024 if RAILWAY_ENVIRONMENT else 4 * 1024 * 1024  # 50MB su Railway, 4MB su Vercel
+    
+    # Storage di upload e risultati: 'local' (cartella STORAGE_DIR) o 's3' (object storage compatibile S3,
+    # necessario su Vercel perché ogni istanza ha la propria /tmp)
+    STORAGE_BACKEND = (os.environ.get('STORAGE_BACKEND') or 'local').lower()
+    STORAGE_DIR = os.environ.get('STORAGE_DIR') or 'storage'
+    # Copia locale degli oggetti letti da S3 (vuota = cartella temporanea)
+    STORAGE_CACHE_DIR = os.environ.get('STORAGE_CACHE_DIR', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or 'https://s3.amazonaws.com'
+    S3_BUCKET = os.environ.get('S3_BUCKET', '')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID', '')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY', '')
+    S3_REGION = os.environ.get('S3_REGION') or 'us-east-1'
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    
+    # Conservazione di upload, risultati e analisi: età massima, spazio massimo degli upload
+    # e intervallo minimo tra due pulizie (secondi)
+    RETENTION_MAX_AGE_DAYS = float(os.environ.get('RETENTION_MAX_AGE_DAYS') or 30)
+    RETENTION_MAX_BYTES = int(os.environ.get('RETENTION_MAX_BYTES') or 2 * 1024 * 1024 * 1024)
+    RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL') or 600)
+    
+    # Configurazione analisi: processi usati per analizzare più file in parallelo, in un pool per ogni
+    # worker gunicorn (quindi al massimo 2 di default, per non moltiplicare i processi per i worker)
+    ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS') or min(os.cpu_count() or 1, 2))
+    # Spazio massimo dei risultati salvati nello storage e condivisi tra worker e istanze
+    ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES') or 1024 * 1024 * 1024)
+    # Spazio massimo degli export CSV già generati (e delle versioni gzip) nella cartella di upload
+    EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+    # Analisi progressiva: per upload da PROGRESSIVE_MIN_BYTES in su (0 = disattivata; su Vercel il lavoro
+    # in background dopo la risposta non è garantito) si mostra prima una stima da PROGRESSIVE_SAMPLE_BYTES
+    # di campione; il processo che esegue l'analisi in background ne aggiorna il manifest ogni PROGRESSIVE_HEARTBEAT
+    # secondi e un'analisi senza aggiornamenti da PROGRESSIVE_TIMEOUT secondi si considera interrotta
+    PROGRESSIVE_MIN_BYTES = int(os.environ.get('PROGRESSIVE_MIN_BYTES')
+                                or (0 if os.environ.get('VERCEL') else 8 * 1024 * 1024))
+    PROGRESSIVE_SAMPLE_BYTES = int(os.environ.get('PROGRESSIVE_SAMPLE_BYTES') or 1024 * 1024)
+    PROGRESSIVE_HEARTBEAT = float(os.environ.get('PROGRESSIVE_HEARTBEAT') or 30)
+    PROGRESSIVE_TIMEOUT = int(os.environ.get('PROGRESSIVE_TIMEOUT') or 120)
+    
+    # Ingestione dei lead dal CRM (/api/ingest/leads): token "token:user_id" separati da virgole
+    # e archivio SQLite dei lead ricevuti (su Vercel il disco non è persistente)
+    INGEST_TOKENS = os.environ.get('INGEST_TOKENS', '')
+    INGEST_DB_PATH = os.environ.get('INGEST_DB_PATH') or os.path.join('storage', 'leads.sqlite3')
+    # Fuso orario di Data e Ora dei lead, come negli export: i timestamp con fuso vi vengono convertiti
+    LEADS_TIMEZONE = os.environ.get('LEADS_TIMEZONE') or 'Europe/Rome'
+    
+    # Token richiesto per leggere /metrics (se vuoto l'endpoint è pubblico)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    # Cartella in cui ogni processo scrive le proprie metriche, sommate da /metrics (impostata da
+    # gunicorn.conf.py; vuota = metriche del solo processo che risponde) e intervallo di scrittura
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL') or 5)
+    
+    # Profilazione opt-in delle richieste: frazione campionata e soglia di lentezza (secondi, 0 = disattivata)
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 0)
+    PROFILE_SLOW_THRESHOLD = float(os.environ.get('PROFILE_SLOW_THRESHOLD') or 0)
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS') or 5)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or 'profiles'
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES') or 200)
+    PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES') or 50 * 1024 * 1024)
@@ -1,163 +1,225 @@
+import argparse
 import csv
-import re
-from urllib.parse import urlparse, parse_qs
-from collections import Counter
-
-def extract_utm_term_from_url(url):
-    """Estrae il valore utm_term da un URL"""
-    if not url or not isinstance(url, str):
-        return None
-    
-    try:
-        # Parse dell'URL
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        
-        # Estrai utm_term
-        utm_term = query_params.get('utm_term', [None])[0]
-        return utm_term
-    except:
-        return None
-
-def extract_campaign_name_from_url(url):
-    """Estrae il nome della campagna dall'URL"""
-    if pd.isna(url) or not isinstance(url, str):
-        return None
-    
-    try:
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        
-        # Estrai utm_campaign
-        utm_campaign = query_params.get('utm_campaign', [None])[0]
-        return utm_campaign
-    except:
-        return None
-
-def extract_content_name_from_url(url):
-    """Estrae il contenuto dell'inserzione dall'URL"""
-    if pd.isna(url) or not isinstance(url, str):
-        return None
-    
-    try:
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        
-        # Estrai utm_content
-        utm_content = query_params.get('utm_content', [None])[0]
-        return utm_content
-    except:
-        return None
-
-def main():
-    # Leggi il file CSV
-    print("Caricamento del file CSV...")
-    rows = []
-    with open('KPI - Legge3 - Lead.csv', 'r', encoding='utf-8-sig', newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            rows.append(row)
-    
-    print(f"Totale righe nel file: {len(rows)}")
-    
-    # Filtra solo le righe che hanno una SORGENTE (URL)
-    rows_with_url = []
-    for row in rows:
-        sorgente = row.get('SORGENTE', '')
-        if sorgente and 'utm_term' in sorgente:
-            rows_with_url.append(row)
-    
-    print(f"Righe con utm_term: {len(rows_with_url)}")
-    
-    # Estrai i parametri UTM
-    rows_with_utm_term = []
-    for row in rows_with_url:
-        utm_term = extract_utm_term_from_url(row.get('SORGENTE', ''))
-        utm_campaign = extract_campaign_name_from_url(row.get('SORGENTE', ''))
-        utm_content = extract_content_name_from_url(row.get('SORGENTE', ''))
-        
-        if utm_term:
-            row['utm_term_extracted'] = utm_term
-            row['utm_campaign_extracted'] = utm_campaign
-            row['utm_content_extracted'] = utm_content
-            rows_with_utm_term.append(row)
-    
-    print(f"Righe con utm_term valido: {len(rows_with_utm_term)}")
-    
-    # Analizza i valori utm_term più frequenti
-    utm_term_counts = Counter([row['utm_term_extracted'] for row in rows_with_utm_term])
-    
-    print("\n=== TOP 20 UTM_TERM PIÙ FREQUENTI ===")
-    for utm_term, count in utm_term_counts.most_common(20):
-        print(f"{utm_term}: {count} occorrenze")
-    
-    # Crea un mapping utm_term -> nome inserzione basato su utm_content
-    print("\n=== MAPPING UTM_TERM -> NOME INSERZIONE ===")
-    
-    # Raggruppa per utm_term e prendi il utm_content più frequente per ogni utm_term
-    utm_term_to_content = {}
-    
-    for utm_term in utm_term_counts.keys():
-        if utm_term:
-            content_list = [row['utm_content_extracted'] for row in rows_with_utm_term 
-                           if row['utm_term_extracted'] == utm_term and row.get('utm_content_extracted')]
-            if content_list:
-                content_counts = Counter(content_list)
-                most_common_content = content_counts.most_common(1)[0][0]
-                utm_term_to_content[utm_term] = most_common_content
-    
-    # Salva i risultati in un file CSV
-    results = []
-    for utm_term, content in utm_term_to_content.items():
-        count = utm_term_counts[utm_term]
-        results.append({
-            'utm_term': utm_term,
-            'nome_inserzione': content,
-            'numero_lead': count
-        })
-    
-    # Ordina per numero di lead
-    results.sort(key=lambda x: x['numero_lead'], reverse=True)
-    
-    # Salva in CSV
-    with open('utm_term_inserzioni.csv', 'w', newline='', encoding='utf-8-sig') as csvfile:
-        if results:
-            fieldnames = results[0].keys()
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
-    
-    print(f"\nRisultati salvati in 'utm_term_inserzioni.csv'")
-    print(f"Totale inserzioni uniche identificate: {len(results)}")
-    
-    # Mostra i primi 10 risultati
-    print("\n=== PRIME 10 INSERZIONI PER NUMERO DI LEAD ===")
-    for i, row in enumerate(results[:10]):
-        print(f"UTM_TERM: {row['utm_term']}")
-        print(f"Nome inserzione: {row['nome_inserzione']}")
-        print(f"Lead generati: {row['numero_lead']}")
-        print("-" * 50)
-    
-    # Salva anche un file dettagliato con tutti i lead
-    detailed_results = []
-    for row in rows_with_utm_term:
-        detailed_results.append({
-            'Data': row.get('Data', ''),
-            'Ora': row.get('Ora', ''),
-            'Email': row.get('Email', ''),
-            'UTM_Term': row.get('utm_term_extracted', ''),
-            'Campagna': row.get('utm_campaign_extracted', ''),
-            'Nome_Inserzione': row.get('utm_content_extracted', '')
-        })
-    
-    with open('lead_dettagliati_con_inserzioni.csv', 'w', newline='', encoding='utf-8-sig') as csvfile:
-        if detailed_results:
-            fieldnames = detailed_results[0].keys()
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(detailed_results)
-    
-    print(f"\nFile dettagliato salvato in 'lead_dettagliati_con_inserzioni.csv'")
+import glob
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from services.csv_analysis import process_csv, process_csv_stream, merge_results
+
+DEFAULT_INPUT = 'KPI - Legge3 - Lead.csv'
+STDIN = '-'
+
+# Report prodotti per ogni file, con i nomi usati dall'app web
+REPORTS = {
+    'riepilogo': ('results_df', 'utm_term_inserzioni'),
+    'dettaglio': ('detailed_df', 'lead_dettagliati_con_inserzioni'),
+}
+
+
+def expand_inputs(patterns):
+    """Espande glob e percorsi in un elenco ordinato di file (il trattino indica stdin)"""
+    paths = []
+    for pattern in patterns:
+        if pattern == STDIN:
+            paths.append(STDIN)
+            continue
+        matches = sorted(glob.glob(pattern))
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+
+class CountingReader(io.RawIOBase):
+    """Legge da uno stream binario contando i byte letti"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        read = self.raw.readinto(buffer)
+        self.count += read or 0
+        return read
+
+
+def analyze_path(path):
+    """Analizza un file (o stdin) e restituisce (percorso, byte letti, risultati)"""
+    if path == STDIN:
+        # stdin si legge a blocchi come i file, senza caricarlo tutto in memoria
+        reader = CountingReader(sys.stdin.buffer)
+        stream = io.TextIOWrapper(io.BufferedReader(reader), encoding='utf-8-sig', newline='')
+        results = process_csv_stream(stream)
+        return path, reader.count, results
+    size = os.path.getsize(path) if os.path.isfile(path) else 0
+    return path, size, process_csv(path)
+
+
+def iter_analyses(paths, jobs):
+    """Restituisce le analisi nell'ordine dei file, processandole su più processi se richiesto"""
+    files = [path for path in paths if path != STDIN]
+    if STDIN in paths:
+        # stdin non è condivisibile con i processi figli: lo si legge subito
+        yield analyze_path(STDIN)
+
+    workers = min(jobs, len(files))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(analyze_path, files)
+    else:
+        for path in files:
+            yield analyze_path(path)
+
+
+class ReportWriter:
+    """Scrive le righe di un report in CSV o JSONL man mano che arrivano"""
+
+    def __init__(self, stream, fmt, with_file_column):
+        self.stream = stream
+        self.fmt = fmt
+        self.with_file_column = with_file_column
+        self.csv_writer = None
+
+    def write(self, source, rows):
+        for row in rows:
+            if self.with_file_column:
+                row = dict(file=source, **row)
+            if self.fmt == 'jsonl':
+                self.stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+                continue
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(self.stream, fieldnames=list(row.keys()))
+                self.csv_writer.writeheader()
+            self.csv_writer.writerow(row)
+
+
+def output_stems(paths):
+    """Nome base dei report di ogni input; input con lo stesso nome (es. mese1/lead.csv e
+    mese2/lead.csv) ricevono un suffisso -2, -3... invece di sovrascriversi a vicenda"""
+    stems = {}
+    used = set()
+    for path in dict.fromkeys(paths):
+        base = 'stdin' if path == STDIN else os.path.splitext(os.path.basename(path))[0]
+        stem, counter = base, 1
+        while stem in used:
+            counter += 1
+            stem = f"{base}-{counter}"
+        used.add(stem)
+        stems[path] = stem
+    return stems
+
+
+def output_name(stem, report, fmt):
+    """Nome del file di output per un input e un tipo di report"""
+    return f"{stem}.{REPORTS[report][1]}.{fmt}"
+
+
+def write_to_dir(output_dir, stem, results, reports, fmt):
+    """Salva i report di un'analisi nella cartella di output"""
+    for report in reports:
+        target = os.path.join(output_dir, output_name(stem, report, fmt))
+        with open(target, 'w', newline='', encoding='utf-8-sig' if fmt == 'csv' else 'utf-8') as f:
+            ReportWriter(f, fmt, False).write(stem, results[REPORTS[report][0]])
+
+
+def sort_summary(results):
+    """Ordina il riepilogo per numero di lead, come nella pagina dei risultati"""
+    results['results_df'].sort(key=lambda x: x['numero_lead'], reverse=True)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Estrae utm_term, campagna e nome inserzione dai CSV di lead (colonna SORGENTE).')
+    parser.add_argument('inputs', nargs='*', default=[DEFAULT_INPUT],
+                        help="file CSV o glob da analizzare, '-' per leggere da stdin "
+                             f"(default: '{DEFAULT_INPUT}')")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='numero di processi per analizzare i file in parallelo (default: 1)')
+    parser.add_argument('-o', '--output-dir',
+                        help='cartella in cui salvare i report di ogni file; senza questa opzione '
+                             'il report viene scritto su stdout')
+    parser.add_argument('-f', '--format', choices=['csv', 'jsonl'], default='csv',
+                        help='formato di output (default: csv)')
+    parser.add_argument('-r', '--report', choices=['riepilogo', 'dettaglio', 'entrambi'], default='riepilogo',
+                        help="report da produrre (default: riepilogo; 'entrambi' richiede --output-dir)")
+    parser.add_argument('-m', '--merge', action='store_true',
+                        help="unisce tutti i file in un unico report, come l'upload multiplo dell'app")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='non stampa il riepilogo delle prestazioni su stderr')
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error('--jobs deve essere almeno 1')
+    if args.report == 'entrambi' and not args.output_dir:
+        parser.error("--report entrambi richiede --output-dir")
+    if args.inputs.count(STDIN) > 1:
+        parser.error("stdin ('-') può essere indicato una sola volta")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = expand_inputs(args.inputs)
+    reports = list(REPORTS) if args.report == 'entrambi' else [args.report]
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        stems = output_stems(paths)
+        writer = None
+    else:
+        sys.stdout.reconfigure(newline='')
+        writer = ReportWriter(sys.stdout, args.format, len(paths) > 1 and not args.merge)
+
+    started = time.perf_counter()
+    total_rows = 0
+    total_bytes = 0
+    failures = 0
+    merged = []
+
+    for path, size, results in iter_analyses(paths, args.jobs):
+        if 'error' in results:
+            failures += 1
+            print(f"{path}: {results['error']}", file=sys.stderr)
+            continue
+
+        total_rows += results['total_rows']
+        total_bytes += size
+
+        if args.merge:
+            merged.append(results)
+        elif args.output_dir:
+            write_to_dir(args.output_dir, stems[path], sort_summary(results), reports, args.format)
+        else:
+            writer.write(path, sort_summary(results)[REPORTS[reports[0]][0]])
+
+    if args.merge and merged:
+        results = sort_summary(merge_results(merged))
+        if args.output_dir:
+            write_to_dir(args.output_dir, 'merged', results, reports, args.format)
+        else:
+            writer.write('merged', results[REPORTS[reports[0]][0]])
+
+    elapsed = time.perf_counter() - started
+    if not args.quiet:
+        rate = 1 / elapsed if elapsed > 0 else 0
+        print(f"{len(paths) - failures}/{len(paths)} file analizzati, {total_rows} righe, "
+              f"{total_bytes / 1024 / 1024:.1f} MB in {elapsed:.2f}s "
+              f"({total_rows * rate:,.0f} righe/s, {total_bytes * rate / 1024 / 1024:.1f} MB/s)",
+              file=sys.stderr)
+
+    return 1 if failures else 0
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        sys.exit(main())
+    except BrokenPipeError:
+        # Output troncato (es. con | head): si esce senza traceback
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
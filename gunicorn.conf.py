@@ -0,0 +1,59 @@
+"""Configurazione di produzione per gunicorn (Railway / Procfile).
+
+Avvio: gunicorn -c gunicorn.conf.py app:app
+Riavvio graduale: kill -HUP <pid master> (i worker terminano le richieste in corso)
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Processi e thread: i thread coprono l'attesa delle chiamate Airtable,
+# i processi l'analisi CSV che occupa la CPU
+workers = int(os.environ.get('WEB_CONCURRENCY') or min(multiprocessing.cpu_count() * 2 + 1, 8))
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+worker_class = 'gthread'
+
+# Il rate limit di Airtable vale per base: i worker condividono un unico limiter,
+# creato nel master durante il preload dell'app
+os.environ.setdefault('AIRTABLE_SHARED_RATE_LIMIT', '1')
+
+# Metriche di tutti i worker: ognuno scrive le proprie in METRICS_DIR e /metrics le somma
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'analizzatore-utm-metrics'))
+
+# L'app viene importata una volta nel master e condivisa dai worker (avvio più rapido)
+preload_app = True
+
+# Upload fino a 50MB e analisi lunghe: timeout ampi
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 300)
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT') or 60)
+keepalive = 2
+
+# Riciclo periodico dei worker per contenere la memoria dopo analisi molto grandi
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS') or 500)
+max_requests_jitter = 50
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Le metriche di un avvio precedente non vanno sommate a quelle nuove
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+
+def worker_exit(server, worker):
+    # Analisi progressive in background e salvataggi delle preferenze ancora in coda:
+    # vengono completati prima che il worker termini (riciclo con max_requests, riavvio graduale);
+    # poi si chiude il pool di processi dell'analisi e le metriche del worker passano all'archivio
+    from services import progressive
+    from services.airtable_service import flush_pending_writes
+    from services.analysis_cache import shutdown_pool
+    from services.metrics import registry
+    progressive.shutdown()
+    flush_pending_writes()
+    shutdown_pool()
+    registry.close()
@@ -0,0 +1,292 @@
+"""Server locale che simula le API Airtable usate dall'app (Utenti, Licenze, Preferenze utente).
+
+Permette di fare load test senza toccare la base reale, con latenza configurabile
+e risposte 429 iniettate a caso o quando si supera il rate limit di Airtable
+(--rate-limit-rps 5: al massimo 5 richieste in ogni secondo).
+
+Uso:
+    python -m loadtest.airtable_stub --port 8765 --users 50 --latency-ms 120 --rate-limit-ratio 0.02
+    AIRTABLE_API_URL=http://127.0.0.1:8765/v0 python app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+APP_NAME = 'Estrattore UTM Term'
+
+# Confronti {campo} = 'valore' (anche dentro TRIM(...) o AND(...))
+FORMULA_CONDITION = re.compile(r"\{([^}]+)\}\)?\s*=\s*'((?:[^'\\]|\\.)*)'")
+# Campi calcolati da Airtable (lookup): le scritture che li contengono vengono rifiutate
+COMPUTED_FIELDS = {'Preferenze utente': ('user_id',)}
+
+
+class AirtableStore:
+    """Tabelle in memoria con record nel formato delle API Airtable"""
+
+    def __init__(self, users=10, app_name=APP_NAME):
+        self.tables = {'Utenti': {}, 'Licenze': {}, 'Preferenze utente': {}}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        for i in range(1, users + 1):
+            user_id = self._new_id()
+            # user_id coincide con l'id del record: l'app usa entrambi come chiave
+            self.tables['Utenti'][user_id] = {
+                'user_id': user_id,
+                'username': f'utente{i}',
+                'password': f'password{i}',
+                'Name': f'Utente {i}',
+                'Incrementale': i
+            }
+            self.insert('Licenze', {
+                'Applicazione': app_name,
+                'Stato': 'Attivo',
+                'Utente_Collegato': [user_id],
+                'Username': f'utente{i}'
+            })
+
+    def _new_id(self):
+        self._next_id += 1
+        return f'rec{self._next_id:014d}'
+
+    def insert(self, table, fields):
+        fields = dict(fields)
+        if table == 'Preferenze utente' and 'Utente' in fields and 'user_id' not in fields:
+            # Campo lookup calcolato da Airtable a partire dal collegamento all'utente
+            fields['user_id'] = list(fields['Utente'])
+        with self._lock:
+            record_id = self._new_id()
+            self.tables[table][record_id] = fields
+        return record_id
+
+    def record(self, table, record_id):
+        fields = self.tables[table].get(record_id)
+        return None if fields is None else {'id': record_id, 'createdTime': '2025-01-01T00:00:00.000Z',
+                                            'fields': fields}
+
+    def select(self, table, formula=None, max_records=None):
+        conditions = FORMULA_CONDITION.findall(formula or '')
+        records = []
+        for record_id, fields in list(self.tables[table].items()):
+            if all(self._matches(fields.get(name), value) for name, value in conditions):
+                records.append(self.record(table, record_id))
+                if max_records and len(records) >= max_records:
+                    break
+        return records
+
+    @staticmethod
+    def _matches(field_value, value):
+        if isinstance(field_value, list):
+            return value in field_value
+        return str(field_value if field_value is not None else '').strip() == value
+
+    def update(self, table, record_id, fields):
+        with self._lock:
+            if record_id not in self.tables[table]:
+                return None
+            self.tables[table][record_id].update(fields)
+        return self.record(table, record_id)
+
+    def upsert(self, table, merge_fields, records):
+        """Aggiorna i record con gli stessi valori nei campi di merge, crea gli altri"""
+        results, created, updated = [], [], []
+        for item in records:
+            fields = item.get('fields', {})
+            conditions = [(name, str(fields.get(name, ''))) for name in merge_fields]
+            with self._lock:
+                existing = [record_id for record_id, current in self.tables[table].items()
+                            if all(self._matches(current.get(name), value) for name, value in conditions)]
+            if existing:
+                record = self.update(table, existing[0], fields)
+                updated.append(record['id'])
+            else:
+                record = self.record(table, self.insert(table, fields))
+                created.append(record['id'])
+            results.append(record)
+        return {'records': results, 'createdRecords': created, 'updatedRecords': updated}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    store: AirtableStore = None
+    latency = 0.0
+    jitter = 0.0
+    rate_limit_ratio = 0.0
+    # Richieste al secondo oltre le quali si risponde 429 (0 = nessun limite)
+    rate_limit_rps = 0
+    recent = None
+    recent_lock = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        """Restituisce (tabella, id record, query) o None se il percorso non è valido"""
+        parsed = urlparse(self.path)
+        parts = [unquote(p) for p in parsed.path.split('/') if p]
+        # /v0/<base>/<tabella>[/<record>]
+        if len(parts) < 3 or parts[0] != 'v0' or parts[2] not in self.store.tables:
+            return None
+        return parts[2], (parts[3] if len(parts) > 3 else None), parse_qs(parsed.query)
+
+    def _over_rate_limit(self):
+        """Registra la richiesta e indica se nell'ultimo secondo si è superato il limite"""
+        if not self.rate_limit_rps:
+            return False
+        now = time.monotonic()
+        with self.recent_lock:
+            while self.recent and now - self.recent[0] >= 1:
+                self.recent.popleft()
+            self.recent.append(now)
+            return len(self.recent) > self.rate_limit_rps
+
+    def _simulate(self):
+        """Applica la latenza e decide se rispondere 429"""
+        over_limit = self._over_rate_limit()
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if over_limit or (self.rate_limit_ratio and random.random() < self.rate_limit_ratio):
+            self._send(429, {'errors': [{'error': 'RATE_LIMIT_REACHED',
+                                         'message': 'Rate limit exceeded. Please try again later'}]})
+            return False
+        return True
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return self._send(404, {'error': 'NOT_FOUND'})
+        if not self._simulate():
+            return
+        table, record_id, query = route
+        if record_id:
+            record = self.store.record(table, record_id)
+            return self._send(200, record) if record else self._send(404, {'error': 'NOT_FOUND'})
+        max_records = int(query.get('maxRecords', ['0'])[0]) or None
+        formula = query.get('filterByFormula', [''])[0]
+        self._send(200, {'records': self.store.select(table, formula, max_records)})
+
+    @staticmethod
+    def _invalid_records(table, records, batch=True):
+        """Messaggio d'errore se la scrittura va rifiutata (come fa Airtable), altrimenti None"""
+        if batch and not 0 < len(records) <= 10:
+            return 'Scrittura multipla di 1-10 record'
+        for item in records:
+            for name in COMPUTED_FIELDS.get(table, ()):
+                if name in item.get('fields', {}):
+                    return f'Field "{name}" cannot accept a value because the field is computed'
+        return None
+
+    def _send_invalid(self, message):
+        self._send(422, {'error': {'type': 'INVALID_VALUE_FOR_COLUMN', 'message': message}})
+
+    def do_POST(self):
+        route = self._route()
+        if route is None or route[1]:
+            return self._send(404, {'error': 'NOT_FOUND'})
+        if not self._simulate():
+            return
+        table, body = route[0], self._body()
+        if 'records' in body:
+            # Creazione multipla, al massimo 10 record
+            records = body['records'] or []
+            error = self._invalid_records(table, records)
+            if error:
+                return self._send_invalid(error)
+            created = [self.store.insert(table, item.get('fields', {})) for item in records]
+            return self._send(200, {'records': [self.store.record(table, record_id) for record_id in created]})
+        error = self._invalid_records(table, [body], batch=False)
+        if error:
+            return self._send_invalid(error)
+        record_id = self.store.insert(table, body.get('fields', {}))
+        self._send(200, self.store.record(table, record_id))
+
+    def do_PATCH(self):
+        route = self._route()
+        if route is None:
+            return self._send(404, {'error': 'NOT_FOUND'})
+        if not self._simulate():
+            return
+        table, body = route[0], self._body()
+        if not route[1]:
+            # Aggiornamento multiplo per id o upsert (performUpsert), al massimo 10 record
+            records = body.get('records') or []
+            error = self._invalid_records(table, records)
+            if error:
+                return self._send_invalid(error)
+            upsert = body.get('performUpsert')
+            if upsert is not None:
+                if not upsert.get('fieldsToMergeOn'):
+                    return self._send(422, {'error': {'type': 'INVALID_REQUEST_UNKNOWN',
+                                                      'message': 'Upsert senza fieldsToMergeOn'}})
+                return self._send(200, self.store.upsert(table, upsert['fieldsToMergeOn'], records))
+            if any(item.get('id') not in self.store.tables[table] for item in records):
+                return self._send(404, {'error': 'NOT_FOUND'})
+            return self._send(200, {'records': [self.store.update(table, item['id'], item.get('fields', {}))
+                                                for item in records]})
+        error = self._invalid_records(table, [body], batch=False)
+        if error:
+            return self._send_invalid(error)
+        record = self.store.update(table, route[1], body.get('fields', {}))
+        self._send(200, record) if record else self._send(404, {'error': 'NOT_FOUND'})
+
+
+def make_server(host='127.0.0.1', port=8765, users=10, latency_ms=0.0, jitter_ms=0.0, rate_limit_ratio=0.0,
+                rate_limit_rps=0):
+    """Crea il server stub (non avviato); port=0 sceglie una porta libera"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {
+        'store': AirtableStore(users=users),
+        'latency': latency_ms / 1000,
+        'jitter': jitter_ms / 1000,
+        'rate_limit_ratio': rate_limit_ratio,
+        'rate_limit_rps': rate_limit_rps,
+        'recent': deque(),
+        'recent_lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Server locale che simula le API Airtable.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--users', type=int, default=10,
+                        help="utenti creati (utenteN / passwordN), ciascuno con licenza attiva")
+    parser.add_argument('--latency-ms', type=float, default=0, help='latenza media per chiamata')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='variazione casuale della latenza')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0,
+                        help='frazione di chiamate a cui rispondere 429 (es. 0.05)')
+    parser.add_argument('--rate-limit-rps', type=int, default=0,
+                        help='risponde 429 oltre queste richieste al secondo (Airtable: 5)')
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.users, args.latency_ms, args.jitter_ms, args.rate_limit_ratio,
+                         args.rate_limit_rps)
+    print(f"Stub Airtable su http://{args.host}:{server.server_address[1]}/v0 ({args.users} utenti)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
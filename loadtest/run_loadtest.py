@@ -0,0 +1,206 @@
+"""Load test dell'app completa: login, upload di CSV generati, pagina risultati e download.
+
+Di default avvia lo stub Airtable e un'istanza dell'app che lo usa; con --base-url
+si può puntare a un'app già in esecuzione (configurata con AIRTABLE_API_URL).
+Con --instances > 1 ogni utente alterna le istanze a ogni richiesta, come su Vercel:
+con --storage s3 le istanze condividono upload e risultati tramite lo stub S3.
+
+Uso:
+    python -m loadtest.run_loadtest --users 20 --iterations 5 --rows 20k --latency-ms 150
+    python -m loadtest.run_loadtest --instances 3 --storage s3
+"""
+import itertools
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from benchmarks.generate_leads import generate, parse_rows
+from loadtest.airtable_stub import make_server
+from loadtest import s3_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOWNLOADS = ['utm_term_inserzioni.csv', 'lead_dettagliati_con_inserzioni.csv']
+
+
+class Recorder:
+    """Raccoglie le latenze per operazione da più thread"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, ok):
+        with self._lock:
+            self.latencies[operation].append(seconds)
+            if not ok:
+                self.errors[operation] += 1
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def timed(recorder, operation, call, expect=200):
+    started = time.perf_counter()
+    try:
+        response = call()
+        ok = response.status_code == expect
+    except requests.RequestException:
+        response, ok = None, False
+    recorder.record(operation, time.perf_counter() - started, ok)
+    return response
+
+
+def virtual_user(base_urls, index, iterations, payloads, recorder):
+    """Simula un utente: login e poi upload, risultati e download ripetuti (alternando le istanze)"""
+    client = requests.Session()
+    instances = itertools.cycle(base_urls[index % len(base_urls):] + base_urls[:index % len(base_urls)])
+    timed(recorder, 'login', lambda: client.post(
+        f'{next(instances)}/api/auth/login', json={'username': f'utente{index}', 'password': f'password{index}'}))
+
+    for i in range(iterations):
+        payload = payloads[(index + i) % len(payloads)]
+        timed(recorder, 'upload', lambda: client.post(
+            f'{next(instances)}/upload', files={'file': (f'leads_{index}_{i}.csv', payload, 'text/csv')},
+            allow_redirects=False))
+        timed(recorder, 'results', lambda: client.get(f'{next(instances)}/results', allow_redirects=False))
+        for name in DOWNLOADS:
+            timed(recorder, 'download', lambda: client.get(f'{next(instances)}/download/{name}',
+                                                           allow_redirects=False))
+
+
+def build_payloads(rows, count):
+    """CSV generati in memoria, con semi diversi per variare i contenuti"""
+    payloads = []
+    for seed in range(count):
+        buffer = io.StringIO(newline='')
+        generate(buffer, rows=rows, seed=seed)
+        payloads.append(buffer.getvalue().encode('utf-8-sig'))
+    return payloads
+
+
+def start_app(port, stub_url, workdir, storage_env=None):
+    """Avvia l'app in un sottoprocesso che usa lo stub Airtable"""
+    env = dict(os.environ)
+    env.update(storage_env or {})
+    env.update({
+        'AIRTABLE_API_URL': stub_url,
+        'AIRTABLE_BASE_ID': 'appLoadTest',
+        'AIRTABLE_API_KEY': 'stub',
+        'SECRET_KEY': 'loadtest',
+        'RAILWAY_ENVIRONMENT_NAME': 'loadtest',  # limite upload a 50MB
+        'PYTHONPATH': ROOT,
+    })
+    os.makedirs(os.path.join(workdir, 'uploads'), exist_ok=True)
+    return subprocess.Popen(
+        [sys.executable, '-c',
+         f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{base_url}/login', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"L'app non risponde su {base_url}")
+
+
+def report(recorder, elapsed):
+    total = sum(len(v) for v in recorder.latencies.values())
+    print(f"{'operazione':<10} {'richieste':>9} {'errori':>7} {'p50 ms':>9} {'p90 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9} {'req/s':>8}")
+    for operation, values in recorder.latencies.items():
+        print(f"{operation:<10} {len(values):>9} {recorder.errors[operation]:>7} "
+              f"{percentile(values, 0.50) * 1000:>9.1f} {percentile(values, 0.90) * 1000:>9.1f} "
+              f"{percentile(values, 0.99) * 1000:>9.1f} {max(values) * 1000:>9.1f} {len(values) / elapsed:>8.1f}")
+    print(f"Totale: {total} richieste in {elapsed:.1f}s ({total / elapsed:.1f} req/s), "
+          f"{sum(recorder.errors.values())} errori")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test dell'app con stub Airtable locale.")
+    parser.add_argument('--base-url', help="app già in esecuzione (default: ne avvia una con lo stub)")
+    parser.add_argument('--app-port', type=int, default=5055, help='porta della prima istanza avviata')
+    parser.add_argument('--instances', type=int, default=1,
+                        help='istanze indipendenti da avviare, ognuna con la propria cartella (default: 1)')
+    parser.add_argument('--storage', choices=['local', 's3'], default='local',
+                        help='storage delle istanze avviate: cartella locale o stub S3 condiviso (default: local)')
+    parser.add_argument('--users', type=int, default=10, help='utenti virtuali concorrenti (default: 10)')
+    parser.add_argument('--iterations', type=int, default=3, help='cicli upload/download per utente (default: 3)')
+    parser.add_argument('--rows', default='10k', help='righe per CSV generato (default: 10k)')
+    parser.add_argument('--payloads', type=int, default=4, help='CSV distinti da generare (default: 4)')
+    parser.add_argument('--latency-ms', type=float, default=100, help='latenza dello stub Airtable (default: 100)')
+    parser.add_argument('--jitter-ms', type=float, default=30)
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help='frazione di risposte 429 dallo stub (default: 0)')
+    parser.add_argument('--rate-limit-rps', type=int, default=0,
+                        help='richieste al secondo oltre le quali lo stub risponde 429 (Airtable: 5; default: nessun limite)')
+    args = parser.parse_args(argv)
+
+    payloads = build_payloads(parse_rows(args.rows), args.payloads)
+    stub = s3 = None
+    app_processes = []
+    workdir = tempfile.TemporaryDirectory()
+    try:
+        base_urls = [args.base_url] if args.base_url else []
+        if not base_urls:
+            stub = make_server(port=0, users=args.users, latency_ms=args.latency_ms,
+                               jitter_ms=args.jitter_ms, rate_limit_ratio=args.rate_limit_ratio,
+                               rate_limit_rps=args.rate_limit_rps)
+            threading.Thread(target=stub.serve_forever, daemon=True).start()
+            stub_url = f'http://127.0.0.1:{stub.server_address[1]}/v0'
+            storage_env = None
+            if args.storage == 's3':
+                s3 = s3_stub.make_server(port=0)
+                threading.Thread(target=s3.serve_forever, daemon=True).start()
+                storage_env = {'STORAGE_BACKEND': 's3', 'S3_ENDPOINT_URL': f'http://127.0.0.1:{s3.server_address[1]}',
+                               'S3_BUCKET': 'utm', 'S3_ACCESS_KEY_ID': 'stub', 'S3_SECRET_ACCESS_KEY': 'stub'}
+            for i in range(args.instances):
+                instance_dir = os.path.join(workdir.name, f'istanza{i}')
+                if storage_env:
+                    storage_env['STORAGE_CACHE_DIR'] = os.path.join(instance_dir, 'cache')
+                app_processes.append(start_app(args.app_port + i, stub_url, instance_dir, storage_env))
+                base_urls.append(f'http://127.0.0.1:{args.app_port + i}')
+        for base_url in base_urls:
+            wait_ready(base_url)
+
+        recorder = Recorder()
+        threads = [threading.Thread(target=virtual_user,
+                                    args=(base_urls, i, args.iterations, payloads, recorder))
+                   for i in range(1, args.users + 1)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(recorder, time.perf_counter() - started)
+        return 1 if sum(recorder.errors.values()) else 0
+    finally:
+        for app_process in app_processes:
+            app_process.terminate()
+            app_process.wait()
+        for server in (stub, s3):
+            if server:
+                server.shutdown()
+        workdir.cleanup()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Object storage locale compatibile S3 (sottoinsieme usato dall'app), in stile MinIO.
+
+Supporta PUT/GET/HEAD/DELETE di oggetti, CopyObject (PUT con x-amz-copy-source) e ListObjectsV2 con indirizzamento
+path-style (/bucket/chiave). Gli oggetti restano in memoria; l'header
+Authorization deve usare la chiave di accesso configurata.
+
+Uso:
+    python -m loadtest.s3_stub --port 9010 --bucket utm --access-key stub
+    STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://127.0.0.1:9010 S3_BUCKET=utm \
+        S3_ACCESS_KEY_ID=stub S3_SECRET_ACCESS_KEY=stub python app.py
+"""
+import argparse
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+
+class ObjectStore:
+    """Bucket in memoria: {bucket: {chiave: (contenuto, ultima modifica)}}"""
+
+    def __init__(self, buckets):
+        self.buckets = {name: {} for name in buckets}
+        self._lock = threading.Lock()
+
+    def put(self, bucket, key, data):
+        with self._lock:
+            self.buckets[bucket][key] = (data, time.time())
+
+    def get(self, bucket, key):
+        return self.buckets[bucket].get(key)
+
+    def delete(self, bucket, key):
+        with self._lock:
+            self.buckets[bucket].pop(key, None)
+
+    def list(self, bucket, prefix, after, max_keys):
+        keys = sorted(k for k in self.buckets[bucket] if k.startswith(prefix) and k > after)
+        return [(k, self.buckets[bucket][k]) for k in keys[:max_keys]], len(keys) > max_keys
+
+
+class S3StubHandler(BaseHTTPRequestHandler):
+    store: ObjectStore = None
+    access_key = 'stub'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='application/xml', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        self._send(status, f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code></Error>'.encode())
+
+    def _route(self):
+        """Restituisce (bucket, chiave, query) se la richiesta è autorizzata, altrimenti risponde con l'errore"""
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('AWS4-HMAC-SHA256 ') or f'Credential={self.access_key}/' not in authorization:
+            self._error(403, 'AccessDenied')
+            return None
+        parsed = urlparse(self.path)
+        bucket, _, key = parsed.path.lstrip('/').partition('/')
+        if bucket not in self.store.buckets:
+            self._error(404, 'NoSuchBucket')
+            return None
+        return bucket, unquote(key), parse_qs(parsed.query)
+
+    def do_PUT(self):
+        route = self._route()
+        if route is None:
+            return
+        bucket, key, _ = route
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('x-amz-content-sha256') != hashlib.sha256(body).hexdigest():
+            return self._error(400, 'XAmzContentSHA256Mismatch')
+        copy_source = self.headers.get('x-amz-copy-source')
+        if copy_source:
+            source_bucket, _, source_key = unquote(copy_source).lstrip('/').partition('/')
+            stored = self.store.get(source_bucket, source_key) if source_bucket in self.store.buckets else None
+            if stored is None:
+                return self._error(404, 'NoSuchKey')
+            if (source_bucket, source_key) == (bucket, key) and self.headers.get('x-amz-metadata-directive') != 'REPLACE':
+                # Come S3: la copia su se stesso richiede di cambiare qualcosa
+                return self._error(400, 'InvalidRequest')
+            self.store.put(bucket, key, stored[0])
+            last_modified = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            etag = hashlib.md5(stored[0]).hexdigest()
+            return self._send(200, (f'<?xml version="1.0" encoding="UTF-8"?><CopyObjectResult>'
+                                    f'<LastModified>{last_modified}</LastModified><ETag>"{etag}"</ETag>'
+                                    f'</CopyObjectResult>').encode())
+        self.store.put(bucket, key, body)
+        self._send(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+    def do_GET(self):
+        route = self._route()
+        if route is None:
+            return
+        bucket, key, query = route
+        if not key:
+            return self._list(bucket, query)
+        stored = self.store.get(bucket, key)
+        if stored is None:
+            return self._error(404, 'NoSuchKey')
+        self._send(200, stored[0], 'application/octet-stream')
+
+    def do_HEAD(self):
+        route = self._route()
+        if route is None:
+            return
+        bucket, key, _ = route
+        stored = self.store.get(bucket, key)
+        if stored is None:
+            return self._send(404)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(stored[0])))
+        self.end_headers()
+
+    def do_DELETE(self):
+        route = self._route()
+        if route is None:
+            return
+        bucket, key, _ = route
+        self.store.delete(bucket, key)
+        self._send(204)
+
+    def _list(self, bucket, query):
+        prefix = query.get('prefix', [''])[0]
+        after = query.get('continuation-token', [''])[0]
+        max_keys = int(query.get('max-keys', ['1000'])[0])
+        items, truncated = self.store.list(bucket, prefix, after, max_keys)
+        contents = ''.join(
+            f'<Contents><Key>{escape(key)}</Key><Size>{len(data)}</Size>'
+            f'<LastModified>{datetime.fromtimestamp(modified, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]}Z'
+            f'</LastModified></Contents>'
+            for key, (data, modified) in items
+        )
+        token = f'<NextContinuationToken>{escape(items[-1][0])}</NextContinuationToken>' if truncated else ''
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                f'<Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(items)}</KeyCount>'
+                f'<IsTruncated>{"true" if truncated else "false"}</IsTruncated>{token}{contents}'
+                '</ListBucketResult>')
+        self._send(200, body.encode('utf-8'))
+
+
+def make_server(host='127.0.0.1', port=9010, bucket='utm', access_key='stub'):
+    """Crea il server stub (non avviato); port=0 sceglie una porta libera"""
+    handler = type('ConfiguredS3StubHandler', (S3StubHandler,), {
+        'store': ObjectStore([bucket]),
+        'access_key': access_key,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Object storage locale compatibile S3.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9010)
+    parser.add_argument('--bucket', default='utm')
+    parser.add_argument('--access-key', default='stub')
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.bucket, args.access_key)
+    print(f"Stub S3 su http://{args.host}:{server.server_address[1]} (bucket '{args.bucket}')")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
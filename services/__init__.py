@@ -1,3 +1,9 @@
-from .airtable_service import AirtableService
+__all__ = ['AirtableService']
 
-__all__ = ['AirtableService']
\ No newline at end of file
+
+def __getattr__(name):
+    # Import al primo utilizzo: requests (usato dal client Airtable) è costoso da caricare
+    if name == 'AirtableService':
+        from .airtable_service import AirtableService
+        return AirtableService
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,211 @@
+import csv
+import re
+import threading
+from collections import OrderedDict
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, List, Optional
+
+from services.metrics import registry, stage
+from services.storage import get_storage, upload_key
+from services.time_index import parse_timestamp
+
+registry.counter('ad_spend_joins_total', 'Join tra export della spesa e lead per inserzione, per esito')
+
+# Colonne dell'export di Gestione Inserzioni di Meta (italiano e inglese), confrontate in minuscolo
+# e per prefisso: es. "Importo speso (EUR)" o "Amount spent (USD)"
+SPEND_COLUMNS = {
+    'ad_id': ('id inserzione', 'ad id', 'ad_id'),
+    'spesa': ('importo speso', 'amount spent', 'spesa', 'spend'),
+    'impression': ('impression',),
+    'clic': ('clic sul link', 'link clicks', 'clic (tutti)', 'clicks (all)', 'clic', 'clicks'),
+    'giorno': ('giorno', 'day', 'inizio report', 'reporting starts', 'date')
+}
+# Colonne obbligatorie: senza impression e clic si calcola solo il CPL
+REQUIRED_COLUMNS = ('ad_id', 'spesa')
+DELIMITERS = ',;\t'
+# Righe lette per capire il separatore dei decimali della spesa
+DECIMAL_SAMPLE_ROWS = 200
+
+# Join già calcolati, per file della spesa, analisi e intervallo di date
+_joins: 'OrderedDict[tuple, Dict[str, List[float]]]' = OrderedDict()
+_joins_lock = threading.Lock()
+MAX_CACHED_JOINS = 64
+
+
+def parse_number(value: Optional[str], integer: bool = False, decimal: str = '.') -> float:
+    """Numero da un export (1234.56, 1.234,56 o 1,234.56, con eventuale valuta); 0 se vuoto.
+    decimal è il separatore dei decimali del file (vedi detect_decimal): l'altro separa le migliaia.
+    Per i conteggi (integer=True) punti e virgole sono sempre separatori delle migliaia."""
+    value = re.sub(r'[^0-9,.\-]', '', value or '')
+    if integer:
+        value = value.replace('.', '').replace(',', '')
+    else:
+        value = value.replace(',' if decimal == '.' else '.', '').replace(decimal, '.')
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def detect_decimal(values: Iterable[str], delimiter: str) -> str:
+    """Separatore dei decimali di un export, deciso una volta per file dagli importi campione.
+
+    Un importo con punto e virgola, un separatore ripetuto o seguito da un numero di cifre
+    diverso da 3 indica quale dei due è il decimale; senza indizi (es. solo "12,500") vale la
+    convenzione del delimitatore: virgola con ";" (export italiani), punto altrimenti.
+    """
+    votes = {'.': 0, ',': 0}
+    for value in values:
+        value = re.sub(r'[^0-9,.]', '', value or '')
+        if ',' in value and '.' in value:
+            votes[',' if value.rfind(',') > value.rfind('.') else '.'] += 1
+            continue
+        for separator, other in (('.', ','), (',', '.')):
+            if value.count(separator) > 1:
+                votes[other] += 1
+            elif separator in value and len(value) - value.index(separator) != 4:
+                votes[separator] += 1
+    if votes['.'] != votes[',']:
+        return max(votes, key=votes.get)
+    return ',' if delimiter == ';' else '.'
+
+
+def parse_day(value: Optional[str]) -> Optional[int]:
+    """Timestamp del giorno di una riga (YYYY-MM-DD, o DD/MM/YYYY degli export in italiano, come
+    la colonna Data dei lead; l'eventuale ora si ignora), o None se assente o non valido"""
+    parts = (value or '').split()
+    return parse_timestamp(parts[0], '') if parts else None
+
+
+def find_columns(header: List[str]) -> Dict[str, int]:
+    """Posizione delle colonne note nell'intestazione (la prima corrispondenza per ogni campo)"""
+    normalized = [name.strip().lstrip('﻿').lower() for name in header]
+    columns = {}
+    for field, aliases in SPEND_COLUMNS.items():
+        for alias in aliases:
+            index = next((i for i, name in enumerate(normalized) if name.startswith(alias)), None)
+            if index is not None:
+                columns[field] = index
+                break
+    return columns
+
+
+def join_spend(lines: Iterable[str], terms: Iterable[str], start: Optional[int] = None,
+               end: Optional[int] = None) -> Dict[str, Any]:
+    """Somma spesa, impression e clic dell'export per ogni inserzione presente tra i lead.
+
+    La tabella hash si costruisce con gli utm_term dell'analisi (già in memoria e limitati al numero
+    di inserzioni) e l'export si legge riga per riga: in memoria restano solo i totali delle
+    inserzioni in comune, qualunque sia la dimensione del file. Con un intervallo di date e una
+    colonna del giorno si contano solo i giorni dell'intervallo.
+    """
+    table = {term: None for term in terms}
+    lines = iter(lines)
+    first = next(lines, '')
+    delimiter = max(DELIMITERS, key=first.count)
+    header = next(csv.reader([first], delimiter=delimiter), [])
+    columns = find_columns(header)
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        return {'error': "Export della spesa senza le colonne ID inserzione e importo speso"}
+
+    ad_column, spend_column = columns['ad_id'], columns['spesa']
+    impression_column, click_column = columns.get('impression'), columns.get('clic')
+    day_column = columns.get('giorno') if start is not None or end is not None else None
+    reader = csv.reader(lines, delimiter=delimiter)
+    sample = list(islice(reader, DECIMAL_SAMPLE_ROWS))
+    decimal = detect_decimal((row[spend_column] for row in sample if len(row) > spend_column), delimiter)
+    rows = matched_rows = 0
+    unmatched_spend = 0.0
+    for row in chain(sample, reader):
+        if len(row) <= max(ad_column, spend_column):
+            continue
+        rows += 1
+        if day_column is not None and day_column < len(row):
+            day = parse_day(row[day_column])
+            if day is not None and ((start is not None and day < start) or (end is not None and day > end)):
+                continue
+        ad_id = row[ad_column].strip()
+        if ad_id not in table:
+            unmatched_spend += parse_number(row[spend_column], decimal=decimal)
+            continue
+        matched_rows += 1
+        totals = table[ad_id]
+        if totals is None:
+            totals = table[ad_id] = [0.0, 0, 0]
+        totals[0] += parse_number(row[spend_column], decimal=decimal)
+        if impression_column is not None and impression_column < len(row):
+            totals[1] += int(parse_number(row[impression_column], integer=True))
+        if click_column is not None and click_column < len(row):
+            totals[2] += int(parse_number(row[click_column], integer=True))
+
+    return {
+        'totals': {term: totals for term, totals in table.items() if totals is not None},
+        'rows': rows,
+        'matched_rows': matched_rows,
+        'unmatched_spend': round(unmatched_spend, 2),
+        'has_impressions': impression_column is not None,
+        'has_clicks': click_column is not None
+    }
+
+
+def load_spend(spend_id: str, upload_ids: List[str], terms: Iterable[str], start: Optional[int] = None,
+               end: Optional[int] = None) -> Dict[str, Any]:
+    """Join dell'export della spesa caricato (sha256) con le inserzioni dell'analisi, in cache"""
+    key = (spend_id, tuple(upload_ids), start, end)
+    with _joins_lock:
+        joined = _joins.get(key)
+        if joined is not None:
+            _joins.move_to_end(key)
+            return joined
+
+    path = get_storage().local_path(upload_key(spend_id))
+    if path is None:
+        return {'error': 'Export della spesa non più disponibile, caricalo di nuovo'}
+    with stage('join'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as spend_file:
+            joined = join_spend(spend_file, terms, start, end)
+    registry.inc('ad_spend_joins_total', result='error' if 'error' in joined else 'ok')
+    if 'error' not in joined:
+        with _joins_lock:
+            _joins[key] = joined
+            while len(_joins) > MAX_CACHED_JOINS:
+                _joins.popitem(last=False)
+    return joined
+
+
+def add_cost_columns(rows: List[Dict[str, Any]], joined: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Copie delle righe per inserzione con spesa, impression, clic, CPL e CTR (vuoti senza dati)"""
+    enriched = []
+    for row in rows:
+        totals = joined['totals'].get(row['utm_term'])
+        spesa = impression = clic = None
+        if totals is not None:
+            spesa = round(totals[0], 2)
+            impression = totals[1] if joined['has_impressions'] else None
+            clic = totals[2] if joined['has_clicks'] else None
+        enriched.append(dict(
+            row,
+            spesa=spesa,
+            impression=impression,
+            clic=clic,
+            cpl=round(spesa / row['numero_lead'], 2) if spesa is not None and row['numero_lead'] else None,
+            ctr=round(clic / impression * 100, 2) if clic is not None and impression else None
+        ))
+    return enriched
+
+
+def spend_summary(rows: List[Dict[str, Any]], joined: Dict[str, Any]) -> Dict[str, Any]:
+    """Totali per la pagina dei risultati: spesa delle inserzioni con lead, CPL e CTR complessivi"""
+    matched = [row for row in rows if row['spesa'] is not None]
+    spesa = sum(row['spesa'] for row in matched)
+    leads = sum(row['numero_lead'] for row in matched)
+    impressions = sum(row['impression'] or 0 for row in matched)
+    clicks = sum(row['clic'] or 0 for row in matched)
+    return {
+        'spesa': round(spesa, 2),
+        'cpl': round(spesa / leads, 2) if leads else None,
+        'ctr': round(clicks / impressions * 100, 2) if joined['has_clicks'] and impressions else None,
+        'matched_ads': len(matched),
+        'unmatched_spend': joined['unmatched_spend']
+    }
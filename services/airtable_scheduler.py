@@ -0,0 +1,113 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from services.metrics import registry
+
+registry.gauge('airtable_queue_depth', 'Chiamate Airtable in attesa di un token del rate limiter')
+registry.histogram('airtable_queue_wait_seconds', 'Attesa delle chiamate Airtable nel rate limiter')
+registry.counter('airtable_coalesced_total', 'Letture Airtable servite dalla risposta di una richiesta identica in corso')
+
+
+class TokenBucket:
+    """Rate limiter a token bucket: in media rate richieste al secondo, con picchi fino a burst.
+
+    Ogni chiamata prenota il proprio token (anche nel futuro) e attende il suo turno,
+    quindi le richieste passano nell'ordine di arrivo, senza attese attive. Con shared=True
+    lo stato è in memoria condivisa: se creato prima del fork (gunicorn con preload_app)
+    il limite vale per tutti i processi insieme.
+    """
+
+    def __init__(self, rate: float, burst: float, shared: bool = False):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        # [token disponibili, istante dell'ultimo aggiornamento]
+        self._state = None
+        if shared:
+            try:
+                import multiprocessing
+                self._state = multiprocessing.RawArray('d', [self.burst, time.monotonic()])
+                self._lock = multiprocessing.Lock()
+            except (ImportError, OSError) as e:
+                # Es. ambienti serverless senza /dev/shm: limite per processo
+                print(f"Rate limiter condiviso non disponibile, uso quello per processo: {e}")
+                self._state = None
+        if self._state is None:
+            self._state = [self.burst, time.monotonic()]
+            self._lock = threading.Lock()
+        self._waiting = 0
+        self._waiting_lock = threading.Lock()
+
+    def _reserve(self, timeout: Optional[float]) -> Optional[float]:
+        """Prenota un token; restituisce l'attesa necessaria o None se supera timeout"""
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._state[0] + (now - self._state[1]) * self.rate)
+            wait = max(0.0, (1 - tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return None
+            self._state[0] = tokens - 1
+            self._state[1] = now
+            return wait
+
+    def _set_waiting(self, delta: int):
+        with self._waiting_lock:
+            self._waiting += delta
+            registry.set('airtable_queue_depth', self._waiting)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Attende un token; False (senza consumarlo) se non arriverebbe entro timeout secondi"""
+        if self.rate <= 0:
+            return True
+        wait = self._reserve(timeout)
+        if wait is None:
+            return False
+        registry.observe('airtable_queue_wait_seconds', wait)
+        if wait:
+            self._set_waiting(1)
+            try:
+                time.sleep(wait)
+            finally:
+                self._set_waiting(-1)
+        return True
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Esegue una sola volta le chiamate identiche contemporanee: chi arriva mentre la
+    prima è in corso ne attende e ne condivide il risultato (o l'eccezione)"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            registry.inc('airtable_coalesced_total')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
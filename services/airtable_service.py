@@ -1,18 +1,134 @@
-import requests
+import atexit
 import os
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Any
+from urllib.parse import unquote
+
+from config import Config
+from services.airtable_scheduler import SingleFlight, TokenBucket
+from services.metrics import registry, stage
+from services.ttl_cache import MISSING, TTLCache
+from services.write_behind import WriteBehindQueue
+
+if TYPE_CHECKING:
+    import requests
+
+# Pool condiviso per le chiamate in parallelo (fetch_many), creato al primo utilizzo
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _executor = ThreadPoolExecutor(max_workers=Config.AIRTABLE_MAX_CONCURRENCY,
+                                           thread_name_prefix='airtable')
+        return _executor
+
+# Limite di Airtable: 5 richieste al secondo per base. Con burst + rate <= 5 non si supera
+# in nessun intervallo di un secondo
+_rate_limiter = TokenBucket(Config.AIRTABLE_RATE_LIMIT, Config.AIRTABLE_RATE_BURST,
+                            shared=Config.AIRTABLE_SHARED_RATE_LIMIT)
+_single_flight = SingleFlight()
+
+# Profili e preferenze letti di recente, per user_id (in ogni processo; con AIRTABLE_SHARED_CACHE
+# un salvataggio delle preferenze invalida le copie degli altri worker)
+_profiles = TTLCache(Config.AIRTABLE_CACHE_TTL, name='airtable_profile', shared=Config.AIRTABLE_SHARED_CACHE)
+_preferences = TTLCache(Config.AIRTABLE_CACHE_TTL, name='airtable_preferences', shared=Config.AIRTABLE_SHARED_CACHE)
+
+# Campi della tabella "Preferenze utente" per ogni preferenza
+PREFERENCE_FIELDS = {'tema_interfaccia': 'Tema interfaccia', 'json_pref': 'json pref'}
+# Record per chiamata di scrittura multipla (limite di Airtable)
+UPSERT_BATCH_SIZE = 10
+
+# Salvataggi delle preferenze in attesa, per user_id: più modifiche dello stesso utente
+# diventano un solo record, scritto in un'unica chiamata insieme a quelli di altri utenti
+_preferences_writer = WriteBehindQueue(
+    'preferences', lambda batch: AirtableService().upsert_user_preferences(batch),
+    interval=Config.PREFERENCES_FLUSH_INTERVAL, batch_size=UPSERT_BATCH_SIZE,
+    on_discard=_preferences.delete)
+atexit.register(_preferences_writer.close)
+
+def flush_pending_writes():
+    """Scrive subito i salvataggi in attesa (all'uscita di un worker)"""
+    _preferences_writer.close()
 
 class AirtableService:
     def __init__(self):
         self.api_key = os.getenv('AIRTABLE_API_KEY')
         self.base_id = os.getenv('AIRTABLE_BASE_ID')
-        self.base_url = f'https://api.airtable.com/v0/{self.base_id}'
+        self.base_url = f"{os.getenv('AIRTABLE_API_URL') or 'https://api.airtable.com/v0'}/{self.base_id}"
         self.headers = {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
         }
     
+    def _request(self, method: str, url: str, **kwargs) -> 'requests.Response':
+        """Esegue una chiamata HTTP verso Airtable; le letture identiche in corso condividono la risposta"""
+        if method == 'GET':
+            params = kwargs.get('params') or {}
+            key = (url, tuple(sorted((name, str(value)) for name, value in params.items())))
+            return _single_flight.do(key, lambda: self._send(method, url, **kwargs))
+        return self._send(method, url, **kwargs)
+    
+    def _send(self, method: str, url: str, **kwargs) -> 'requests.Response':
+        """Esegue la chiamata nel rispetto del rate limit, ripetendola dopo un 429, e ne registra la latenza"""
+        # requests viene importato alla prima chiamata, non all'avvio dell'app
+        import requests
+        table = unquote(url[len(self.base_url):].lstrip('/').split('/')[0])
+        kwargs.setdefault('timeout', Config.AIRTABLE_TIMEOUT)
+        deadline = time.monotonic() + Config.AIRTABLE_TIMEOUT
+        attempt = 0
+        while True:
+            if not _rate_limiter.acquire(timeout=deadline - time.monotonic()):
+                raise requests.Timeout(f"Coda delle chiamate Airtable oltre la scadenza ({table})")
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                with stage('airtable'):
+                    response = requests.request(method, url, headers=self.headers, **kwargs)
+                status = str(response.status_code)
+            finally:
+                registry.observe('airtable_request_duration_seconds', time.perf_counter() - started,
+                                 table=table, method=method)
+                registry.inc('airtable_requests_total', table=table, method=method, status=status)
+            
+            if response.status_code != 429 or attempt >= Config.AIRTABLE_MAX_RETRIES:
+                return response
+            # Limite superato (es. altre istanze sulla stessa base): si riprova dopo una pausa crescente
+            pause = float(response.headers.get('Retry-After') or 2 ** attempt)
+            if time.monotonic() + pause > deadline:
+                return response
+            time.sleep(pause)
+            attempt += 1
+    
+    def fetch_many(self, calls: Dict[str, Callable[[], Any]], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Esegue in parallelo letture indipendenti (es. profilo e preferenze) con una scadenza comune.
+
+        Restituisce {nome: risultato}; le chiamate non concluse entro la scadenza valgono None.
+        """
+        from concurrent.futures import wait
+
+        executor = _get_executor()
+        with stage('airtable_parallel'):
+            futures = {name: executor.submit(call) for name, call in calls.items()}
+            wait(futures.values(), timeout=timeout or Config.AIRTABLE_TIMEOUT)
+
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                print(f"Chiamata Airtable '{name}' oltre la scadenza")
+                results[name] = None
+            elif future.exception() is not None:
+                print(f"Errore nella chiamata Airtable '{name}': {future.exception()}")
+                results[name] = None
+            else:
+                results[name] = future.result()
+        return results
+    
     def authenticate_user(self, username: str, password: str) -> Optional[Dict[str, Any]]:
         """Autentica un utente verificando username e password"""
         try:
@@ -27,7 +143,7 @@ class AirtableService:
             
 
             
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self._request('GET', url, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -60,56 +176,43 @@ class AirtableService:
             print(f"Errore durante l'autenticazione: {e}")
             return None
     
+    def _fetch_licenses(self, user_id: str, app_name: str) -> List[Dict[str, Any]]:
+        """Licenze dell'utente per l'applicazione; solleva un'eccezione se Airtable non risponde"""
+        # Dato che i filtri non funzionano con gli array, si filtrano per applicazione
+        # e si cerca l'utente in Utente_Collegato
+        url = f"{self.base_url}/Licenze"
+        params = {
+            'filterByFormula': f"{{Applicazione}} = '{app_name}'"
+        }
+        
+        response = self._request('GET', url, params=params)
+        response.raise_for_status()
+        
+        data = response.json()
+        
+        licenses = []
+        
+        for record in data.get('records', []):
+            fields = record['fields']
+            # Controlla se l'user_id è nell'array Utente_Collegato
+            utenti_collegati = fields.get('Utente_Collegato', [])
+            
+            if user_id in utenti_collegati:
+                license_data = {
+                    'id': record['id'],
+                    'stato': fields.get('Stato'),
+                    'applicazione': fields.get('Applicazione'),
+                    'username': fields.get('Username'),
+                    'data_creazione': fields.get('Data_Creazione')
+                }
+                licenses.append(license_data)
+        
+        return licenses
+    
     def get_user_licenses(self, user_id: str, app_name: str):
         """Recupera le licenze di un utente per una specifica applicazione"""
         try:
-    
-            
-            # Prima stampa tutte le licenze disponibili
-            all_licenses_url = f"{self.base_url}/Licenze"
-            all_licenses_response = requests.get(all_licenses_url, headers=self.headers)
-            all_licenses_response.raise_for_status()
-            all_licenses_data = all_licenses_response.json()
-
-            
-            # Cerca le licenze nella tabella Licenze
-            # Dato che i filtri non funzionano con gli array, prendiamo tutti i record e filtriamo manualmente
-            filter_formula = f"{{Applicazione}} = '{app_name}'"
-
-            
-            url = f"{self.base_url}/Licenze"
-            params = {
-                'filterByFormula': filter_formula
-            }
-            
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-
-            
-            licenses = []
-            
-            for record in data.get('records', []):
-                fields = record['fields']
-                # Controlla se l'user_id è nell'array Utente_Collegato
-                utenti_collegati = fields.get('Utente_Collegato', [])
-
-                
-                if user_id in utenti_collegati:
-                    license_data = {
-                        'id': record['id'],
-                        'stato': fields.get('Stato'),
-                        'applicazione': fields.get('Applicazione'),
-                        'username': fields.get('Username'),
-                        'data_creazione': fields.get('Data_Creazione')
-                    }
-                    licenses.append(license_data)
-
-            
-
-            return licenses
-            
+            return self._fetch_licenses(user_id, app_name)
         except Exception as e:
             print(f"Errore durante il recupero delle licenze: {e}")
             return []
@@ -127,7 +230,8 @@ class AirtableService:
     def verify_license(self, user_id: str, app_name: str) -> Dict[str, Any]:
         """Verifica se l'utente ha una licenza attiva per l'applicazione specificata"""
         try:
-            licenses = self.get_user_licenses(user_id, app_name)
+            # Un errore di Airtable (es. 429) non deve risultare come licenza non attiva
+            licenses = self._fetch_licenses(user_id, app_name)
             
             for license in licenses:
                 if license.get('stato') == 'Attivo':
@@ -153,103 +257,155 @@ class AirtableService:
     # Funzione di logging rimossa - non necessaria per il funzionamento base
     
     def get_user_profile(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Recupera il profilo completo di un utente"""
+        """Recupera il profilo completo di un utente (dalla cache se letto da poco)"""
+        cached = _profiles.get(user_id)
+        if cached is not MISSING:
+            return dict(cached)
         try:
             url = f"{self.base_url}/Utenti/{user_id}"
+            version = _profiles.version(user_id)
             
-            response = requests.get(url, headers=self.headers)
+            response = self._request('GET', url)
             response.raise_for_status()
             
             data = response.json()
             fields = data['fields']
             
-            return {
+            profile = {
                 'id': data['id'],
                 'user_id': fields.get('user_id'),
                 'username': fields.get('username'),
                 'name': fields.get('Name'),
                 'incrementale': fields.get('Incrementale')
             }
+            _profiles.set(user_id, profile, version=version)
+            return dict(profile)
             
         except Exception as e:
             print(f"Errore durante il recupero del profilo: {e}")
             return None
     
+    @staticmethod
+    def _parse_preferences(record: Dict[str, Any]) -> Dict[str, Any]:
+        fields = record['fields']
+        return {
+            'id': record['id'],
+            'tema_interfaccia': fields.get('Tema interfaccia'),
+            'json_pref': fields.get('json pref')
+        }
+    
+    def _fetch_preferences(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Legge da Airtable le preferenze (None se l'utente non ne ha) e le mette in cache"""
+        url = f"{self.base_url}/Preferenze utente"
+        params = {
+            'filterByFormula': f"{{user_id}} = '{user_id}'",
+            'maxRecords': 1
+        }
+        version = _preferences.version(user_id)
+        
+        response = self._request('GET', url, params=params)
+        response.raise_for_status()
+        
+        data = response.json()
+        preferences = self._parse_preferences(data['records'][0]) if data.get('records') else None
+        # Si ricorda anche l'assenza del record: l'aggiornamento sa già di doverlo creare.
+        # Se nel frattempo un altro processo le ha salvate, il valore letto non va in cache
+        _preferences.set(user_id, preferences, version=version)
+        return preferences
+    
     def get_user_preferences(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Recupera le preferenze di un utente"""
-        try:
-            url = f"{self.base_url}/Preferenze utente"
-            params = {
-                'filterByFormula': f"{{user_id}} = '{user_id}'",
-                'maxRecords': 1
-            }
-            
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            if not data.get('records'):
-                return None
-            
-            record = data['records'][0]
-            fields = record['fields']
-            
-            return {
-                'id': record['id'],
-                'tema_interfaccia': fields.get('Tema interfaccia'),
-                'json_pref': fields.get('json pref')
-            }
-            
-        except Exception as e:
-            print(f"Errore durante il recupero delle preferenze: {e}")
-            return None
+        """Recupera le preferenze di un utente (dalla cache se lette o scritte da poco),
+        comprese le modifiche non ancora salvate su Airtable"""
+        preferences = _preferences.get(user_id)
+        if preferences is MISSING:
+            try:
+                preferences = self._fetch_preferences(user_id)
+            except Exception as e:
+                print(f"Errore durante il recupero delle preferenze: {e}")
+                preferences = None
+        
+        pending = _preferences_writer.pending(user_id)
+        if pending:
+            preferences = dict(preferences or {'id': None, 'tema_interfaccia': None, 'json_pref': None})
+            preferences.update({key: pending[field] for key, field in PREFERENCE_FIELDS.items()
+                                if field in pending})
+        return dict(preferences) if preferences else None
     
     def update_user_preferences(self, user_id: str, preferences: Dict[str, Any]) -> bool:
-        """Aggiorna le preferenze di un utente"""
+        """Aggiorna le preferenze di un utente (tema_interfaccia, json_pref).
+
+        Con PREFERENCES_FLUSH_INTERVAL > 0 la modifica viene accodata e scritta in background
+        (upsert a gruppi); altrimenti viene scritta subito.
+        """
+        fields = {field: preferences[key] for key, field in PREFERENCE_FIELDS.items() if key in preferences}
+        if Config.PREFERENCES_FLUSH_INTERVAL > 0:
+            _preferences_writer.submit(user_id, fields)
+            return True
+        return self._write_preferences(user_id, fields)
+    
+    def _write_preferences(self, user_id: str, fields: Dict[str, Any]) -> bool:
+        """Scrive subito le preferenze e aggiorna la cache.
+
+        Con il record già in cache basta una sola chiamata (PATCH, o POST se non esiste).
+        """
         try:
-            # Prima trova il record delle preferenze
-            url = f"{self.base_url}/Preferenze utente"
-            params = {
-                'filterByFormula': f"{{user_id}} = '{user_id}'",
-                'maxRecords': 1
-            }
-            
-            response = requests.get(url, headers=self.headers, params=params)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            if data.get('records'):
-                # Aggiorna il record esistente
-                record_id = data['records'][0]['id']
-                update_url = f"{self.base_url}/Preferenze utente/{record_id}"
-                
-                update_data = {
-                    'fields': {
-                        'Tema interfaccia': preferences.get('tema_interfaccia'),
-                        'json pref': preferences.get('json_pref', '')
-                    }
-                }
+            for attempt in range(2):
+                current = _preferences.get(user_id)
+                if current is MISSING:
+                    # Record non in cache: serve una lettura per sapere se aggiornarlo o crearlo
+                    current = self._fetch_preferences(user_id)
                 
-                response = requests.patch(update_url, headers=self.headers, json=update_data)
+                url = f"{self.base_url}/Preferenze utente"
+                if current:
+                    # Aggiorna il record esistente
+                    response = self._request('PATCH', f"{url}/{current['id']}", json={'fields': fields})
+                    if response.status_code == 404 and attempt == 0:
+                        # Record eliminato su Airtable dopo la lettura: si rilegge
+                        _preferences.delete(user_id)
+                        continue
+                else:
+                    # Crea un nuovo record
+                    response = self._request('POST', url, json={'fields': {**fields, 'Utente': [user_id]}})
                 response.raise_for_status()
-            else:
-                # Crea un nuovo record
-                create_data = {
-                    'fields': {
-                        'Tema interfaccia': preferences.get('tema_interfaccia'),
-                        'json pref': preferences.get('json_pref', ''),
-                        'Utente': [user_id]
-                    }
-                }
                 
-                response = requests.post(url, headers=self.headers, json=create_data)
-                response.raise_for_status()
-            
-            return True
+                _preferences.invalidate(user_id)
+                _preferences.set(user_id, self._parse_preferences(response.json()))
+                return True
             
         except Exception as e:
+            _preferences.delete(user_id)
             print(f"Errore durante l'aggiornamento delle preferenze: {e}")
             return False
     
+    def upsert_user_preferences(self, batch: Dict[str, Dict[str, Any]]):
+        """Scrive le preferenze di più utenti ({user_id: campi}, al massimo 10) con al più due
+        chiamate: PATCH dei record esistenti per id (dalla cache) e POST di quelli mancanti.
+        user_id è un lookup calcolato da Utente e non si può scrivere né usare per l'upsert.
+        Solleva un'eccezione se la scrittura non riesce.
+        """
+        url = f"{self.base_url}/Preferenze utente"
+        updates, creates = [], []
+        for user_id, fields in batch.items():
+            current = _preferences.get(user_id)
+            if current is MISSING:
+                current = self._fetch_preferences(user_id)
+            if current and current.get('id'):
+                updates.append((user_id, {'id': current['id'], 'fields': fields}))
+            else:
+                creates.append((user_id, {'fields': {**fields, 'Utente': [user_id]}}))
+        
+        for method, items in (('PATCH', updates), ('POST', creates)):
+            if not items:
+                continue
+            response = self._request(method, url, json={'records': [record for _, record in items]})
+            if not response.ok:
+                # Record eliminati dopo la lettura: al prossimo tentativo si rileggono
+                for user_id, _ in items:
+                    _preferences.delete(user_id)
+            response.raise_for_status()
+            # Airtable restituisce i record nello stesso ordine della richiesta
+            for (user_id, _), record in zip(items, response.json().get('records', [])):
+                _preferences.invalidate(user_id)
+                _preferences.set(user_id, self._parse_preferences(record))
+    
     # Funzione di recupero log rimossa - non necessaria per il funzionamento base
\ No newline at end of file
@@ -0,0 +1,234 @@
+import hashlib
+import hmac
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+from config import Config
+from services.metrics import record_cache, stage
+from services.storage import ANALYSES_PREFIX, get_storage, upload_key
+from services.time_index import TimeIndex
+
+
+# HMAC-SHA256 che precede ogni analisi salvata nello storage
+SIGNATURE_BYTES = 32
+
+# Pool di processi per l'analisi, uno per processo (worker gunicorn) e creato al primo utilizzo
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(max_workers: int):
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # I worker gunicorn hanno più thread: un fork potrebbe copiare lock già acquisiti da
+            # altri thread, quindi i processi si creano da un server dedicato (o da zero)
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def shutdown_pool():
+    """Chiude il pool di processi dell'analisi (all'uscita di un worker)"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and _pool_pid == os.getpid():
+        pool.shutdown(wait=True)
+
+
+def analyze_files(file_paths: List[str], max_workers: int = 1) -> List[Dict[str, Any]]:
+    """Analizza più file in parallelo sul pool di processi condiviso (in sequenza se non disponibile)"""
+    global _pool
+    # Import al primo utilizzo: non pesano sull'avvio a freddo dell'app
+    from services.csv_analysis import process_csv
+
+    if max_workers > 1 and len(file_paths) > 1:
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            # Nei processi figli i tempi delle singole fasi non sono visibili: si misura il totale
+            with stage('parse'):
+                return list(_get_pool(max_workers).map(process_csv, file_paths))
+        except (OSError, NotImplementedError, BrokenProcessPool) as e:
+            # Ambienti serverless senza supporto al multiprocessing, o processo del pool terminato
+            print(f"Pool di processi non disponibile, analisi sequenziale: {e}")
+            with _pool_lock:
+                _pool = None
+    return [process_csv(path) for path in file_paths]
+
+
+class AnalysisCache:
+    """Cache delle analisi CSV, indicizzata per contenuto dei file caricati (sha256).
+
+    Il primo livello è in memoria nel processo; il secondo è lo storage degli
+    artefatti, condiviso tra worker e istanze: un'analisi fatta altrove viene
+    riutilizzata senza ricaricare né rileggere il CSV.
+    """
+
+    def __init__(self, max_entries: int = 8, workers: int = 1, storage=None,
+                 shared_max_bytes: int = 1024 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.workers = workers
+        self._storage = storage
+        self.shared_max_bytes = shared_max_bytes
+        self._entries: 'OrderedDict[tuple, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def storage(self):
+        return self._storage or get_storage()
+
+    @staticmethod
+    def _shared_key(key: tuple) -> str:
+        digest = hashlib.sha256('-'.join(key).encode('utf-8')).hexdigest()
+        return f'{ANALYSES_PREFIX}{digest}.pickle'
+
+    @staticmethod
+    def _signature(data: bytes) -> bytes:
+        return hmac.new(Config.SECRET_KEY.encode('utf-8'), data, hashlib.sha256).digest()
+
+    def _load_shared(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """Legge un'analisi salvata nello storage da un altro worker o istanza, se presente"""
+        shared_key = self._shared_key(key)
+        entry = None
+        try:
+            data = self.storage.get_bytes(shared_key)
+            if data is not None:
+                # Si deserializza solo un contenuto firmato dall'app (SECRET_KEY): chi può scrivere
+                # nel bucket non può far eseguire codice ai worker con un pickle arbitrario
+                signature, payload = data[:SIGNATURE_BYTES], data[SIGNATURE_BYTES:]
+                if not hmac.compare_digest(signature, self._signature(payload)):
+                    raise ValueError('firma non valida')
+                entry = pickle.loads(payload)
+                self.storage.touch(shared_key)
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            print(f"Analisi salvata non leggibile, verrà ripetuta: {e}")
+            entry = None
+        record_cache('analysis_shared', entry is not None)
+        return entry
+
+    def _store_shared(self, key: tuple, entry: Dict[str, Any]):
+        """Salva l'analisi nello storage e applica il limite di spazio"""
+        try:
+            payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+            self.storage.put_bytes(self._shared_key(key), self._signature(payload) + payload)
+            self._evict_shared()
+        except OSError as e:
+            print(f"Impossibile salvare l'analisi nello storage: {e}")
+
+    def _evict_shared(self):
+        """Elimina le analisi salvate meno recenti oltre lo spazio massimo"""
+        objects = sorted(self.storage.list(ANALYSES_PREFIX), key=lambda item: item[2], reverse=True)
+        total = 0
+        for key, size, _ in objects:
+            total += size
+            if total > self.shared_max_bytes:
+                self.storage.delete(key)
+
+    def _remember(self, key: tuple, entry: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def cached(self, upload_ids: Union[str, List[str]]) -> Optional[Dict[str, Any]]:
+        """Analisi dei file già disponibile in memoria o nello storage, senza processarli (None se assente)"""
+        if isinstance(upload_ids, str):
+            upload_ids = [upload_ids]
+        key = tuple(upload_ids)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        record_cache('analysis', entry is not None)
+        if entry is not None:
+            return entry
+
+        entry = self._load_shared(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def get(self, upload_ids: Union[str, List[str]], names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Restituisce l'analisi dei file caricati (unita se più di uno), processandoli solo se necessario"""
+        if isinstance(upload_ids, str):
+            upload_ids = [upload_ids]
+        key = tuple(upload_ids)
+        entry = self.cached(upload_ids)
+        if entry is not None:
+            return entry
+
+        file_paths = []
+        with stage('fetch'):
+            for upload_id in upload_ids:
+                path = self.storage.local_path(upload_key(upload_id))
+                if path is None:
+                    return {'error': 'File caricato non più disponibile, caricalo di nuovo'}
+                file_paths.append(path)
+
+        results_list = analyze_files(file_paths, self.workers)
+        for name, results in zip(names or upload_ids, results_list):
+            if 'error' in results:
+                if len(upload_ids) > 1:
+                    return {'error': f"{name}: {results['error']}"}
+                return results
+
+        if len(results_list) == 1:
+            results = results_list[0]
+        else:
+            from services.csv_analysis import merge_results
+            with stage('merge'):
+                results = merge_results(results_list)
+        entry = dict(results)
+        with stage('index'):
+            entry['time_index'] = TimeIndex(results['detailed_df'], results['row_timestamps'])
+
+        self._remember(key, entry)
+        self._store_shared(key, entry)
+        return entry
+
+    def filter(self, upload_ids: Union[str, List[str]], start: Optional[int] = None,
+               end: Optional[int] = None) -> Dict[str, Any]:
+        """Analisi dei file ristretta all'intervallo [start, end]"""
+        entry = self.get(upload_ids)
+        if 'error' in entry or (start is None and end is None):
+            return entry
+
+        filtered = entry['time_index'].filter(start, end)
+        filtered['time_index'] = entry['time_index']
+        return filtered
+
+
+def analysis_etag(upload_ids: List[str], *parts) -> str:
+    """ETag forte per una vista dell'analisi: i file sono indirizzati per contenuto, quindi
+    upload e parametri della vista bastano a identificare la risposta senza calcolarla"""
+    raw = '|'.join(list(upload_ids) + [str(part) for part in parts])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def get_upload_folder(config) -> str:
+    """Cartella di lavoro per upload ed export temporanei, creata al primo utilizzo"""
+    folder = config['UPLOAD_FOLDER']
+    if config.get('UPLOAD_FOLDER_READY'):
+        return folder
+    try:
+        os.makedirs(folder, exist_ok=True)
+    except OSError:
+        # Su Vercel il filesystem dell'app è in sola lettura: si usa /tmp
+        folder = config['UPLOAD_FOLDER'] = '/tmp'
+    config['UPLOAD_FOLDER_READY'] = True
+    return folder
+
+
+analysis_cache = AnalysisCache(
+    workers=Config.ANALYSIS_WORKERS,
+    shared_max_bytes=Config.ANALYSIS_CACHE_MAX_BYTES
+)
@@ -0,0 +1,191 @@
+import json
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from services.analysis_summary import build_summary
+from services.metrics import registry
+from services.storage import ANALYSES_PREFIX, UPLOADS_PREFIX, get_storage
+
+MANIFESTS_PREFIX = 'manifests/'
+
+registry.counter('storage_retention_deleted_total', 'Oggetti eliminati dalla politica di conservazione')
+
+# I manifest non cambiano dopo la creazione: si tengono in memoria i più usati
+_manifests: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+_manifests_lock = threading.Lock()
+MAX_CACHED_MANIFESTS = 256
+
+
+def _user_prefix(user_id: str) -> str:
+    return f"{MANIFESTS_PREFIX}{re.sub(r'[^A-Za-z0-9_-]', '_', str(user_id))}/"
+
+
+def manifest_key(user_id: str, analysis_id: str) -> str:
+    return f'{_user_prefix(user_id)}{analysis_id}.json'
+
+
+def create_manifest(user_id: str, uploads: List[Tuple[str, str, int]], results: Optional[Dict[str, Any]],
+                    preview: Optional[Dict[str, Any]] = None,
+                    spend: Optional[Tuple[str, str, int]] = None) -> Dict[str, Any]:
+    """Registra una nuova analisi dell'utente: file caricati (sha256, nome, byte) e riassunto per i confronti.
+
+    Con results=None l'analisi è in corso (progressiva): il manifest contiene l'anteprima
+    e viene completato da complete_manifest. spend è l'eventuale export della spesa (sha256, nome, byte).
+    """
+    manifest = {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'file': ', '.join(name for _, name, _ in uploads),
+        'files': [{'upload_id': upload_id, 'name': name, 'size': size} for upload_id, name, size in uploads],
+        'summary': build_summary(results) if results is not None else None
+    }
+    if spend is not None:
+        manifest['spend'] = {'upload_id': spend[0], 'name': spend[1], 'size': spend[2]}
+    if results is None:
+        manifest.update({'pending': True, 'started': time.time(), 'preview': preview})
+    _save(manifest_key(user_id, manifest['id']), manifest)
+    return manifest
+
+
+def complete_manifest(user_id: str, analysis_id: str, results: Dict[str, Any]):
+    """Completa un'analisi progressiva con il riassunto (o l'errore) dell'analisi completa"""
+    manifest = load_manifest(user_id, analysis_id)
+    if manifest is None:
+        return
+    manifest = dict(manifest, pending=False, preview=None)
+    if 'error' in results:
+        manifest['error'] = results['error']
+    else:
+        manifest['summary'] = build_summary(results)
+    _save(manifest_key(user_id, analysis_id), manifest)
+
+
+def touch_manifest(user_id: str, analysis_id: str):
+    """Segnala che l'analisi progressiva è ancora in corso (o in coda) nel processo che la esegue"""
+    manifest = load_manifest(user_id, analysis_id)
+    if manifest is None or not manifest.get('pending'):
+        return
+    _save(manifest_key(user_id, analysis_id), dict(manifest, heartbeat=time.time()))
+
+
+def is_pending(manifest: Dict[str, Any]) -> bool:
+    """Analisi progressiva non ancora completata né interrotta (es. per il riavvio del worker):
+    il processo che la esegue aggiorna heartbeat finché non termina"""
+    last_seen = manifest.get('heartbeat', manifest.get('started', 0))
+    return bool(manifest.get('pending')) and time.time() - last_seen < Config.PROGRESSIVE_TIMEOUT
+
+
+def _save(key: str, manifest: Dict[str, Any]):
+    get_storage().put_bytes(key, json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+    _remember(key, manifest)
+
+
+def _remember(key: str, manifest: Dict[str, Any]):
+    with _manifests_lock:
+        _manifests[key] = manifest
+        _manifests.move_to_end(key)
+        while len(_manifests) > MAX_CACHED_MANIFESTS:
+            _manifests.popitem(last=False)
+
+
+def load_manifest(user_id: Optional[str], analysis_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Manifest di un'analisi dell'utente (lettura diretta per id), o None se non esiste"""
+    if not user_id or not analysis_id or not re.fullmatch(r'[0-9a-f]{32}', analysis_id):
+        return None
+    key = manifest_key(user_id, analysis_id)
+    with _manifests_lock:
+        manifest = _manifests.get(key)
+    # Un'analisi in corso può essere completata da un altro processo: si rilegge
+    if manifest is not None and not manifest.get('pending'):
+        return manifest
+    try:
+        data = get_storage().get_bytes(key)
+        manifest = json.loads(data) if data is not None else None
+    except (OSError, ValueError) as e:
+        print(f"Manifest dell'analisi non leggibile: {e}")
+        return None
+    if manifest is not None:
+        _remember(key, manifest)
+    return manifest
+
+
+def list_manifests(user_id: str) -> List[Dict[str, Any]]:
+    """Analisi completate dell'utente, dalla più recente"""
+    storage = get_storage()
+    manifests = []
+    for key, _, _ in storage.list(_user_prefix(user_id)):
+        manifest = load_manifest(user_id, key.rsplit('/', 1)[-1][:-len('.json')])
+        # Solo le analisi completate hanno un riassunto da confrontare
+        if manifest is not None and manifest.get('summary') is not None:
+            manifests.append(manifest)
+    manifests.sort(key=lambda m: m['created'], reverse=True)
+    return manifests
+
+
+def get_session_uploads(user_id: Optional[str], analysis_id: Optional[str]) -> List[str]:
+    """Upload (sha256) dell'analisi della sessione; lista vuota se l'analisi non esiste o non è dell'utente"""
+    manifest = load_manifest(user_id, analysis_id)
+    return [item['upload_id'] for item in manifest['files']] if manifest else []
+
+
+class RetentionPolicy:
+    """Elimina upload, risultati e manifest più vecchi di max_age_days e, oltre max_bytes
+    di upload, i meno recenti; gira al massimo una volta ogni interval secondi."""
+
+    def __init__(self, max_age_days: float, max_bytes: int, interval: float = 600):
+        self.max_age = max_age_days * 86400
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._last_run = 0.0
+        self._lock = threading.Lock()
+
+    def maybe_run(self):
+        """Avvia la pulizia in background se è passato abbastanza tempo dall'ultima"""
+        with self._lock:
+            if time.time() - self._last_run < self.interval:
+                return
+            self._last_run = time.time()
+        threading.Thread(target=self.run, name='storage-retention', daemon=True).start()
+
+    def run(self) -> int:
+        storage = get_storage()
+        now = time.time()
+        deleted = 0
+        try:
+            for prefix in (UPLOADS_PREFIX, ANALYSES_PREFIX, MANIFESTS_PREFIX):
+                remaining = []
+                for key, size, modified in storage.list(prefix):
+                    if self.max_age and now - modified > self.max_age:
+                        storage.delete(key)
+                        with _manifests_lock:
+                            _manifests.pop(key, None)
+                        deleted += 1
+                    else:
+                        remaining.append((key, size, modified))
+
+                if prefix == UPLOADS_PREFIX and self.max_bytes:
+                    total = 0
+                    for key, size, _ in sorted(remaining, key=lambda item: item[2], reverse=True):
+                        total += size
+                        if total > self.max_bytes:
+                            storage.delete(key)
+                            deleted += 1
+        except OSError as e:
+            print(f"Errore durante la pulizia dello storage: {e}")
+        if deleted:
+            registry.inc('storage_retention_deleted_total', deleted)
+        return deleted
+
+
+retention = RetentionPolicy(
+    Config.RETENTION_MAX_AGE_DAYS,
+    Config.RETENTION_MAX_BYTES,
+    interval=Config.RETENTION_INTERVAL
+)
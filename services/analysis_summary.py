@@ -0,0 +1,73 @@
+from typing import Any, Dict
+
+
+def build_summary(results: Dict[str, Any]) -> Dict[str, Any]:
+    """Riassunto compatto di un'analisi: statistiche e conteggi per utm_term"""
+    return {
+        'total_rows': results['total_rows'],
+        'rows_with_utm_term': results['rows_with_utm_term'],
+        'unique_ads': results['unique_ads'],
+        'terms': {item['utm_term']: [item['numero_lead'], item['nome_inserzione']]
+                  for item in results['results_df']}
+    }
+
+
+def _ranks(terms: Dict[str, list]) -> Dict[str, int]:
+    ordered = sorted(terms.items(), key=lambda item: item[1][0], reverse=True)
+    return {term: position for position, (term, _) in enumerate(ordered, start=1)}
+
+
+def compare_summaries(base: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Confronta due riassunti: delta per utm_term, inserzioni nuove/scomparse e cambi di posizione"""
+    base_terms = base['terms']
+    current_terms = current['terms']
+    base_ranks = _ranks(base_terms)
+    current_ranks = _ranks(current_terms)
+
+    rows = []
+    for utm_term in set(base_terms) | set(current_terms):
+        base_count, base_name = base_terms.get(utm_term, [0, None])
+        current_count, current_name = current_terms.get(utm_term, [0, None])
+        delta = current_count - base_count
+
+        if utm_term not in base_terms:
+            status = 'nuova'
+        elif utm_term not in current_terms:
+            status = 'scomparsa'
+        elif delta > 0:
+            status = 'in crescita'
+        elif delta < 0:
+            status = 'in calo'
+        else:
+            status = 'stabile'
+
+        base_rank = base_ranks.get(utm_term)
+        current_rank = current_ranks.get(utm_term)
+        rows.append({
+            'utm_term': utm_term,
+            'nome_inserzione': current_name or base_name or utm_term,
+            'lead_precedenti': base_count,
+            'lead_attuali': current_count,
+            'delta': delta,
+            'delta_percentuale': round(delta / base_count * 100, 1) if base_count else None,
+            'posizione_precedente': base_rank,
+            'posizione_attuale': current_rank,
+            'variazione_posizione': base_rank - current_rank if base_rank and current_rank else None,
+            'stato': status
+        })
+
+    rows.sort(key=lambda x: (x['lead_attuali'], x['lead_precedenti']), reverse=True)
+
+    base_total = base['rows_with_utm_term']
+    current_total = current['rows_with_utm_term']
+    return {
+        'rows': rows,
+        'new_ads': [row for row in rows if row['stato'] == 'nuova'],
+        'disappeared_ads': [row for row in rows if row['stato'] == 'scomparsa'],
+        'totals': {
+            'lead_precedenti': base_total,
+            'lead_attuali': current_total,
+            'delta': current_total - base_total,
+            'delta_percentuale': round((current_total - base_total) / base_total * 100, 1) if base_total else None
+        }
+    }
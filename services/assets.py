@@ -0,0 +1,69 @@
+import json
+import mimetypes
+import os
+from typing import Dict, Optional
+
+# Librerie front-end copiate in static/vendor/ da build_assets.py --fetch (versioni fissate).
+# Finché non sono presenti, le pagine le caricano dalla CDN indicata.
+VENDOR_ASSETS = {
+    'vendor/bootstrap-5.1.3/css/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+    'vendor/bootstrap-5.1.3/js/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+    'vendor/bootstrap-5.3.3/css/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
+    'vendor/bootstrap-5.3.3/js/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js',
+    'vendor/fontawesome-6.0.0/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+    'vendor/chartjs-4.4.0/chart.umd.js':
+        'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js',
+}
+
+DIST_FOLDER = 'dist'
+MANIFEST_NAME = 'manifest.json'
+# Gli asset in dist/ hanno l'hash del contenuto nel nome: possono restare in cache per sempre
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Versioni precompresse, in ordine di preferenza
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class AssetManifest:
+    """Nomi con fingerprint degli asset statici, letti da static/dist/manifest.json"""
+
+    def __init__(self, static_folder: str):
+        self.static_folder = static_folder
+        self._entries: Optional[Dict[str, str]] = None
+
+    @property
+    def entries(self) -> Dict[str, str]:
+        if self._entries is None:
+            try:
+                with open(os.path.join(self.static_folder, DIST_FOLDER, MANIFEST_NAME), encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                # Asset non ancora generati: si servono gli originali
+                self._entries = {}
+        return self._entries
+
+    def resolve(self, name: str) -> Dict[str, Optional[str]]:
+        """Dove trovare l'asset: {'filename': percorso sotto /static} oppure {'url': CDN}"""
+        hashed = self.entries.get(name)
+        if hashed is not None:
+            return {'filename': f'{DIST_FOLDER}/{hashed}', 'url': None}
+        if name in VENDOR_ASSETS and not os.path.exists(os.path.join(self.static_folder, name)):
+            return {'filename': None, 'url': VENDOR_ASSETS[name]}
+        return {'filename': name, 'url': None}
+
+
+def negotiate_encoding(path: str, accept_encodings) -> Optional[str]:
+    """Versione precompressa (br, gzip) di path accettata dal client e presente su disco"""
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] > 0 and os.path.exists(path + suffix):
+            return encoding
+    return None
+
+
+def guess_mimetype(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
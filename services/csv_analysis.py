@@ -0,0 +1,332 @@
+import csv
+import io
+import os
+from array import array
+from urllib.parse import urlparse, parse_qs
+from collections import Counter
+
+from services.metrics import stage
+from services.time_index import parse_timestamp
+
+def extract_utm_term_from_url(url):
+    """Estrae il valore utm_term da un URL"""
+    if not url or not isinstance(url, str):
+        return None
+    
+    try:
+        parsed_url = urlparse(url)
+        query_params = parse_qs(parsed_url.query)
+        utm_term = query_params.get('utm_term', [None])[0]
+        return utm_term
+    except:
+        return None
+
+def extract_campaign_name_from_url(url):
+    """Estrae il nome della campagna dall'URL"""
+    if not url or not isinstance(url, str):
+        return None
+    
+    try:
+        parsed_url = urlparse(url)
+        query_params = parse_qs(parsed_url.query)
+        utm_campaign = query_params.get('utm_campaign', [None])[0]
+        return utm_campaign
+    except:
+        return None
+
+def extract_content_name_from_url(url):
+    """Estrae il contenuto dell'inserzione dall'URL"""
+    if not url or not isinstance(url, str):
+        return None
+    
+    try:
+        parsed_url = urlparse(url)
+        query_params = parse_qs(parsed_url.query)
+        utm_content = query_params.get('utm_content', [None])[0]
+        return utm_content
+    except:
+        return None
+
+def extract_utm_params(url):
+    """Restituisce (utm_term, utm_campaign, utm_content) di un URL, o None se manca utm_term"""
+    url = str(url or '')
+    if 'utm_term=' not in url:
+        return None
+    try:
+        query_params = parse_qs(urlparse(url).query)
+    except Exception:
+        return None
+    utm_term = query_params.get('utm_term', [''])[0]
+    if not utm_term:
+        return None
+    return utm_term, query_params.get('utm_campaign', [''])[0], query_params.get('utm_content', [''])[0]
+
+def add_to_cube(cube, utm_campaign, utm_content, utm_term, count=1):
+    """Aggiorna il cubo campagna -> contenuto -> termine con un lead"""
+    campaign_node = cube.get(utm_campaign)
+    if campaign_node is None:
+        campaign_node = cube[utm_campaign] = {'numero_lead': 0, 'contents': {}}
+    campaign_node['numero_lead'] += count
+    
+    content_node = campaign_node['contents'].get(utm_content)
+    if content_node is None:
+        content_node = campaign_node['contents'][utm_content] = {'numero_lead': 0, 'terms': Counter()}
+    content_node['numero_lead'] += count
+    content_node['terms'][utm_term] += count
+
+def build_results(utm_term_counts, content_counts):
+    """Calcola il nome inserzione (utm_content più frequente) e le righe di riepilogo per utm_term"""
+    utm_mapping = {}
+    results_data = []
+    for utm_term, count in utm_term_counts.items():
+        contents = content_counts.get(utm_term)
+        nome_inserzione = contents.most_common(1)[0][0] if contents else utm_term
+        utm_mapping[utm_term] = nome_inserzione
+        results_data.append({
+            'utm_term': utm_term,
+            'nome_inserzione': nome_inserzione,
+            'numero_lead': count
+        })
+    return utm_mapping, results_data
+
+def process_csv_file(file_path):
+    """Processa il file CSV e restituisce i risultati"""
+    try:
+        # Leggi il file CSV
+        rows = []
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                rows.append(row)
+        
+        # Filtra solo le righe che hanno una SORGENTE (URL) con utm_term
+        rows_with_url = []
+        for row in rows:
+            sorgente = row.get('SORGENTE', '')
+            if sorgente and 'utm_term' in sorgente:
+                rows_with_url.append(row)
+        
+        # Estrai i parametri UTM
+        rows_with_utm_term = []
+        for row in rows_with_url:
+            utm_term = extract_utm_term_from_url(row.get('SORGENTE', ''))
+            utm_campaign = extract_campaign_name_from_url(row.get('SORGENTE', ''))
+            utm_content = extract_content_name_from_url(row.get('SORGENTE', ''))
+            
+            if utm_term:
+                row['utm_term_extracted'] = utm_term
+                row['utm_campaign_extracted'] = utm_campaign
+                row['utm_content_extracted'] = utm_content
+                rows_with_utm_term.append(row)
+        
+        # Analizza i valori utm_term più frequenti
+        utm_term_counts = Counter([row['utm_term_extracted'] for row in rows_with_utm_term])
+        
+        # Crea un mapping utm_term -> nome inserzione basato su utm_content
+        utm_term_to_content = {}
+        
+        for utm_term in utm_term_counts.keys():
+            if utm_term:
+                content_list = [row['utm_content_extracted'] for row in rows_with_utm_term 
+                               if row['utm_term_extracted'] == utm_term and row.get('utm_content_extracted')]
+                if content_list:
+                    content_counts = Counter(content_list)
+                    most_common_content = content_counts.most_common(1)[0][0]
+                    utm_term_to_content[utm_term] = most_common_content
+        
+        # Prepara i risultati
+        results = []
+        for utm_term, content in utm_term_to_content.items():
+            count = utm_term_counts[utm_term]
+            results.append({
+                'utm_term': utm_term,
+                'nome_inserzione': content,
+                'numero_lead': count
+            })
+        
+        # Ordina per numero di lead
+        results.sort(key=lambda x: x['numero_lead'], reverse=True)
+        
+        # Prepara i dati dettagliati
+        detailed_results = []
+        for row in rows_with_utm_term:
+            detailed_results.append({
+                'Data': row.get('Data', ''),
+                'Ora': row.get('Ora', ''),
+                'Email': row.get('Email', ''),
+                'UTM_Term': row.get('utm_term_extracted', ''),
+                'Campagna': row.get('utm_campaign_extracted', ''),
+                'Nome_Inserzione': row.get('utm_content_extracted', '')
+            })
+        
+        return {
+            'success': True,
+            'total_rows': len(rows),
+            'rows_with_utm_term': len(rows_with_utm_term),
+            'unique_ads': len(results),
+            'results_df': results,
+            'detailed_df': detailed_results,
+            'top_utm_terms': utm_term_counts.most_common(10)
+        }
+        
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def process_csv(file_path):
+    """Processa il file CSV e restituisce i risultati dell'analisi"""
+    try:
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as csvfile:
+            return process_csv_stream(csvfile)
+    except Exception as e:
+        return {'error': f'Errore nel processare il file: {str(e)}'}
+
+def sample_csv(file_path, sample_bytes, segments=32):
+    """Analizza un campione del file: segments blocchi di righe distribuiti su tutto il file,
+    per circa sample_bytes in totale. Restituisce l'analisi del campione con 'sampled_bytes'
+    e 'data_bytes' (byte di dati del file, esclusa l'intestazione) per stimare i totali."""
+    try:
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            header = f.readline()
+            data_start = f.tell()
+            data_bytes = size - data_start
+            if data_bytes <= sample_bytes:
+                # File piccolo: il campione è il file intero
+                f.seek(0)
+                lines = [f.read().decode('utf-8-sig', errors='replace')]
+                sampled = data_bytes
+            else:
+                chunk = max(sample_bytes // segments, 4096)
+                lines = [header.decode('utf-8-sig', errors='replace')]
+                sampled = 0
+                for i in range(segments):
+                    offset = data_start + i * (data_bytes - chunk) // max(segments - 1, 1)
+                    f.seek(offset)
+                    block = f.read(chunk)
+                    # Si tengono solo righe intere: dal primo a capo (se il blocco non parte
+                    # da inizio riga) all'ultimo
+                    if offset > data_start:
+                        f.seek(offset - 1)
+                        if f.read(1) != b'\n':
+                            block = block[block.find(b'\n') + 1:] if b'\n' in block else b''
+                    block = block[:block.rfind(b'\n') + 1]
+                    sampled += len(block)
+                    for line in block.decode('utf-8', errors='replace').splitlines(keepends=True):
+                        # Una riga con virgolette dispari è parte di un campo su più righe: si scarta
+                        if line.count('"') % 2 == 0:
+                            lines.append(line)
+                        else:
+                            sampled -= len(line.encode('utf-8'))
+        
+        results = process_csv_stream(io.StringIO(''.join(lines), newline=''))
+        if 'error' not in results:
+            results['sampled_bytes'] = sampled
+            results['data_bytes'] = data_bytes
+        return results
+    except Exception as e:
+        return {'error': f'Errore nel processare il file: {str(e)}'}
+
+def process_csv_stream(csvfile):
+    """Analizza un CSV già aperto (file o stdin) leggendolo riga per riga"""
+    try:
+        reader = csv.DictReader(csvfile)
+        fieldnames = reader.fieldnames
+        
+        # Verifica che esista la colonna SORGENTE
+        if not fieldnames or 'SORGENTE' not in fieldnames:
+            return {'error': 'Il file deve contenere una colonna "SORGENTE"'}
+        
+        # Estrai utm_term, utm_campaign e utm_content dagli URL
+        utm_data = []
+        row_timestamps = array('q')
+        cube = {}
+        utm_term_counts = Counter()
+        content_counts = {}
+        total_rows = 0
+        with stage('parse'):
+            for row in reader:
+                total_rows += 1
+                ts = parse_timestamp(row.get('Data', ''), row.get('Ora', ''))
+                if ts is not None:
+                    row_timestamps.append(ts)
+            
+                params = extract_utm_params(row.get('SORGENTE', ''))
+                if params is not None:
+                    utm_term, utm_campaign, utm_content = params
+                    utm_data.append({
+                        'utm_term': utm_term,
+                        'utm_campaign': utm_campaign,
+                        'utm_content': utm_content,
+                        'data': row.get('Data', ''),
+                        'ora': row.get('Ora', ''),
+                        'email': row.get('Email', '')
+                    })
+                    add_to_cube(cube, utm_campaign, utm_content, utm_term)
+                    utm_term_counts[utm_term] += 1
+                    if utm_content:
+                        content_counts.setdefault(utm_term, Counter())[utm_content] += 1
+        
+        if not utm_data:
+            return {'error': 'Nessun URL con utm_term trovato nel file'}
+        
+        with stage('aggregate'):
+            # Mappa utm_term a nome inserzione usando il utm_content più frequente
+            utm_mapping, results_data = build_results(utm_term_counts, content_counts)
+            
+            # Aggiungi nome inserzione ai dati dettagliati
+            for item in utm_data:
+                item['nome_inserzione'] = utm_mapping[item['utm_term']]
+        
+        return {
+            'results_df': results_data,
+            'detailed_df': utm_data,
+            'total_rows': total_rows,
+            'rows_with_utm_term': len(utm_data),
+            'unique_ads': len(utm_term_counts),
+            'row_timestamps': row_timestamps,
+            'content_counts': content_counts,
+            'cube': cube
+        }
+        
+    except Exception as e:
+        return {'error': f'Errore nel processare il file: {str(e)}'}
+
+def merge_results(results_list):
+    """Unisce le analisi di più file combinando gli aggregati di ciascuno"""
+    utm_term_counts = Counter()
+    content_counts = {}
+    cube = {}
+    detailed = []
+    row_timestamps = array('q')
+    total_rows = 0
+    
+    for results in results_list:
+        total_rows += results['total_rows']
+        row_timestamps.extend(results['row_timestamps'])
+        detailed.extend(results['detailed_df'])
+        for item in results['results_df']:
+            utm_term_counts[item['utm_term']] += item['numero_lead']
+        for utm_term, contents in results['content_counts'].items():
+            content_counts.setdefault(utm_term, Counter()).update(contents)
+        for utm_campaign, campaign_node in results['cube'].items():
+            for utm_content, content_node in campaign_node['contents'].items():
+                for utm_term, count in content_node['terms'].items():
+                    add_to_cube(cube, utm_campaign, utm_content, utm_term, count)
+    
+    utm_mapping, results_data = build_results(utm_term_counts, content_counts)
+    for item in detailed:
+        item['nome_inserzione'] = utm_mapping[item['utm_term']]
+    
+    return {
+        'results_df': results_data,
+        'detailed_df': detailed,
+        'total_rows': total_rows,
+        'rows_with_utm_term': len(detailed),
+        'unique_ads': len(utm_term_counts),
+        'row_timestamps': row_timestamps,
+        'content_counts': content_counts,
+        'cube': cube
+    }
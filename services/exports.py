@@ -0,0 +1,107 @@
+import csv
+import gzip
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from services.metrics import record_cache, stage
+
+# Export disponibili: nome del file scaricato -> chiave dei risultati dell'analisi
+EXPORTS = {
+    'utm_term_inserzioni.csv': 'results_df',
+    'lead_dettagliati_con_inserzioni.csv': 'detailed_df',
+}
+# Da incrementare quando cambia il contenuto degli export (colonne, valori), per invalidare
+# gli ETag già emessi e i file già generati
+EXPORT_VERSION = 2
+
+
+def _tmp_path(path: str) -> str:
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def write_csv(path: str, rows: List[Dict[str, Any]]):
+    """Scrive le righe in CSV (UTF-8 con BOM, come si aspetta Excel) in modo atomico"""
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
+        if rows:
+            writer = csv.DictWriter(csvfile, fieldnames=rows[0].keys())
+            writer.writeheader()
+            writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def write_gzip(source: str, path: str):
+    """Versione gzip di un file; senza nome né data nell'header, quindi identica su ogni istanza"""
+    tmp_path = _tmp_path(path)
+    with open(source, 'rb') as src, open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=6, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, path)
+
+
+class ExportCache:
+    """CSV esportati già generati, indicizzati per hash di analisi, export e date, in una cartella locale.
+
+    Ogni file si scrive in un temporaneo e poi si rinomina, quindi download concorrenti
+    non leggono mai un export a metà; oltre max_bytes si eliminano i meno usati.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def _path(folder: str, export_id: str, gzipped: bool) -> str:
+        return os.path.join(folder, f"{export_id}.csv{'.gz' if gzipped else ''}")
+
+    def lookup(self, folder: str, export_id: str, gzipped: bool = False) -> Optional[str]:
+        """Percorso dell'export già generato, o None"""
+        path = self._path(folder, export_id, gzipped)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            record_cache('export', False)
+            return None
+        record_cache('export', True)
+        return path
+
+    def store(self, folder: str, export_id: str, rows: List[Dict[str, Any]], gzipped: bool = False) -> str:
+        """Genera l'export (e la versione gzip se richiesta) e ne restituisce il percorso"""
+        os.makedirs(folder, exist_ok=True)
+        plain = self._path(folder, export_id, False)
+        if not os.path.exists(plain):
+            with stage('export'):
+                write_csv(plain, rows)
+        path = plain
+        if gzipped:
+            path = self._path(folder, export_id, True)
+            with stage('compress'):
+                write_gzip(plain, path)
+        self._evict(folder)
+        return path
+
+    def _evict(self, folder: str):
+        if not self.max_bytes:
+            return
+        files = []
+        for entry in os.scandir(folder):
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = 0
+        for _, size, path in sorted(files, reverse=True):
+            total += size
+            if total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+export_cache = ExportCache(Config.EXPORT_CACHE_MAX_BYTES)
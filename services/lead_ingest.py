@@ -0,0 +1,249 @@
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from config import Config
+from services.metrics import registry
+from services.time_index import parse_timestamp
+
+registry.counter('ingest_leads_total', 'Lead ricevuti dal webhook di ingestione, per esito')
+
+# Alias accettati per i campi del lead (il primo è il nome della colonna negli export CSV)
+FIELD_ALIASES = {
+    'SORGENTE': ('SORGENTE', 'sorgente', 'url'),
+    'Email': ('Email', 'email'),
+    'Data': ('Data', 'data'),
+    'Ora': ('Ora', 'ora'),
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    lead_id TEXT,
+    ts INTEGER,
+    data TEXT NOT NULL,
+    ora TEXT NOT NULL,
+    email TEXT NOT NULL,
+    utm_term TEXT,
+    utm_campaign TEXT,
+    utm_content TEXT,
+    received REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS leads_user_lead ON leads (user_id, lead_id);
+CREATE INDEX IF NOT EXISTS leads_user_ts ON leads (user_id, ts);
+CREATE TABLE IF NOT EXISTS lead_totals (
+    user_id TEXT NOT NULL,
+    utm_campaign TEXT NOT NULL,
+    utm_content TEXT NOT NULL,
+    utm_term TEXT NOT NULL,
+    numero_lead INTEGER NOT NULL,
+    PRIMARY KEY (user_id, utm_campaign, utm_content, utm_term)
+);
+CREATE TABLE IF NOT EXISTS lead_streams (
+    user_id TEXT PRIMARY KEY,
+    total_rows INTEGER NOT NULL,
+    first_ts INTEGER,
+    last_ts INTEGER
+);
+'''
+
+
+def parse_tokens(raw: str) -> Dict[str, str]:
+    """Legge INGEST_TOKENS ("token:user_id,token2:user_id2") come {token: user_id}"""
+    tokens = {}
+    for item in raw.split(','):
+        token, _, user_id = item.strip().partition(':')
+        if token and user_id:
+            tokens[token] = user_id
+    return tokens
+
+
+def authenticate(header: Optional[str]) -> Optional[str]:
+    """user_id associato al token "Authorization: Bearer <token>", o None"""
+    if not header or not header.startswith('Bearer '):
+        return None
+    supplied = header[len('Bearer '):].strip()
+    user_id = None
+    for token, owner in parse_tokens(Config.INGEST_TOKENS).items():
+        # Confronto a tempo costante su tutti i token
+        if hmac.compare_digest(token.encode('utf-8'), supplied.encode('utf-8')):
+            user_id = owner
+    return user_id
+
+
+def _field(lead: Dict[str, Any], name: str) -> str:
+    for alias in FIELD_ALIASES[name]:
+        value = lead.get(alias)
+        if value is not None:
+            return str(value).strip()
+    return ''
+
+
+def normalize_lead(lead: Any) -> Dict[str, Any]:
+    """Porta un lead ricevuto (SORGENTE, Email, Data/Ora oppure timestamp ISO 8601) nel formato
+    delle righe degli export, con i parametri UTM estratti come nell'analisi dei CSV.
+    Solleva ValueError se il lead non è valido."""
+    # Import al primo utilizzo: non pesa sull'avvio a freddo dell'app
+    from services.csv_analysis import extract_utm_params
+
+    if not isinstance(lead, dict):
+        raise ValueError('il lead deve essere un oggetto JSON')
+    sorgente = _field(lead, 'SORGENTE')
+    if not sorgente:
+        raise ValueError('campo SORGENTE mancante')
+
+    data, ora = _field(lead, 'Data'), _field(lead, 'Ora')
+    if lead.get('timestamp') not in (None, ''):
+        try:
+            when = datetime.fromisoformat(str(lead['timestamp']).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('timestamp non valido (formato ISO 8601)')
+        if when.tzinfo is not None:
+            when = when.astimezone(ZoneInfo(Config.LEADS_TIMEZONE))
+        # Come negli export: data e ora italiane (LEADS_TIMEZONE), senza fuso
+        data, ora = when.strftime('%d/%m/%Y'), when.strftime('%H:%M:%S')
+
+    params = extract_utm_params(sorgente)
+    utm_term, utm_campaign, utm_content = params if params is not None else (None, None, None)
+    lead_id = lead.get('id')
+    return {
+        'lead_id': str(lead_id) if lead_id not in (None, '') else None,
+        'ts': parse_timestamp(data, ora),
+        'data': data,
+        'ora': ora,
+        'email': _field(lead, 'Email'),
+        'utm_term': utm_term,
+        'utm_campaign': utm_campaign,
+        'utm_content': utm_content,
+    }
+
+
+class LeadStore:
+    """Lead ricevuti dal webhook, in SQLite, con i totali per inserzione aggiornati a ogni
+    inserimento: i risultati si leggono dai totali senza rileggere i lead."""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Una connessione per thread e per processo: l'app viene importata nel master di gunicorn
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def append(self, user_id: str, leads: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+        """Aggiunge i lead normalizzati e aggiorna i totali nella stessa transazione.
+        Un lead con un id già ricevuto viene ignorato. Restituisce (inseriti, duplicati)."""
+        connection = self._connection()
+        totals: Counter = Counter()
+        inserted = duplicates = 0
+        first_ts = last_ts = None
+        received = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for lead in leads:
+                cursor = connection.execute(
+                    'INSERT OR IGNORE INTO leads (user_id, lead_id, ts, data, ora, email, utm_term, '
+                    'utm_campaign, utm_content, received) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (user_id, lead['lead_id'], lead['ts'], lead['data'], lead['ora'], lead['email'],
+                     lead['utm_term'], lead['utm_campaign'], lead['utm_content'], received))
+                if not cursor.rowcount:
+                    duplicates += 1
+                    continue
+                inserted += 1
+                if lead['utm_term']:
+                    totals[(lead['utm_campaign'], lead['utm_content'], lead['utm_term'])] += 1
+                if lead['ts'] is not None:
+                    first_ts = lead['ts'] if first_ts is None else min(first_ts, lead['ts'])
+                    last_ts = lead['ts'] if last_ts is None else max(last_ts, lead['ts'])
+
+            connection.executemany(
+                'INSERT INTO lead_totals (user_id, utm_campaign, utm_content, utm_term, numero_lead) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, utm_campaign, utm_content, utm_term) '
+                'DO UPDATE SET numero_lead = numero_lead + excluded.numero_lead',
+                [(user_id, *key, count) for key, count in totals.items()])
+            if inserted:
+                connection.execute(
+                    'INSERT INTO lead_streams (user_id, total_rows, first_ts, last_ts) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (user_id) DO UPDATE SET total_rows = total_rows + excluded.total_rows, '
+                    'first_ts = MIN(COALESCE(first_ts, excluded.first_ts), COALESCE(excluded.first_ts, first_ts)), '
+                    'last_ts = MAX(COALESCE(last_ts, excluded.last_ts), COALESCE(excluded.last_ts, last_ts))',
+                    (user_id, inserted, first_ts, last_ts))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return inserted, duplicates
+
+    def results(self, user_id: str, start: Optional[int] = None, end: Optional[int] = None) -> Dict[str, Any]:
+        """Risultati dei lead ricevuti nel formato dell'analisi dei CSV (results_df, cube, ...),
+        dai totali oppure, con un intervallo di date, contando i lead dell'intervallo"""
+        from services.csv_analysis import add_to_cube, build_results
+
+        connection = self._connection()
+        stream = connection.execute('SELECT total_rows, first_ts, last_ts FROM lead_streams WHERE user_id = ?',
+                                    (user_id,)).fetchone()
+        if stream is None:
+            return {'error': 'Nessun lead ricevuto'}
+
+        if start is None and end is None:
+            total_rows = stream[0]
+            groups = connection.execute(
+                'SELECT utm_campaign, utm_content, utm_term, numero_lead FROM lead_totals WHERE user_id = ?',
+                (user_id,)).fetchall()
+        else:
+            low = start if start is not None else -2 ** 62
+            high = end if end is not None else 2 ** 62
+            total_rows = connection.execute('SELECT COUNT(*) FROM leads WHERE user_id = ? AND ts BETWEEN ? AND ?',
+                                            (user_id, low, high)).fetchone()[0]
+            groups = connection.execute(
+                'SELECT utm_campaign, utm_content, utm_term, COUNT(*) FROM leads '
+                'WHERE user_id = ? AND ts BETWEEN ? AND ? AND utm_term IS NOT NULL '
+                'GROUP BY utm_campaign, utm_content, utm_term', (user_id, low, high)).fetchall()
+
+        cube = {}
+        utm_term_counts = Counter()
+        content_counts = {}
+        for utm_campaign, utm_content, utm_term, count in groups:
+            add_to_cube(cube, utm_campaign, utm_content, utm_term, count)
+            utm_term_counts[utm_term] += count
+            if utm_content:
+                content_counts.setdefault(utm_term, Counter())[utm_content] += count
+        _, results_data = build_results(utm_term_counts, content_counts)
+
+        return {
+            'results_df': results_data,
+            'total_rows': total_rows,
+            'rows_with_utm_term': sum(utm_term_counts.values()),
+            'unique_ads': len(utm_term_counts),
+            'content_counts': content_counts,
+            'cube': cube,
+            'bounds': (stream[1], stream[2])
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_lead_store() -> LeadStore:
+    """Archivio dei lead ricevuti (INGEST_DB_PATH), creato al primo utilizzo"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = LeadStore(Config.INGEST_DB_PATH)
+        return _store
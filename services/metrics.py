@@ -0,0 +1,357 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+
+# Bucket (in secondi) adatti sia alle chiamate Airtable sia all'analisi di CSV grandi
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Istogramma cumulativo in stile Prometheus, per insieme di etichette"""
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelKey, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # conteggi per bucket (+Inf in coda), somma, numero di osservazioni
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_format_labels(key, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class Counter:
+    """Contatore monotono in stile Prometheus, per insieme di etichette"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._series: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self._series.items()):
+            lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    """Valore istantaneo in stile Prometheus (es. lunghezza di una coda), per insieme di etichette"""
+
+    def set(self, value: float, **labels):
+        self._series[_label_key(labels)] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f'# TYPE {self.name} gauge'
+        return lines
+
+
+METRIC_TYPES = {'histogram': Histogram, 'counter': Counter, 'gauge': Gauge}
+# File delle metriche dei processi terminati, già sommate
+ARCHIVE_FILE = 'archive.json'
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """Registro delle metriche del processo, esposte in formato testo Prometheus.
+
+    Con directory (più worker gunicorn) ogni processo scrive le proprie serie in un file
+    della cartella ogni write_interval secondi e render() somma quelle di tutti i processi:
+    contatori e istogrammi dei worker terminati restano nel totale (archive.json), i gauge
+    contano solo per i processi ancora attivi.
+    """
+
+    def __init__(self, directory: str = '', write_interval: float = 5.0):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = directory
+        self.write_interval = write_interval
+        # (pid, file) del processo corrente: un worker derivato dal master ne apre uno suo
+        self._file: Optional[Tuple[int, str]] = None
+        self._write_lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help_text, buckets)
+            return self._metrics[name]
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help_text)
+            return self._metrics[name]
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Gauge(name, help_text)
+            return self._metrics[name]
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._start_writer()
+            self._metrics[name].set(value, **labels)
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            self._start_writer()
+            self._metrics[name].observe(value, **labels)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        with self._lock:
+            self._start_writer()
+            self._metrics[name].inc(amount, **labels)
+
+    def _start_writer(self):
+        # Alla prima metrica del processo (chiamato con il lock): dopo il fork il pid cambia
+        if not self.directory or (self._file is not None and self._file[0] == os.getpid()):
+            return
+        if self._file is not None:
+            # Serie copiate dal processo padre: sono già nel suo file
+            for metric in self._metrics.values():
+                metric._series = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = (os.getpid(), os.path.join(self.directory, f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'))
+        threading.Thread(target=self._write_loop, name='metrics-writer', daemon=True).start()
+
+    def _write_loop(self):
+        pid = os.getpid()
+        while self._file is not None and self._file[0] == pid:
+            time.sleep(self.write_interval)
+            self.write()
+
+    def snapshot(self, gauges: bool = True, reset: bool = False) -> Dict[str, Any]:
+        """Serie del processo in forma serializzabile ({nome: {type, help, buckets, series}});
+        con reset=True le serie ripartono da zero"""
+        with self._lock:
+            data = {}
+            for name, metric in self._metrics.items():
+                kind = next(k for k, cls in METRIC_TYPES.items() if type(metric) is cls)
+                if kind == 'gauge' and not gauges:
+                    continue
+                data[name] = {'type': kind, 'help': metric.help_text, 'buckets': getattr(metric, 'buckets', None),
+                              'series': [[list(key), value] for key, value in metric._series.items()]}
+            if reset:
+                for metric in self._metrics.values():
+                    metric._series = {}
+            return data
+
+    def write(self):
+        """Scrive le serie del processo nel suo file (sostituzione atomica)"""
+        with self._write_lock:
+            if self._file is None or self._file[0] != os.getpid():
+                return
+            path = self._file[1]
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump({'pid': os.getpid(), 'metrics': self.snapshot()}, f)
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                print(f"Errore nella scrittura delle metriche: {e}")
+
+    def close(self):
+        """All'uscita del processo: somma contatori e istogrammi all'archivio e rimuove il file.
+        Le serie ripartono da zero: quelle registrate dopo finiscono in un nuovo file."""
+        with self._write_lock:
+            if self._file is None or self._file[0] != os.getpid():
+                return
+            path, self._file = self._file[1], None
+            try:
+                with self._directory_lock():
+                    archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+                    archive = _read_snapshot(archive_path) or {}
+                    merged = _merge([archive.get('metrics', {}), self.snapshot(gauges=False, reset=True)])
+                    with open(archive_path + '.tmp', 'w', encoding='utf-8') as f:
+                        json.dump({'metrics': merged}, f)
+                    os.replace(archive_path + '.tmp', archive_path)
+                    for name in (path, path + '.tmp'):
+                        if os.path.exists(name):
+                            os.remove(name)
+            except OSError as e:
+                print(f"Errore nell'archiviazione delle metriche: {e}")
+
+    @contextmanager
+    def _directory_lock(self):
+        # Lettura dei file e archiviazione non si sovrappongono (un processo non viene contato due volte)
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _collect(self) -> Dict[str, Any]:
+        """Serie di tutti i processi dai loro file. Il processo corrente scrive prima il proprio:
+        ogni valore esposto è già salvato e una lettura successiva da un altro worker non lo vede
+        diminuire (gli altri processi sono indietro al più di write_interval secondi)"""
+        self.write()
+        snapshots = []
+        os.makedirs(self.directory, exist_ok=True)
+        with self._directory_lock():
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                data = _read_snapshot(os.path.join(self.directory, name))
+                if data is None:
+                    continue
+                alive = data.get('pid') is not None and _pid_alive(data['pid'])
+                snapshots.append({metric_name: metric for metric_name, metric in data.get('metrics', {}).items()
+                                  if alive or metric['type'] != 'gauge'})
+        return _merge(snapshots)
+
+    def render(self) -> str:
+        if not self.directory:
+            with self._lock:
+                metrics = [self._metrics[name] for name in sorted(self._metrics)]
+                lines = [line for metric in metrics for line in metric.render()]
+            return '\n'.join(lines) + '\n'
+
+        lines = []
+        for name, data in sorted(self._collect().items()):
+            cls = METRIC_TYPES[data['type']]
+            metric = cls(name, data['help'], data['buckets']) if cls is Histogram else cls(name, data['help'])
+            metric._series = {tuple(tuple(pair) for pair in key): value for key, value in data['series']}
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Somma le serie con le stesse etichette (i gauge dei processi attivi si sommano tra loro)"""
+    merged: Dict[str, Any] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, series={}))
+            for key, value in metric['series']:
+                key = tuple(tuple(pair) for pair in key)
+                current = target['series'].get(key)
+                if metric['type'] != 'histogram':
+                    target['series'][key] = (current or 0) + value
+                elif current is None:
+                    target['series'][key] = [list(value[0]), value[1], value[2]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+    for metric in merged.values():
+        metric['series'] = [[list(key), value] for key, value in metric['series'].items()]
+    return merged
+
+
+registry = MetricsRegistry(Config.METRICS_DIR, Config.METRICS_WRITE_INTERVAL)
+atexit.register(registry.close)
+registry.histogram('http_request_duration_seconds', 'Durata delle richieste HTTP')
+registry.histogram('stage_duration_seconds', 'Durata delle fasi di elaborazione di una richiesta')
+registry.histogram('airtable_request_duration_seconds', 'Latenza delle chiamate alle API Airtable')
+registry.counter('airtable_requests_total', 'Chiamate alle API Airtable per tabella ed esito')
+registry.counter('cache_requests_total', 'Accessi alle cache per cache ed esito (hit/miss)')
+
+# Tempi delle fasi della richiesta in corso, per thread
+_current = threading.local()
+
+
+def start_request():
+    """Inizia a raccogliere i tempi delle fasi per la richiesta del thread corrente"""
+    _current.timings = {}
+
+
+def finish_request() -> Dict[str, float]:
+    """Termina la raccolta e restituisce i tempi (in secondi) per fase"""
+    timings = getattr(_current, 'timings', None) or {}
+    _current.timings = None
+    return timings
+
+
+@contextmanager
+def stage(name: str):
+    """Misura una fase: la registra nell'istogramma e nei tempi della richiesta corrente"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe('stage_duration_seconds', elapsed, stage=name)
+        timings = getattr(_current, 'timings', None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Valore dell'header Server-Timing (durate in millisecondi)"""
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def record_cache(cache: str, hit: bool):
+    """Conta un accesso a una cache (per il calcolo dell'hit rate)"""
+    registry.inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
@@ -0,0 +1,146 @@
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+
+class _Profile:
+    """Campioni raccolti per una singola richiesta"""
+
+    def __init__(self, thread_id: int, sampled: bool, meta: Dict[str, Any]):
+        self.thread_id = thread_id
+        self.sampled = sampled
+        self.meta = meta
+        self.started = time.perf_counter()
+        self.stacks: Counter = Counter()
+
+
+class SamplingProfiler:
+    """Profiler a campionamento per richieste: un solo thread legge periodicamente lo
+    stack dei thread osservati, con un costo trascurabile per la richiesta stessa."""
+
+    def __init__(self, output_dir: str, sample_rate: float = 0.0, slow_threshold: float = 0.0,
+                 interval: float = 0.005, max_files: int = 200, max_bytes: int = 50 * 1024 * 1024,
+                 max_depth: int = 64):
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self._active: Dict[int, _Profile] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self._current = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_threshold > 0
+
+    def start_request(self, **meta):
+        """Inizia a osservare il thread corrente se la richiesta è campionata o serve la soglia"""
+        self._current.profile = None
+        if not self.enabled:
+            return
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and self.slow_threshold <= 0:
+            return
+
+        profile = _Profile(threading.get_ident(), sampled, dict(meta))
+        self._current.profile = profile
+        with self._lock:
+            self._active[profile.thread_id] = profile
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+                self._sampler.start()
+
+    def annotate(self, **info):
+        """Aggiunge informazioni (dimensione file, righe, ...) al profilo della richiesta corrente"""
+        profile = getattr(self._current, 'profile', None)
+        if profile is not None:
+            profile.meta.update(info)
+
+    def finish_request(self) -> Optional[str]:
+        """Smette di osservare il thread e salva il profilo se campionato o lento"""
+        profile = getattr(self._current, 'profile', None)
+        self._current.profile = None
+        if profile is None:
+            return None
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+
+        duration = time.perf_counter() - profile.started
+        slow = self.slow_threshold > 0 and duration >= self.slow_threshold
+        if not (profile.sampled or slow) or not profile.stacks:
+            return None
+        try:
+            return self._dump(profile, duration, 'slow' if slow else 'sampled')
+        except OSError as e:
+            print(f"Impossibile salvare il profilo della richiesta: {e}")
+            return None
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                profiles = list(self._active.values())
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.stacks[self._fold(frame)] += 1
+
+    def _fold(self, frame) -> str:
+        """Stack in formato 'collapsed' (dal più esterno al più interno), come per i flame graph"""
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            parts.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(parts))
+
+    def _dump(self, profile: _Profile, duration: float, reason: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        path_slug = re.sub(r'[^A-Za-z0-9]+', '_', str(profile.meta.get('path', ''))).strip('_') or 'root'
+        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{path_slug[:40]}_{int(duration * 1000)}ms.json.gz"
+        target = os.path.join(self.output_dir, filename)
+
+        payload = dict(profile.meta)
+        payload.update({
+            'reason': reason,
+            'duration_ms': round(duration * 1000, 1),
+            'interval_ms': self.interval * 1000,
+            'samples': sum(profile.stacks.values()),
+            'stacks': dict(profile.stacks.most_common())
+        })
+        with gzip.open(target, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f)
+        self._rotate()
+        return target
+
+    def _rotate(self):
+        """Elimina i profili più vecchi oltre il numero o la dimensione massimi"""
+        entries = []
+        for name in os.listdir(self.output_dir):
+            if name.endswith('.json.gz'):
+                path = os.path.join(self.output_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)
+
+        total = 0
+        for position, (_, size, path) in enumerate(entries):
+            total += size
+            if position >= self.max_files or total > self.max_bytes:
+                os.remove(path)
@@ -0,0 +1,137 @@
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from services.analysis_manifest import complete_manifest, touch_manifest
+from services.metrics import registry, stage
+from services.storage import get_storage, upload_key
+
+registry.counter('progressive_analyses_total', 'Analisi progressive (anteprima e analisi completa in background), per esito')
+
+# Quantile della normale per intervalli di confidenza al 95%
+Z_95 = 1.96
+# Inserzioni mostrate nell'anteprima
+PREVIEW_TOP = 20
+
+# Analisi complete in corso in background (un solo thread per processo, creato al primo utilizzo)
+_executor = None
+_executor_lock = threading.Lock()
+# Analisi del processo in coda o in corso, {analysis_id: user_id}: finché ci sono il loro manifest
+# viene aggiornato ogni PROGRESSIVE_HEARTBEAT secondi. Il lock impedisce che un aggiornamento
+# sovrascriva il manifest appena completato
+_active: Dict[str, str] = {}
+_active_lock = threading.Lock()
+_heartbeat = None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analysis')
+        return _executor
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(Config.PROGRESSIVE_HEARTBEAT)
+        with _active_lock:
+            for analysis_id, user_id in list(_active.items()):
+                try:
+                    touch_manifest(user_id, analysis_id)
+                except OSError as e:
+                    print(f"Errore nell'aggiornamento del manifest dell'analisi: {e}")
+
+
+def is_enabled(total_bytes: int) -> bool:
+    """Anteprima progressiva per upload di almeno PROGRESSIVE_MIN_BYTES (0 = disattivata)"""
+    return Config.PROGRESSIVE_MIN_BYTES > 0 and total_bytes >= Config.PROGRESSIVE_MIN_BYTES
+
+
+def build_preview(upload_ids: List[str]) -> Optional[Dict[str, Any]]:
+    """Stima dei risultati da un campione di ogni file, con margine di errore al 95%.
+
+    Restituisce None se il campione non basta (es. colonna mancante): in quel caso si fa
+    l'analisi completa, che riporta l'errore.
+    """
+    from services.csv_analysis import sample_csv
+
+    storage = get_storage()
+    estimates: Dict[str, List[float]] = {}
+    names: Dict[str, Tuple[int, str]] = {}
+    total_rows = sampled_rows = 0.0
+    sampled_bytes = data_bytes = 0
+    with stage('sample'):
+        for upload_id in upload_ids:
+            path = storage.local_path(upload_key(upload_id))
+            if path is None:
+                return None
+            sample = sample_csv(path, Config.PROGRESSIVE_SAMPLE_BYTES)
+            if 'error' in sample or not sample['sampled_bytes']:
+                return None
+
+            # Righe stimate del file e peso di ogni riga del campione
+            rows = sample['total_rows']
+            file_rows = rows * sample['data_bytes'] / sample['sampled_bytes']
+            total_rows += file_rows
+            sampled_rows += rows
+            sampled_bytes += sample['sampled_bytes']
+            data_bytes += sample['data_bytes']
+            for item in sample['results_df']:
+                share = item['numero_lead'] / rows
+                # Stima e varianza (proporzione binomiale) delle lead dell'inserzione nel file
+                estimate = estimates.setdefault(item['utm_term'], [0.0, 0.0, 0])
+                estimate[0] += share * file_rows
+                estimate[1] += file_rows ** 2 * share * (1 - share) / rows
+                estimate[2] += item['numero_lead']
+                if item['numero_lead'] > names.get(item['utm_term'], (0, ''))[0]:
+                    names[item['utm_term']] = (item['numero_lead'], item['nome_inserzione'])
+
+    ranked = sorted(estimates.items(), key=lambda item: item[1][0], reverse=True)
+    return {
+        'rows': [{
+            'utm_term': utm_term,
+            'nome_inserzione': names[utm_term][1],
+            'lead_stimati': round(estimate),
+            'margine': round(Z_95 * math.sqrt(variance)),
+            'lead_campione': count
+        } for utm_term, (estimate, variance, count) in ranked[:PREVIEW_TOP]],
+        'total_rows': round(total_rows),
+        'sampled_rows': int(sampled_rows),
+        'sampled_percent': round(100 * sampled_bytes / data_bytes, 1) if data_bytes else 100.0,
+        'unique_ads': len(estimates)
+    }
+
+
+def start_full_analysis(user_id: str, analysis_id: str, upload_ids: List[str], names: List[str]):
+    """Avvia in background l'analisi completa; al termine il manifest dell'analisi viene completato"""
+    def run():
+        from services.analysis_cache import analysis_cache
+
+        try:
+            results = analysis_cache.get(upload_ids, names)
+        except Exception as e:
+            results = {'error': f'Errore nel processare il file: {str(e)}'}
+        with _active_lock:
+            _active.pop(analysis_id, None)
+            complete_manifest(user_id, analysis_id, results)
+        registry.inc('progressive_analyses_total', result='error' if 'error' in results else 'ok')
+
+    global _heartbeat
+    with _active_lock:
+        _active[analysis_id] = user_id
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_heartbeat_loop, name='analysis-heartbeat', daemon=True)
+            _heartbeat.start()
+    _get_executor().submit(run)
+
+
+def shutdown():
+    """Attende le analisi in background in corso (all'uscita di un worker)"""
+    with _executor_lock:
+        executor = _executor
+    if executor is not None:
+        executor.shutdown(wait=True)
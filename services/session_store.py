@@ -0,0 +1,194 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Sessione salvata sul server: il cookie contiene solo l'id (firmato)"""
+
+    def __init__(self, initial=None, sid: Optional[str] = None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.new = sid is None
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.modified = False
+        self.accessed = False
+        # Sessione svuotata nella richiesta (logout, nuovo login): riceve un nuovo id
+        self.cleared = False
+
+    def clear(self):
+        super().clear()
+        self.cleared = True
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class MemorySessionBackend:
+    """Sessioni in memoria del processo, al massimo max_entries (le meno recenti vengono scartate)"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry[1]
+
+    def save(self, sid: str, data: str, expires: float):
+        with self._lock:
+            self._entries[sid] = (expires, data)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class SqliteSessionBackend:
+    """Sessioni in un file SQLite, condiviso dai processi della stessa macchina (worker gunicorn)"""
+
+    # Ogni quante scritture si eliminano le sessioni scadute
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Una connessione per thread e per processo: l'app viene importata nel master di gunicorn
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS sessions '
+                               '(id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def load(self, sid: str) -> Optional[str]:
+        row = self._connection().execute('SELECT data FROM sessions WHERE id = ? AND expires >= ?',
+                                         (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid: str, data: str, expires: float):
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)',
+                           (sid, data, expires))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            connection.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),))
+
+    def delete(self, sid: str):
+        self._connection().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+
+class ServerSessionInterface(SessionInterface):
+    """Sessioni Flask salvate in un backend (memoria o SQLite) invece che nel cookie.
+
+    Il contenuto viene scritto solo se modificato nella richiesta, e il cookie solo quando
+    la sessione riceve un nuovo id. Un id sconosciuto o scaduto non viene riutilizzato.
+    """
+
+    serializer = session_json_serializer
+    salt = 'server-session'
+
+    def __init__(self, backend, lifetime: float):
+        self.backend = backend
+        self.lifetime = lifetime
+
+    def _signer(self, app) -> Optional[Signer]:
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        signer = self._signer(app)
+        if signer is None:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            data = self.backend.load(sid) if sid else None
+            if data is not None:
+                try:
+                    return ServerSession(self.serializer.loads(data), sid=sid)
+                except ValueError:
+                    self.backend.delete(sid)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.cleared and not session.new:
+            # Logout o nuovo login: il vecchio id non è più valido
+            self.backend.delete(session.sid)
+            if session:
+                session.sid, session.new = secrets.token_urlsafe(32), True
+
+        if not session:
+            if not session.new:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        if not session.modified and not session.new:
+            return
+        self.backend.save(session.sid, self.serializer.dumps(dict(session)), time.time() + self.lifetime)
+        if session.new:
+            cookie = self._signer(app).sign(session.sid.encode('ascii')).decode('ascii')
+            response.set_cookie(name, cookie, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def create_session_interface(backend: str, lifetime: float, sqlite_path: str = '',
+                             max_entries: int = 10000) -> Optional[ServerSessionInterface]:
+    """Interfaccia delle sessioni per SESSION_BACKEND ('cookie' = sessioni standard di Flask, None)"""
+    if backend == 'memory':
+        return ServerSessionInterface(MemorySessionBackend(max_entries), lifetime)
+    if backend == 'sqlite':
+        return ServerSessionInterface(SqliteSessionBackend(sqlite_path), lifetime)
+    return None
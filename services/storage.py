@@ -0,0 +1,310 @@
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import BinaryIO, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+
+from config import Config
+
+CHUNK_SIZE = 1024 * 1024
+
+# (chiave, dimensione in byte, ultima modifica come timestamp)
+StoredObject = Tuple[str, int, float]
+
+UPLOADS_PREFIX = 'uploads/'
+ANALYSES_PREFIX = 'analyses/'
+
+
+def upload_key(upload_id: str) -> str:
+    """Chiave del CSV caricato, indirizzato per contenuto (sha256)"""
+    return f'{UPLOADS_PREFIX}{upload_id}.csv'
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LocalStorage:
+    """Artefatti in una cartella locale (o in un volume condiviso tra le istanze)"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self._ready = False
+
+    def _path(self, key: str) -> str:
+        if not self._ready:
+            try:
+                os.makedirs(self.root, exist_ok=True)
+            except OSError:
+                # Su Vercel il filesystem dell'app è in sola lettura: si usa la cartella temporanea
+                self.root = os.path.join(tempfile.gettempdir(), 'utm-storage')
+                os.makedirs(self.root, exist_ok=True)
+            self._ready = True
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Percorso locale leggibile dell'oggetto, o None se non esiste"""
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def put_file(self, key: str, path: str, move: bool = False):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        if move:
+            shutil.move(path, tmp_path)
+        else:
+            shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, target)
+
+    def put_bytes(self, key: str, data: bytes):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def touch(self, key: str):
+        """Aggiorna la data di ultimo utilizzo (per l'eliminazione dei meno usati)"""
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str) -> List[StoredObject]:
+        """Oggetti con chiave che inizia per prefix, anche nelle sottocartelle (come S3)"""
+        base = prefix.rstrip('/')
+        folder = self._path(base)
+        objects = []
+        for dirpath, _, filenames in os.walk(folder):
+            relative = os.path.relpath(dirpath, folder).replace(os.sep, '/')
+            for name in filenames:
+                if name.endswith('.tmp'):
+                    continue
+                stat = os.stat(os.path.join(dirpath, name))
+                key = f'{base}/{name}' if relative == '.' else f'{base}/{relative}/{name}'
+                objects.append((key, stat.st_size, stat.st_mtime))
+        return objects
+
+
+class S3Storage:
+    """Artefatti su un object storage compatibile S3 (AWS, MinIO, R2, ...), con firma SigV4.
+
+    Gli oggetti letti vengono copiati in una cache locale: sono indirizzati per
+    contenuto, quindi la copia locale non diventa mai obsoleta.
+    """
+
+    def __init__(self, endpoint_url: str, bucket: str, access_key: str, secret_key: str,
+                 region: str = 'us-east-1', prefix: str = '', cache_dir: Optional[str] = None,
+                 timeout: float = 30):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.cache = LocalStorage(cache_dir or os.path.join(tempfile.gettempdir(), 'utm-storage-cache'))
+        self.timeout = timeout
+
+    def _sign(self, method: str, path: str, query: str, payload_hash: str,
+              extra_headers: Optional[dict] = None) -> dict:
+        """Header di autenticazione AWS Signature Version 4 (gli header x-amz-* aggiuntivi sono firmati)"""
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = f"{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request"
+        headers = {
+            'host': urlparse(self.endpoint_url).netloc,
+            'x-amz-content-sha256': payload_hash,
+            'x-amz-date': amz_date,
+            **(extra_headers or {})
+        }
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([
+            method, path, query,
+            ''.join(f'{name}:{headers[name]}\n' for name in sorted(headers)),
+            signed_headers, payload_hash
+        ])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        key = f'AWS4{self.secret_key}'.encode('utf-8')
+        for part in scope.split('/'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (f'AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, '
+                                    f'SignedHeaders={signed_headers}, Signature={signature}')
+        del headers['host']
+        return headers
+
+    def _request(self, method: str, key: str = '', params: Optional[dict] = None, data=None,
+                 payload_hash: Optional[str] = None, stream: bool = False, headers: Optional[dict] = None):
+        import requests
+
+        path = quote(f'/{self.bucket}/{self.prefix}{key}' if key else f'/{self.bucket}', safe='/-_.~')
+        query = '&'.join(f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}"
+                         for k, v in sorted((params or {}).items()))
+        if payload_hash is None:
+            payload_hash = hashlib.sha256(data or b'').hexdigest()
+        url = f'{self.endpoint_url}{path}' + (f'?{query}' if query else '')
+        return requests.request(method, url, data=data, stream=stream, timeout=self.timeout,
+                                headers=self._sign(method, path, query, payload_hash, headers))
+
+    @staticmethod
+    def _check(response, key: str):
+        if response.status_code >= 300:
+            raise OSError(f"Object storage: {response.status_code} per '{key}': {response.text[:200]}")
+
+    def exists(self, key: str) -> bool:
+        if self.cache.exists(key):
+            return True
+        response = self._request('HEAD', key)
+        if response.status_code == 404:
+            return False
+        self._check(response, key)
+        return True
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Percorso locale dell'oggetto, scaricandolo nella cache se necessario"""
+        path = self.cache.local_path(key)
+        if path is not None:
+            return path
+        response = self._request('GET', key, stream=True)
+        if response.status_code == 404:
+            return None
+        self._check(response, key)
+        target = self.cache._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, target)
+        return target
+
+    def put_file(self, key: str, path: str, move: bool = False):
+        with open(path, 'rb') as f:
+            self._upload(key, f, file_sha256(path))
+        # Il file caricato resta nella cache locale, pronto per l'analisi
+        self.cache.put_file(key, path, move=move)
+
+    def _upload(self, key: str, data, payload_hash: str):
+        response = self._request('PUT', key, data=data, payload_hash=payload_hash)
+        self._check(response, key)
+
+    def put_bytes(self, key: str, data: bytes):
+        self._upload(key, data, hashlib.sha256(data).hexdigest())
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        response = self._request('GET', key)
+        if response.status_code == 404:
+            return None
+        self._check(response, key)
+        return response.content
+
+    def touch(self, key: str):
+        """Aggiorna la data di ultima modifica copiando l'oggetto su se stesso (lato server,
+        senza trasferirne il contenuto): la politica di conservazione la usa come ultimo utilizzo"""
+        source = quote(f'/{self.bucket}/{self.prefix}{key}', safe='/-_.~')
+        response = self._request('PUT', key, headers={'x-amz-copy-source': source,
+                                                      'x-amz-metadata-directive': 'REPLACE'})
+        if response.status_code != 404:
+            self._check(response, key)
+        self.cache.touch(key)
+
+    def delete(self, key: str):
+        response = self._request('DELETE', key)
+        if response.status_code != 404:
+            self._check(response, key)
+        self.cache.delete(key)
+
+    def list(self, prefix: str) -> List[StoredObject]:
+        import xml.etree.ElementTree as ET
+
+        objects = []
+        params = {'list-type': '2', 'prefix': f'{self.prefix}{prefix}'}
+        while True:
+            response = self._request('GET', params=params)
+            self._check(response, prefix)
+            root = ET.fromstring(response.content)
+            ns = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+            for item in root.iter(f'{ns}Contents'):
+                key = item.findtext(f'{ns}Key')[len(self.prefix):]
+                modified = item.findtext(f'{ns}LastModified').replace('Z', '+00:00')
+                objects.append((key, int(item.findtext(f'{ns}Size')),
+                                datetime.fromisoformat(modified).timestamp()))
+            token = root.findtext(f'{ns}NextContinuationToken')
+            if root.findtext(f'{ns}IsTruncated') != 'true' or not token:
+                return objects
+            params['continuation-token'] = token
+
+
+def save_upload(storage, stream: BinaryIO, work_dir: str) -> Tuple[str, int]:
+    """Salva un file caricato nello storage indirizzandolo per contenuto; restituisce (sha256, byte).
+
+    Se lo stesso contenuto è già presente non viene caricato di nuovo.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(suffix='.csv.tmp', dir=work_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        upload_id = digest.hexdigest()
+        if storage.exists(upload_key(upload_id)):
+            # Rinnova la data: la politica di conservazione conta dall'ultimo caricamento
+            storage.touch(upload_key(upload_id))
+        else:
+            storage.put_file(upload_key(upload_id), tmp_path, move=True)
+        return upload_id, size
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Backend configurato (STORAGE_BACKEND=local|s3), creato al primo utilizzo"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if Config.STORAGE_BACKEND == 's3':
+                _storage = S3Storage(
+                    Config.S3_ENDPOINT_URL, Config.S3_BUCKET, Config.S3_ACCESS_KEY_ID,
+                    Config.S3_SECRET_ACCESS_KEY, region=Config.S3_REGION, prefix=Config.S3_PREFIX,
+                    cache_dir=Config.STORAGE_CACHE_DIR or None
+                )
+            else:
+                _storage = LocalStorage(Config.STORAGE_DIR)
+        return _storage
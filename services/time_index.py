@@ -0,0 +1,138 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from calendar import timegm
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Formati accettati per la colonna Data degli export CRM
+DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%y')
+
+_date_cache: Dict[str, Optional[int]] = {}
+
+
+def _parse_date(data: str) -> Optional[int]:
+    """Converte la data in secondi dall'epoca (mezzanotte UTC), con cache per stringa"""
+    if data in _date_cache:
+        return _date_cache[data]
+
+    parsed = None
+    for fmt in DATE_FORMATS:
+        try:
+            parsed = timegm(datetime.strptime(data, fmt).timetuple())
+            break
+        except ValueError:
+            continue
+
+    # Gli export contengono poche date distinte: la cache resta piccola
+    if len(_date_cache) < 100000:
+        _date_cache[data] = parsed
+    return parsed
+
+
+def _parse_time(ora: str) -> int:
+    """Converte l'ora (HH:MM o HH:MM:SS) in secondi dalla mezzanotte"""
+    parts = ora.split(':')
+    try:
+        hours = int(parts[0])
+        minutes = int(parts[1]) if len(parts) > 1 else 0
+        seconds = int(parts[2]) if len(parts) > 2 else 0
+    except ValueError:
+        return 0
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_timestamp(data, ora) -> Optional[int]:
+    """Restituisce il timestamp intero di Data+Ora, o None se la data non è valida"""
+    if not data:
+        return None
+    day = _parse_date(str(data).strip())
+    if day is None:
+        return None
+    return day + (_parse_time(str(ora).strip()) if ora else 0)
+
+
+def parse_date_param(value: str, end_of_day: bool = False) -> Optional[int]:
+    """Converte un parametro YYYY-MM-DD in timestamp (fine giornata se end_of_day)"""
+    if not value:
+        return None
+    day = timegm(datetime.strptime(value, '%Y-%m-%d').timetuple())
+    return day + 86399 if end_of_day else day
+
+
+def format_timestamp(ts: Optional[int]) -> str:
+    """Formatta un timestamp come YYYY-MM-DD (per i campi date del form)"""
+    if ts is None:
+        return ''
+    return datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
+
+
+class TimeIndex:
+    """Indice ordinato per tempo dei lead di un'analisi, per filtri per intervallo di date"""
+
+    def __init__(self, detailed: List[Dict[str, Any]], row_timestamps: array):
+        keyed = []
+        for item in detailed:
+            ts = parse_timestamp(item.get('data', ''), item.get('ora', ''))
+            if ts is not None:
+                keyed.append((ts, item))
+        # sort stabile: a parità di timestamp resta l'ordine del file
+        keyed.sort(key=lambda pair: pair[0])
+
+        self.timestamps = array('q', (ts for ts, _ in keyed))
+        self.leads = [item for _, item in keyed]
+        self.row_timestamps = array('q', sorted(row_timestamps))
+
+    def bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        """Primo e ultimo timestamp indicizzati"""
+        if not self.timestamps:
+            return None, None
+        return self.timestamps[0], self.timestamps[-1]
+
+    def _range(self, values: array, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        lo = bisect_left(values, start) if start is not None else 0
+        hi = bisect_right(values, end) if end is not None else len(values)
+        return lo, max(lo, hi)
+
+    def filter(self, start: Optional[int], end: Optional[int]) -> Dict[str, Any]:
+        """Ricalcola i risultati sui soli lead compresi tra start ed end (inclusi)"""
+        # csv_analysis importa questo modulo: import al primo utilizzo
+        from services.csv_analysis import add_to_cube
+
+        lo, hi = self._range(self.timestamps, start, end)
+        row_lo, row_hi = self._range(self.row_timestamps, start, end)
+        leads = self.leads[lo:hi]
+
+        utm_term_counts = Counter(item['utm_term'] for item in leads)
+        content_counts = Counter(
+            (item['utm_term'], item['utm_content']) for item in leads if item['utm_content']
+        )
+
+        # utm_content più frequente per ogni utm_term, come in process_csv
+        utm_mapping = {}
+        for (utm_term, utm_content), _ in content_counts.most_common():
+            utm_mapping.setdefault(utm_term, utm_content)
+
+        # Cubo campagna -> contenuto -> termine dei soli lead dell'intervallo, per il drill-down
+        cube = {}
+        for (utm_campaign, utm_content, utm_term), count in Counter(
+                (item['utm_campaign'], item['utm_content'], item['utm_term']) for item in leads).items():
+            add_to_cube(cube, utm_campaign, utm_content, utm_term, count)
+
+        results_data = []
+        for utm_term, count in utm_term_counts.items():
+            results_data.append({
+                'utm_term': utm_term,
+                'nome_inserzione': utm_mapping.get(utm_term, utm_term),
+                'numero_lead': count
+            })
+
+        return {
+            'results_df': results_data,
+            'detailed_df': [dict(item, nome_inserzione=utm_mapping.get(item['utm_term'], item['utm_term']))
+                            for item in leads],
+            'total_rows': row_hi - row_lo,
+            'rows_with_utm_term': len(leads),
+            'unique_ads': len(utm_term_counts),
+            'cube': cube
+        }
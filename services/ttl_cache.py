@@ -0,0 +1,85 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from services.metrics import record_cache
+
+# Valore restituito da get() per una chiave assente o scaduta (None è un valore valido)
+MISSING = object()
+# Contatori di versione condivisi tra i processi (le chiavi si distribuiscono sugli slot)
+SHARED_SLOTS = 4096
+
+
+class TTLCache:
+    """Cache in memoria con scadenza: le voci valgono ttl secondi, al massimo max_entries (LRU).
+
+    Con shared=True ogni chiave ha un contatore di versione in memoria condivisa: se la cache è
+    creata prima del fork (gunicorn con preload_app), invalidate() in un processo rende scadute
+    le copie della chiave negli altri processi.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024, name: Optional[str] = None, shared: bool = False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.name = name
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._versions = None
+        if shared:
+            try:
+                import multiprocessing
+                self._versions = multiprocessing.RawArray('Q', SHARED_SLOTS)
+                self._versions_lock = multiprocessing.Lock()
+            except (ImportError, OSError) as e:
+                # Es. ambienti serverless senza /dev/shm: un solo processo, basta la cache locale
+                print(f"Versioni condivise della cache {name} non disponibili: {e}")
+                self._versions = None
+
+    @staticmethod
+    def _slot(key: Hashable) -> int:
+        # hash() di una stringa cambia tra processi non derivati dallo stesso fork: crc32 no
+        return zlib.crc32(repr(key).encode('utf-8')) % SHARED_SLOTS
+
+    def version(self, key: Hashable) -> int:
+        """Versione attuale della chiave (0 senza cache condivisa): si legge prima di una
+        lettura dalla sorgente e si passa a set(), che scarta il valore se nel frattempo
+        la chiave è stata invalidata"""
+        return self._versions[self._slot(key)] if self._versions is not None else 0
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] < time.monotonic() or entry[2] != self.version(key)):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if self.name:
+            record_cache(self.name, entry is not None)
+        return MISSING if entry is None else entry[1]
+
+    def set(self, key: Hashable, value: Any, version: Optional[int] = None):
+        if self.ttl <= 0:
+            return
+        current = self.version(key)
+        if version is not None and version != current:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value, current)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self, key: Hashable):
+        """Elimina la chiave qui e, con la cache condivisa, negli altri processi"""
+        if self._versions is not None:
+            slot = self._slot(key)
+            with self._versions_lock:
+                self._versions[slot] += 1
+        self.delete(key)
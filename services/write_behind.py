@@ -0,0 +1,114 @@
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from services.metrics import registry
+
+registry.gauge('write_behind_pending', 'Aggiornamenti in attesa di essere scritti, per coda')
+registry.counter('write_behind_flushed_total', 'Record scritti dalle code write-behind, per coda ed esito')
+
+# Tentativi di scrittura di un aggiornamento prima di scartarlo
+MAX_ATTEMPTS = 3
+
+
+class WriteBehindQueue:
+    """Coda write-behind: gli aggiornamenti della stessa chiave si uniscono e vengono scritti
+    in background a gruppi di batch_size, al massimo dopo interval secondi.
+
+    write_batch riceve {chiave: campi} e solleva un'eccezione se la scrittura fallisce;
+    in quel caso gli aggiornamenti restano in coda, insieme a quelli arrivati nel frattempo.
+    """
+
+    def __init__(self, name: str, write_batch: Callable[[Dict[str, Dict[str, Any]]], Any],
+                 interval: float = 2.0, batch_size: int = 10,
+                 on_discard: Optional[Callable[[str], None]] = None):
+        self.name = name
+        self.write_batch = write_batch
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_discard = on_discard
+        # {chiave: [campi, tentativi falliti]}
+        self._pending: Dict[str, List] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def submit(self, key: str, fields: Dict[str, Any]):
+        """Accoda un aggiornamento; i campi si aggiungono a quelli già in attesa per la chiave"""
+        with self._lock:
+            entry = self._pending.setdefault(key, [{}, 0])
+            entry[0].update(fields)
+            pending = len(self._pending)
+            # Il thread parte al primo aggiornamento, quindi nei worker e non nel master di gunicorn
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True)
+                self._thread.start()
+        registry.set('write_behind_pending', pending, queue=self.name)
+        if pending >= self.batch_size or self._closed:
+            self._wakeup.set()
+
+    def pending(self, key: str) -> Optional[Dict[str, Any]]:
+        """Campi in attesa di scrittura per la chiave"""
+        with self._lock:
+            entry = self._pending.get(key)
+            return dict(entry[0]) if entry else None
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Scrive subito tutti gli aggiornamenti in attesa.
+
+        Gli aggiornamenti restano in coda (e visibili a pending) finché il loro gruppo non è
+        stato scritto: chi legge nel frattempo non vede i dati vecchi della sorgente.
+        """
+        with self._flush_lock:
+            with self._lock:
+                taken = {key: dict(entry[0]) for key, entry in self._pending.items()}
+            keys = list(taken)
+            for start in range(0, len(keys), self.batch_size):
+                batch = {key: taken[key] for key in keys[start:start + self.batch_size]}
+                try:
+                    self.write_batch(batch)
+                    registry.inc('write_behind_flushed_total', len(batch), queue=self.name, result='ok')
+                    self._done(batch)
+                except Exception as e:
+                    print(f"Errore nella scrittura della coda {self.name}: {e}")
+                    registry.inc('write_behind_flushed_total', len(batch), queue=self.name, result='error')
+                    self._failed(batch)
+            with self._lock:
+                pending = len(self._pending)
+            registry.set('write_behind_pending', pending, queue=self.name)
+
+    def _done(self, batch: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            for key, fields in batch.items():
+                entry = self._pending.get(key)
+                # Se nel frattempo sono arrivati altri campi la chiave resta in coda
+                if entry is not None and entry[0] == fields:
+                    del self._pending[key]
+
+    def _failed(self, batch: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            for key in batch:
+                entry = self._pending.get(key)
+                if entry is None:
+                    continue
+                entry[1] += 1
+                if entry[1] >= MAX_ATTEMPTS:
+                    print(f"Aggiornamento di {key} scartato dopo {MAX_ATTEMPTS} tentativi ({self.name})")
+                    del self._pending[key]
+                    if self.on_discard is not None:
+                        self.on_discard(key)
+
+    def close(self):
+        """Ferma il thread e scrive gli aggiornamenti rimasti (all'uscita del processo)"""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
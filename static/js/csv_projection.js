@@ -0,0 +1,140 @@
+// Web Worker: riduce un CSV di lead alle sole colonne lette dal server prima dell'upload.
+// Riceve {file, columns, onlyUtm} e risponde con messaggi {type: 'progress' | 'done' | 'error'}.
+// Il file viene letto a blocchi, quindi anche gli export più grandi non restano interi in memoria.
+
+const REQUIRED_COLUMN = 'SORGENTE';
+// Dimensione dei pezzi di output uniti nel Blob finale
+const OUTPUT_CHUNK = 1024 * 1024;
+
+function csvField(value) {
+    if (/[",\r\n]/.test(value)) {
+        return '"' + value.replace(/"/g, '""') + '"';
+    }
+    return value;
+}
+
+// Parser CSV incrementale (RFC 4180: virgolette, "" e a capo dentro i campi)
+class CsvParser {
+    constructor(onRow) {
+        this.onRow = onRow;
+        this.row = [];
+        this.field = '';
+        this.quoted = false;
+        this.afterQuote = false;
+        this.skipLf = false;
+    }
+
+    push(text) {
+        let field = this.field;
+        let start = 0;
+        for (let i = 0; i < text.length; i++) {
+            const c = text.charCodeAt(i);
+            if (this.skipLf) {
+                this.skipLf = false;
+                if (c === 10) { start = i + 1; continue; }
+            }
+            if (this.quoted) {
+                if (c === 34) {  // "
+                    field += text.slice(start, i);
+                    start = i + 1;
+                    this.quoted = false;
+                    this.afterQuote = true;
+                }
+                continue;
+            }
+            if (c === 34) {
+                // "" dentro un campo tra virgolette oppure apertura delle virgolette
+                field += text.slice(start, i);
+                if (this.afterQuote) field += '"';
+                start = i + 1;
+                this.quoted = true;
+                this.afterQuote = false;
+            } else if (c === 44) {  // ,
+                this.row.push(field + text.slice(start, i));
+                field = '';
+                start = i + 1;
+                this.afterQuote = false;
+            } else if (c === 10 || c === 13) {
+                this.row.push(field + text.slice(start, i));
+                field = '';
+                start = i + 1;
+                this.afterQuote = false;
+                this.skipLf = c === 13;
+                this.onRow(this.row);
+                this.row = [];
+            } else {
+                this.afterQuote = false;
+            }
+        }
+        this.field = field + text.slice(start);
+    }
+
+    end() {
+        if (this.field !== '' || this.row.length) {
+            this.row.push(this.field);
+            this.onRow(this.row);
+        }
+        this.row = [];
+        this.field = '';
+    }
+}
+
+async function project(file, columns, onlyUtm) {
+    let indexes = null;
+    let sourceIndex = -1;
+    let rows = 0;
+    let keptRows = 0;
+    let pending = '';
+    const parts = [];
+
+    const parser = new CsvParser((row) => {
+        if (indexes === null) {
+            indexes = columns.map((name) => row.indexOf(name));
+            sourceIndex = row.indexOf(REQUIRED_COLUMN);
+            if (sourceIndex < 0) throw new Error('missing-column');
+            pending += columns.filter((name, i) => indexes[i] >= 0).map(csvField).join(',') + '\r\n';
+            return;
+        }
+        if (row.length === 1 && row[0] === '') return;  // riga vuota
+        rows++;
+        if (onlyUtm && (row[sourceIndex] || '').indexOf('utm_term=') < 0) return;
+        keptRows++;
+        const values = [];
+        for (const index of indexes) {
+            if (index >= 0) values.push(csvField(row[index] || ''));
+        }
+        pending += values.join(',') + '\r\n';
+        if (pending.length >= OUTPUT_CHUNK) {
+            parts.push(pending);
+            pending = '';
+        }
+    });
+
+    const reader = file.stream().getReader();
+    const decoder = new TextDecoder('utf-8');
+    let loaded = 0;
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        loaded += value.length;
+        parser.push(decoder.decode(value, { stream: true }));
+        self.postMessage({ type: 'progress', loaded: loaded, total: file.size });
+    }
+    parser.push(decoder.decode());
+    parser.end();
+    if (indexes === null) throw new Error('missing-column');
+    parts.push(pending);
+
+    const blob = new Blob(parts, { type: 'text/csv' });
+    return { blob: blob, rows: rows, keptRows: keptRows };
+}
+
+self.onmessage = async (event) => {
+    const { file, columns, onlyUtm } = event.data;
+    try {
+        const result = await project(file, columns, onlyUtm);
+        self.postMessage({ type: 'done', ...result });
+    } catch (error) {
+        self.postMessage({ type: 'error', message: String(error && error.message || error) });
+    }
+};